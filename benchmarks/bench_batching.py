@@ -0,0 +1,74 @@
+"""
+Compare the per-file conversion loop with cross-document page batching.
+
+    TORCH_DEVICE=cpu python benchmarks/bench_batching.py --corpus input --repeat 25
+"""
+import argparse
+from common import Timer, load_corpus, peak_rss_mb, print_table
+from marker.convert import convert_single_pdf
+from marker.models import load_all_models
+from marker_api.batching import convert_documents_batched, plan_page_batches
+from marker_api.pages import get_page_count
+
+
+def run_per_file(documents, model_list, batch_multiplier):
+    for _, content, _ in documents:
+        convert_single_pdf(content, model_list, batch_multiplier=batch_multiplier)
+
+
+def run_batched(documents, model_list, page_budget, batch_multiplier):
+    page_counts = [(doc_id, get_page_count(content)) for doc_id, content, _ in documents]
+    by_id = {document[0]: document for document in documents}
+    for group_ids in plan_page_batches(page_counts, page_budget):
+        convert_documents_batched(
+            [by_id[doc_id] for doc_id in group_ids], model_list, batch_multiplier
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cross-document page batching.")
+    parser.add_argument("--corpus", nargs="+", default=None, help="PDF files or folders")
+    parser.add_argument("--repeat", type=int, default=10, help="Copies of each document")
+    parser.add_argument(
+        "--budgets", type=int, nargs="+", default=[16, 32, 64], help="Page budgets to try"
+    )
+    parser.add_argument("--batch_multiplier", type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, repeat=args.repeat)
+    documents = [(i, content, {}) for i, (_, content) in enumerate(corpus)]
+    total_pages = sum(get_page_count(content) for _, content, _ in documents)
+    print(f"Loaded {len(documents)} documents with {total_pages} pages")
+
+    model_list = load_all_models()
+    # Warm up the models so the first measurement does not pay for it
+    run_per_file(documents[:1], model_list, args.batch_multiplier)
+
+    rows = []
+    with Timer() as timer:
+        run_per_file(documents, model_list, args.batch_multiplier)
+    rows.append(
+        {
+            "mode": "per-file loop",
+            "seconds": round(timer.elapsed, 2),
+            "pages/sec": round(total_pages / timer.elapsed, 3),
+        }
+    )
+
+    for budget in args.budgets:
+        with Timer() as timer:
+            run_batched(documents, model_list, budget, args.batch_multiplier)
+        rows.append(
+            {
+                "mode": f"batched (budget {budget})",
+                "seconds": round(timer.elapsed, 2),
+                "pages/sec": round(total_pages / timer.elapsed, 3),
+            }
+        )
+
+    print_table(rows, ["mode", "seconds", "pages/sec"])
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare full conversions with the digital-text fast path.
+
+    TORCH_DEVICE=cpu python benchmarks/bench_fastpath.py --corpus input examples/data
+
+Every document is converted in full, auto and text mode. Parity is the
+similarity of the markdown of a mode to the full conversion (100 = identical).
+"""
+import os
+import argparse
+import tempfile
+from rapidfuzz import fuzz
+from common import Timer, load_corpus, peak_rss_mb, print_table
+from marker.models import load_all_models
+from marker_api.fastpath import TEXT_PAGE, convert_pdf
+from marker_api.pages import get_page_count
+
+MODES = ["full", "auto", "text"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the digital-text fast path.")
+    parser.add_argument("--corpus", nargs="+", default=None, help="PDF files or folders")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    args = parser.parse_args()
+
+    model_list = load_all_models()
+    documents = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # pdftext reads from paths, like the spooled uploads of the server
+        for name, content in load_corpus(args.corpus):
+            path = os.path.join(workdir, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            documents.append((name, path, get_page_count(path)))
+        total_pages = sum(pages for _, _, pages in documents)
+        print(f"Loaded {len(documents)} documents with {total_pages} pages")
+
+        # Warm up the models so the first measurement does not pay for it
+        convert_pdf(documents[0][1], model_list, "full", max_pages=1)
+
+        outputs = {}
+        rows = []
+        for mode in args.modes:
+            text_pages = 0
+            outputs[mode] = {}
+            with Timer() as timer:
+                for name, path, _ in documents:
+                    markdown, _, metadata = convert_pdf(path, model_list, mode)
+                    outputs[mode][name] = markdown
+                    page_modes = metadata.get("page_modes") or []
+                    text_pages += page_modes.count(TEXT_PAGE)
+            rows.append(
+                {
+                    "mode": mode,
+                    "seconds": round(timer.elapsed, 2),
+                    "pages/sec": round(total_pages / timer.elapsed, 3),
+                    "text pages": f"{text_pages}/{total_pages}",
+                }
+            )
+
+    if "full" in outputs:
+        for row in rows:
+            scores = [
+                fuzz.ratio(outputs["full"][name], outputs[row["mode"]][name])
+                for name, _, _ in documents
+            ]
+            row["parity"] = round(sum(scores) / len(scores), 1)
+        print("Parity per document:")
+        for name, _, pages in documents:
+            cells = [
+                f"{mode} {fuzz.ratio(outputs['full'][name], outputs[mode][name]):.1f}"
+                for mode in args.modes
+                if mode != "full"
+            ]
+            print(f"  {name} ({pages} pages): {', '.join(cells)}")
+
+    print_table(rows, ["mode", "seconds", "pages/sec", "text pages", "parity"])
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
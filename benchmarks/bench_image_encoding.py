@@ -0,0 +1,122 @@
+"""
+Compare the old save/read/delete image loop with in-memory, parallel encoding.
+
+    python benchmarks/bench_image_encoding.py --corpus input/certificates.pdf
+
+By default the images are taken from the PDF with pypdfium2 (embedded images,
+or rendered pages for PDFs without any), so no models are needed. Pass
+--marker to benchmark the images marker extracts instead.
+"""
+import os
+import base64
+import argparse
+import tempfile
+import pypdfium2
+import pypdfium2.raw as pdfium_c
+from common import Timer, load_corpus, peak_rss_mb, print_table
+import marker_api.image_delivery as image_delivery
+
+
+def pdfium_images(content, dpi: int = 96):
+    doc = pypdfium2.PdfDocument(content)
+    images = {}
+    try:
+        for pnum, page in enumerate(doc):
+            objects = page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE])
+            for i, image_object in enumerate(objects):
+                images[f"{pnum}_image_{i}.png"] = image_object.get_bitmap().to_pil()
+        if not images:
+            for pnum, page in enumerate(doc):
+                images[f"{pnum}_image_0.png"] = page.render(scale=dpi / 72).to_pil()
+    finally:
+        doc.close()
+    return images
+
+
+def marker_images(content):
+    from marker.convert import convert_single_pdf
+    from marker.models import load_all_models
+
+    _, images, _ = convert_single_pdf(content, load_all_models())
+    return images
+
+
+def encode_via_disk(images):
+    """The loop parse_pdf_and_return_markdown used before."""
+    image_data = {}
+    for filename, image in images.items():
+        image.save(filename, "PNG")
+        with open(filename, "rb") as f:
+            image_bytes = f.read()
+        image_data[filename] = base64.b64encode(image_bytes).decode("utf-8")
+        os.remove(filename)
+    return image_data
+
+
+def encode_in_memory(images, workers, image_format="png", quality=None):
+    if image_delivery.IMAGE_ENCODE_WORKERS != workers:
+        if image_delivery._encode_pool is not None:
+            image_delivery._encode_pool.shutdown()
+        image_delivery.IMAGE_ENCODE_WORKERS = workers
+        image_delivery._encode_pool = None
+    return image_delivery.encode_images("", images, image_format, quality)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image encoding.")
+    parser.add_argument(
+        "--corpus", nargs="+", default=["input/certificates.pdf"], help="PDF files or folders"
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="Encodes of every document")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Pool sizes to try"
+    )
+    parser.add_argument("--marker", action="store_true", help="Use marker to extract images")
+    args = parser.parse_args()
+
+    documents = []
+    for name, content in load_corpus(args.corpus):
+        images = marker_images(content) if args.marker else pdfium_images(content)
+        documents.append((name, images))
+    total_images = sum(len(images) for _, images in documents) * args.rounds
+    print(f"Loaded {len(documents)} documents with {total_images // args.rounds} images")
+
+    runs = [("save/read/delete loop", encode_via_disk)]
+    for workers in args.workers:
+        runs.append(
+            (f"in memory, {workers} workers", lambda images, w=workers: encode_in_memory(images, w))
+        )
+    runs.append(
+        ("in memory, webp q80, 4 workers", lambda images: encode_in_memory(images, 4, "webp", 80))
+    )
+
+    rows = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The disk loop writes to the working directory, keep it out of the repo
+        os.chdir(workdir)
+        try:
+            for label, encode in runs:
+                encoded_bytes = 0
+                with Timer() as timer:
+                    for _ in range(args.rounds):
+                        for _, images in documents:
+                            encoded = encode(images)
+                            encoded_bytes += sum(len(data) for data in encoded.values())
+                rows.append(
+                    {
+                        "mode": label,
+                        "seconds": round(timer.elapsed, 3),
+                        "images/sec": round(total_images / timer.elapsed, 1),
+                        "base64 MB": round(encoded_bytes / args.rounds / 1024**2, 2),
+                    }
+                )
+        finally:
+            os.chdir(cwd)
+
+    print_table(rows, ["mode", "seconds", "images/sec", "base64 MB"])
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
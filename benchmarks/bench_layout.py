@@ -0,0 +1,124 @@
+"""
+Compare the CPU layouts of marker_api.topology with several workers.
+
+    TORCH_DEVICE=cpu python benchmarks/bench_layout.py --workers 4 --repeat 2
+
+For every layout, --workers processes are started with the environment the
+launcher would give them. Each loads the models and converts a warm-up page,
+then all of them convert their share of the corpus at the same time, like
+workers draining a queue. Throughput is the pages of all workers over the
+wall time from the common start to the last worker finishing.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from common import Timer, load_corpus, peak_rss_mb, print_table
+
+LAYOUTS = ["none", "shared", "pinned"]
+
+
+def child(documents: list):
+    """Convert the documents once the parent says go, print the results as JSON."""
+    from marker_api.topology import apply_layout
+
+    apply_layout()
+    from marker_api.fastpath import convert_pdf
+    from marker_api.models import load_models
+
+    model_list = load_models()
+    convert_pdf(documents[0], model_list, "full", max_pages=1)
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    pages = 0
+    with Timer() as timer:
+        for path in documents:
+            _, _, metadata = convert_pdf(path, model_list, "full")
+            pages += metadata.get("pages", 0)
+    print(
+        json.dumps(
+            {"pages": pages, "seconds": timer.elapsed, "peak RSS MB": peak_rss_mb()}
+        ),
+        flush=True,
+    )
+
+
+def run_layout(layout: str, workers: int, documents: list) -> dict:
+    from marker_api.topology import describe_layout, plan_layout, worker_env
+
+    slots = plan_layout(workers, layout)
+    print(describe_layout(layout, slots))
+    processes = []
+    for index, slot in enumerate(slots):
+        share = documents[index::workers]
+        if not share:
+            continue
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, __file__, "--child", *share],
+                env=dict(os.environ, **worker_env(slot)),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+        )
+    for process in processes:
+        if process.stdout.readline().strip() != "ready":
+            raise RuntimeError(f"Worker {process.pid} failed to start")
+
+    with Timer() as timer:
+        for process in processes:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        results = [json.loads(process.stdout.readline()) for process in processes]
+    for process in processes:
+        process.wait()
+
+    pages = sum(result["pages"] for result in results)
+    return {
+        "layout": layout,
+        "workers": len(processes),
+        "pages": pages,
+        "seconds": round(timer.elapsed, 2),
+        "pages/sec": round(pages / timer.elapsed, 3),
+        "slowest worker s": round(max(result["seconds"] for result in results), 2),
+        "peak RSS MB": round(sum(result["peak RSS MB"] for result in results)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CPU layouts of the workers.")
+    parser.add_argument("--corpus", nargs="+", default=None, help="PDF files or folders")
+    parser.add_argument("--repeat", type=int, default=1, help="Copies of every document")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes")
+    parser.add_argument("--layouts", nargs="+", default=LAYOUTS, choices=LAYOUTS)
+    parser.add_argument("--child", nargs="+", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        documents = []
+        for name, content in load_corpus(args.corpus, args.repeat):
+            path = os.path.join(workdir, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            documents.append(path)
+        print(f"Loaded {len(documents)} documents")
+        for layout in args.layouts:
+            rows.append(run_layout(layout, args.workers, documents))
+
+    print_table(
+        rows,
+        ["layout", "workers", "pages", "seconds", "pages/sec", "slowest worker s", "peak RSS MB"],
+    )
+
+
+if __name__ == "__main__":
+    main()
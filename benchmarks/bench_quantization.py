@@ -0,0 +1,116 @@
+"""
+Compare the CPU inference profiles against fp32.
+
+    TORCH_DEVICE=cpu python benchmarks/bench_quantization.py --corpus input
+
+Every profile runs in a fresh process, so peak RSS is the footprint of that
+profile alone. All models go through the models (conversion mode full).
+Similarity is the fuzz ratio of the markdown of a profile to the fp32
+markdown of the same document (100 = identical).
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from rapidfuzz import fuzz
+from common import Timer, load_corpus, peak_rss_mb, print_table
+
+PROFILES = ["fp32", "int8", "bf16"]
+
+
+def child(profile: str, documents: list, output: str):
+    """Convert the documents with one profile and write the results as JSON."""
+    os.environ["INFERENCE_PROFILE"] = profile
+    from marker_api.fastpath import convert_pdf
+    from marker_api.models import load_models
+
+    with Timer() as load_timer:
+        model_list = load_models()
+    # Warm up, so the first measurement does not pay for lazy initialization
+    convert_pdf(documents[0], model_list, "full", max_pages=1)
+
+    markdown = {}
+    pages = 0
+    with Timer() as timer:
+        for path in documents:
+            text, _, metadata = convert_pdf(path, model_list, "full")
+            markdown[os.path.basename(path)] = text
+            pages += metadata.get("pages", 0)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "load s": round(load_timer.elapsed, 2),
+                "seconds": round(timer.elapsed, 2),
+                "pages": pages,
+                "peak RSS MB": round(peak_rss_mb()),
+                "markdown": markdown,
+            },
+            f,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CPU inference profiles.")
+    parser.add_argument("--corpus", nargs="+", default=["input"], help="PDF files or folders")
+    parser.add_argument("--profiles", nargs="+", default=PROFILES, choices=PROFILES)
+    parser.add_argument("--child", nargs="+", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        profile, output, *documents = args.child
+        child(profile, documents, output)
+        return
+
+    profiles = ["fp32"] + [profile for profile in args.profiles if profile != "fp32"]
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        documents = []
+        for name, content in load_corpus(args.corpus):
+            path = os.path.join(workdir, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            documents.append(path)
+        print(f"Loaded {len(documents)} documents")
+
+        for profile in profiles:
+            output = os.path.join(workdir, f"{profile}.json")
+            # No model cache, every profile is loaded and quantized from scratch
+            env = dict(os.environ, MODEL_CACHE_DIR="", INFERENCE_PROFILE=profile)
+            subprocess.run(
+                [sys.executable, __file__, "--child", profile, output, *documents],
+                env=env,
+                check=True,
+            )
+            with open(output) as f:
+                results[profile] = json.load(f)
+
+    rows = []
+    reference = results["fp32"]["markdown"]
+    for profile in profiles:
+        result = results[profile]
+        scores = [
+            fuzz.ratio(reference[name], markdown)
+            for name, markdown in result["markdown"].items()
+        ]
+        rows.append(
+            {
+                "profile": profile,
+                "load s": result["load s"],
+                "seconds": result["seconds"],
+                "pages/sec": round(result["pages"] / result["seconds"], 3),
+                "peak RSS MB": result["peak RSS MB"],
+                "similarity": round(sum(scores) / len(scores), 1),
+            }
+        )
+        if profile != "fp32":
+            print(f"Similarity to fp32 per document ({profile}):")
+            for name, score in zip(result["markdown"], scores):
+                print(f"  {name}: {score:.1f}")
+
+    print_table(rows, ["profile", "load s", "seconds", "pages/sec", "peak RSS MB", "similarity"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Measure Redis memory and pack/unpack latency of batch results per codec.
+
+    python benchmarks/bench_result_store.py --files 200 --redis-url redis://localhost:6379/15
+
+The workload is synthetic: every file gets markdown pages and base64 PNG
+images shaped like process_batch results, so no models are needed. Without
+--redis-url the Redis footprint is the size of the serialized task results;
+with it the results are written to that database (flushed first) and
+used_memory is reported.
+"""
+import io
+import json
+import base64
+import random
+import string
+import argparse
+import tempfile
+from common import Timer, peak_rss_mb, print_table
+from PIL import Image
+import marker_api.result_store as result_store
+
+_rng = random.Random(42)
+WORDS = [
+    "".join(_rng.choices(string.ascii_lowercase, k=_rng.randint(2, 10))) for _ in range(2000)
+]
+
+
+def synthetic_markdown(rng, pages: int) -> str:
+    paragraphs = []
+    for page in range(pages):
+        paragraphs.append(f"## Section {page + 1}")
+        for _ in range(6):
+            paragraphs.append(" ".join(rng.choices(WORDS, k=rng.randint(40, 90))) + ".")
+    return "\n\n".join(paragraphs)
+
+
+def synthetic_image(rng, size=(400, 300)) -> str:
+    # A flat figure with some noise, close to charts and scans in size
+    image = Image.new("RGB", size, (255, 255, 255))
+    pixels = image.load()
+    for _ in range(size[0] * size[1] // 20):
+        pixels[rng.randrange(size[0]), rng.randrange(size[1])] = (
+            rng.randrange(256),
+            rng.randrange(256),
+            rng.randrange(256),
+        )
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def synthetic_batch(files: int, pages: int, images: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [
+        {
+            "filename": f"document_{i}.pdf",
+            "markdown": synthetic_markdown(rng, pages),
+            "metadata": {"languages": None, "pages": pages},
+            "images": {
+                f"{page}_image_0.png": synthetic_image(rng) for page in range(images)
+            },
+            "status": "ok",
+            "cached": False,
+        }
+        for i in range(files)
+    ]
+
+
+class RawStore:
+    """What the result backend held before: the result as plain JSON."""
+
+    ttl = result_store.RESULT_TTL_SECONDS
+
+    def pack(self, result):
+        return result
+
+    def unpack(self, value):
+        return value
+
+
+def measure(label, store, results, redis_client):
+    """
+    Pack, store and unpack task results.
+
+    Args:
+    label (str): Row label.
+    store: A ResultStore, or RawStore for the baseline.
+    results (list): Task results; a whole process_batch result is one item.
+    redis_client: Optional scratch Redis database.
+    """
+    with Timer() as pack_timer:
+        envelopes = [store.pack(result) for result in results]
+    payloads = [json.dumps(envelope) for envelope in envelopes]
+    offloaded = sum(
+        envelope.get("stored", 0) for envelope in envelopes if "blob_ref" in envelope
+    )
+    with Timer() as unpack_timer:
+        for envelope in envelopes:
+            store.unpack(envelope)
+
+    row = {
+        "codec": label,
+        "redis MB": round(sum(len(payload) for payload in payloads) / 1024**2, 2),
+        "offloaded MB": round(offloaded / 1024**2, 2),
+        "pack ms": round(pack_timer.elapsed * 1000, 1),
+        "unpack ms": round(unpack_timer.elapsed * 1000, 1),
+    }
+    if redis_client is not None:
+        redis_client.flushdb()
+        before = redis_client.info("memory")["used_memory"]
+        pipe = redis_client.pipeline()
+        for i, payload in enumerate(payloads):
+            pipe.set(f"bench:result:{i}", payload, ex=store.ttl)
+        pipe.execute()
+        row["used_memory MB"] = round(
+            (redis_client.info("memory")["used_memory"] - before) / 1024**2, 2
+        )
+        with Timer() as get_timer:
+            for i in range(len(payloads)):
+                store.unpack(json.loads(redis_client.get(f"bench:result:{i}")))
+        row["get+unpack ms"] = round(get_timer.elapsed * 1000, 1)
+        redis_client.flushdb()
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed result storage.")
+    parser.add_argument("--files", type=int, default=200, help="Files in the batch")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per file")
+    parser.add_argument("--images", type=int, default=4, help="Images per file")
+    parser.add_argument(
+        "--offload-kb", type=int, default=result_store.RESULT_OFFLOAD_KB, help="Offload threshold"
+    )
+    parser.add_argument("--redis-url", default=None, help="Scratch Redis database to measure")
+    args = parser.parse_args()
+
+    results = synthetic_batch(args.files, args.pages, args.images)
+    raw_bytes = sum(len(json.dumps(result)) for result in results)
+    print(f"Synthetic batch: {args.files} files, {raw_bytes / 1024**2:.1f} MB of JSON")
+
+    redis_client = None
+    if args.redis_url:
+        import redis
+
+        redis_client = redis.Redis.from_url(args.redis_url)
+
+    configurations = [("gzip 6", "gzip", 6)]
+    if result_store._zstd() is not None:
+        configurations += [("zstd 3", "zstd", 3), ("zstd 9", "zstd", 9)]
+    else:
+        print("zstandard is not installed, skipping zstd")
+
+    # One result per file (convert_pdf tasks) or the whole batch as the
+    # result of one process_batch task
+    shapes = [("per file", results), ("batch", [results])]
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        result_store.RESULT_STORE_DIR = workdir
+        for shape, task_results in shapes:
+            row = measure("raw JSON (before)", RawStore(), task_results, redis_client)
+            rows.append({"results": shape, **row})
+            for label, codec, level in configurations:
+                store = result_store.ResultStore(codec, level, args.offload_kb * 1024)
+                row = measure(label, store, task_results, redis_client)
+                rows.append({"results": shape, **row})
+
+    columns = ["results", "codec", "redis MB", "offloaded MB", "pack ms", "unpack ms"]
+    if redis_client is not None:
+        columns += ["used_memory MB", "get+unpack ms"]
+    print_table(rows, columns)
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Measure model startup without and with the memory-mapped model cache.
+
+    TORCH_DEVICE=cpu python benchmarks/bench_startup.py --runs 3
+
+Every run is a fresh process that loads the models and converts the first
+page of a document, like a restarted worker taking its first task:
+
+- hub: MODEL_CACHE_DIR unset, the models are loaded with load_all_models
+- cold: an empty cache, the models are loaded and written to the cache
+- warm: the cache written by the cold run, the models are restored lazily
+
+Time-to-first-conversion is measured from the start of the process. The
+operating system keeps recently read files in its page cache; pass
+--drop-caches (root only) to empty it before every run.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+STARTED = time.perf_counter()
+
+from common import load_corpus, peak_rss_mb, print_table  # noqa: E402
+
+
+def child(document: str):
+    """Load the models, convert the first page and print the timings as JSON."""
+    from marker_api.fastpath import convert_pdf
+    from marker_api.models import load_models
+
+    imported = time.perf_counter()
+    model_list = load_models()
+    loaded = time.perf_counter()
+    convert_pdf(document, model_list, "full", max_pages=1)
+    converted = time.perf_counter()
+    print(
+        json.dumps(
+            {
+                "import s": round(imported - STARTED, 2),
+                "load s": round(loaded - imported, 2),
+                "first conversion s": round(converted - loaded, 2),
+                "time to first conversion s": round(converted - STARTED, 2),
+                "peak RSS MB": round(peak_rss_mb()),
+            }
+        )
+    )
+
+
+def drop_caches():
+    subprocess.run(["sync"], check=True)
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def run(document: str, cache_dir: str, drop: bool) -> dict:
+    if drop:
+        drop_caches()
+    env = dict(os.environ, MODEL_CACHE_DIR=cache_dir)
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", document],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model startup.")
+    parser.add_argument("--corpus", nargs="+", default=None, help="PDF files or folders")
+    parser.add_argument("--runs", type=int, default=1, help="Runs of every mode")
+    parser.add_argument("--drop-caches", action="store_true", help="Empty the page cache first")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        name, content = load_corpus(args.corpus)[0]
+        document = os.path.join(workdir, name)
+        with open(document, "wb") as f:
+            f.write(content)
+        print(f"First conversion: page 1 of {name}")
+
+        for i in range(args.runs):
+            rows.append({"mode": "hub", **run(document, "", args.drop_caches)})
+            # A new cache folder every run, so every cold run writes the cache
+            cache_dir = os.path.join(workdir, f"cache_{i}")
+            rows.append({"mode": "cold", **run(document, cache_dir, args.drop_caches)})
+            rows.append({"mode": "warm", **run(document, cache_dir, args.drop_caches)})
+
+    print_table(
+        sorted(rows, key=lambda row: ["hub", "cold", "warm"].index(row["mode"])),
+        [
+            "mode",
+            "import s",
+            "load s",
+            "first conversion s",
+            "time to first conversion s",
+            "peak RSS MB",
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
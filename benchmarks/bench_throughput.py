@@ -0,0 +1,331 @@
+"""
+Measure conversion throughput through the code paths of the service and
+keep a history of the runs.
+
+    TORCH_DEVICE=cpu python benchmarks/bench_throughput.py --repeat 3
+
+Every path runs in a fresh process with the result cache disabled:
+
+- api: routes.process_pdf_file on a spooled upload, as the simple server
+- celery: celery_tasks.convert_pdf_to_markdown on a blob, as a worker
+  (without the page-range fan-out)
+- cli: convert.process_single_pdf, as marker_api/convert.py
+
+Latency is per document, image time is the time spent in encode_images
+(the cli path saves the images as files instead). Every run is appended to
+the --history file with the engine versions and settings, and compared with
+the latest earlier run of the same path, corpus and machine: a drop in
+pages/sec or a rise in p95 latency above --threshold is flagged as a
+regression, and fails the command with --fail-on-regression.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+from common import Timer, load_corpus, peak_rss_mb, print_table
+
+PATHS = ["api", "celery", "cli"]
+COLUMNS = [
+    "path",
+    "documents",
+    "pages",
+    "seconds",
+    "pages/sec",
+    "p50 s",
+    "p95 s",
+    "p99 s",
+    "image s",
+    "peak RSS MB",
+]
+
+
+def timed(module, name: str, totals: dict):
+    """Wrap module.name so the time spent in it adds up in totals[name]."""
+    function = getattr(module, name)
+    totals[name] = 0.0
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            totals[name] += time.perf_counter() - start
+
+    setattr(module, name, wrapper)
+
+
+def convert_api(model_list, mode: str, workdir: str, totals: dict):
+    from marker_api import routes
+    from marker_api.blobstore import hash_file
+
+    timed(routes, "encode_images", totals)
+
+    def convert(name: str, path: str):
+        routes.process_pdf_file(
+            path, name, model_list, pdf_digest=hash_file(path), conversion_mode=mode
+        )
+
+    return convert
+
+
+def convert_celery(model_list, mode: str, workdir: str, totals: dict):
+    from marker_api import celery_tasks
+    from marker_api.blobstore import get_blob_store
+
+    timed(celery_tasks, "encode_images", totals)
+    celery_tasks.model_list = model_list
+    celery_tasks.metadata_dict = {}
+    celery_tasks.OUTPUT_FOLDER = os.path.join(workdir, "output")
+    blob_store = get_blob_store()
+
+    def convert(name: str, path: str):
+        # The upload to the blob store happens in the server, not the worker
+        blob_ref = blob_store.put_file(path)
+        start = time.perf_counter()
+        celery_tasks.convert_pdf_to_markdown.run(
+            name, blob_ref, allow_fanout=False, conversion_mode=mode
+        )
+        return time.perf_counter() - start
+
+    return convert
+
+
+def convert_cli(model_list, mode: str, workdir: str, totals: dict):
+    from marker_api import convert as cli
+
+    cli.worker_init(model_list)
+    runs = []
+
+    def convert(name: str, path: str):
+        # convert.py skips documents that already have an output folder
+        runs.append(name)
+        cli.process_single_pdf((path, os.path.join(workdir, f"cli_{len(runs)}"), None, None))
+
+    return convert
+
+
+CONVERTERS = {"api": convert_api, "celery": convert_celery, "cli": convert_cli}
+
+
+def child(path_name: str, mode: str, output: str, documents: list):
+    """Convert the documents through one path and write the timings as JSON."""
+    from marker_api.fastpath import convert_pdf
+    from marker_api.models import load_models
+    from marker_api.pages import get_page_count
+
+    with Timer() as load_timer:
+        model_list = load_models()
+    # Warm up, so the first measurement does not pay for lazy initialization
+    convert_pdf(documents[0], model_list, "full", max_pages=1)
+
+    totals = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        convert = CONVERTERS[path_name](model_list, mode, workdir, totals)
+        results = []
+        with Timer() as timer:
+            for document in documents:
+                start = time.perf_counter()
+                elapsed = convert(os.path.basename(document), document)
+                results.append(
+                    {
+                        "name": os.path.basename(document),
+                        "pages": get_page_count(document),
+                        "seconds": elapsed if elapsed is not None else time.perf_counter() - start,
+                    }
+                )
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "load seconds": load_timer.elapsed,
+                "seconds": timer.elapsed,
+                "documents": results,
+                "image seconds": totals.get("encode_images"),
+                "peak RSS MB": peak_rss_mb(),
+            },
+            f,
+        )
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(path_name: str, result: dict) -> dict:
+    latencies = [document["seconds"] for document in result["documents"]]
+    pages = sum(document["pages"] for document in result["documents"])
+    image_seconds = result["image seconds"]
+    return {
+        "path": path_name,
+        "documents": len(latencies),
+        "pages": pages,
+        "seconds": round(result["seconds"], 2),
+        "pages/sec": round(pages / result["seconds"], 3),
+        "p50 s": round(percentile(latencies, 50), 2),
+        "p95 s": round(percentile(latencies, 95), 2),
+        "p99 s": round(percentile(latencies, 99), 2),
+        "image s": "-" if image_seconds is None else round(image_seconds, 2),
+        "peak RSS MB": round(result["peak RSS MB"]),
+    }
+
+
+def environment() -> dict:
+    """The versions and settings a run is compared under."""
+    from marker.settings import settings
+    from marker_api.cache import ENGINE_VERSION
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "engine": ENGINE_VERSION,
+        "device": settings.TORCH_DEVICE_MODEL,
+        "inference_profile": os.environ.get("INFERENCE_PROFILE", "fp32"),
+        "host": socket.gethostname(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def corpus_digest(documents: list) -> str:
+    digest = hashlib.sha256()
+    for name, content in documents:
+        digest.update(name.encode())
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()[:16]
+
+
+def load_history(path: str) -> list:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def find_baseline(history: list, run: dict, path_name: str):
+    """The row of the latest earlier run of the same path, corpus and machine."""
+    for previous in reversed(history):
+        if (
+            previous["corpus"] != run["corpus"]
+            or previous["mode"] != run["mode"]
+            or previous["environment"]["host"] != run["environment"]["host"]
+            or previous["environment"]["device"] != run["environment"]["device"]
+        ):
+            continue
+        for row in previous["rows"]:
+            if row["path"] == path_name:
+                return previous, row
+    return None, None
+
+
+def compare(history: list, run: dict, threshold: float) -> list:
+    """
+    Compare a run with its baselines.
+
+    Returns:
+    list: Messages of the regressions.
+    """
+    regressions = []
+    for row in run["rows"]:
+        previous, baseline = find_baseline(history, run, row["path"])
+        if baseline is None:
+            print(f"{row['path']}: no earlier run to compare with")
+            continue
+        speed = row["pages/sec"] / baseline["pages/sec"] - 1
+        latency = row["p95 s"] / baseline["p95 s"] - 1 if baseline["p95 s"] else 0
+        print(
+            f"{row['path']}: pages/sec {speed:+.1%}, p95 {latency:+.1%} "
+            f"against {previous['label']} ({previous['environment']['engine']})"
+        )
+        if speed < -threshold:
+            regressions.append(f"{row['path']}: pages/sec dropped by {-speed:.1%}")
+        if latency > threshold:
+            regressions.append(f"{row['path']}: p95 latency rose by {latency:.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conversion throughput with history.")
+    parser.add_argument("--corpus", nargs="+", default=None, help="PDF files or folders")
+    parser.add_argument("--repeat", type=int, default=1, help="Copies of every document")
+    parser.add_argument("--paths", nargs="+", default=PATHS, choices=PATHS)
+    parser.add_argument("--mode", default="full", help="Conversion mode: auto, full or text")
+    parser.add_argument("--history", default="benchmarks/history.json", help="History file")
+    parser.add_argument("--label", default=None, help="Name of this run in the history")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Tolerated slowdown")
+    parser.add_argument("--no-save", action="store_true", help="Do not add the run to the history")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--child", nargs="+", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        path_name, output, *documents = args.child
+        child(path_name, args.mode, output, documents)
+        return
+
+    corpus = load_corpus(args.corpus, args.repeat)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        documents = []
+        for name, content in corpus:
+            path = os.path.join(workdir, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            documents.append(path)
+        print(f"Loaded {len(documents)} documents")
+
+        for path_name in args.paths:
+            output = os.path.join(workdir, f"{path_name}.json")
+            env = dict(
+                os.environ,
+                RESULT_CACHE_ENABLED="false",
+                BLOB_STORE="local",
+                BLOB_STORE_DIR=os.path.join(workdir, "blobs"),
+                RESULT_STORE_DIR=os.path.join(workdir, "results"),
+            )
+            subprocess.run(
+                [sys.executable, __file__, "--mode", args.mode, "--child", path_name, output, *documents],
+                env=env,
+                check=True,
+            )
+            with open(output) as f:
+                results[path_name] = json.load(f)
+
+    run = {
+        "label": args.label or time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "time": time.time(),
+        "corpus": corpus_digest(corpus),
+        "mode": args.mode,
+        "environment": environment(),
+        "rows": [summarize(path_name, results[path_name]) for path_name in args.paths],
+    }
+    print_table(run["rows"], COLUMNS)
+
+    history = load_history(args.history)
+    regressions = compare(history, run, args.threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+        with open(args.history, "w") as f:
+            json.dump(history + [run], f, indent=2)
+        print(f"Saved the run as {run['label']} in {args.history}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
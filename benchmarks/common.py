@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import resource
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS = ["input", "examples/data"]
+
+
+def load_corpus(paths=None, repeat: int = 1):
+    """
+    Load the PDFs of the benchmark corpus.
+
+    Args:
+    paths (list): Files or folders with PDFs, defaults to input/ and examples/data.
+    repeat (int): Number of copies of each document, to simulate larger batches.
+
+    Returns:
+    list: (name, pdf bytes) tuples.
+    """
+    documents = []
+    for path in paths or DEFAULT_CORPUS:
+        if os.path.isdir(path):
+            files = [
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.lower().endswith(".pdf")
+            ]
+        elif os.path.isfile(path):
+            files = [path]
+        else:
+            logger.warning(f"Corpus path {path} does not exist, skipping")
+            continue
+        for file_path in files:
+            with open(file_path, "rb") as f:
+                documents.append((os.path.basename(file_path), f.read()))
+
+    copies = []
+    for i in range(repeat):
+        for name, content in documents:
+            copies.append((name if i == 0 else f"{i}_{name}", content))
+    return copies
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak / (1024**2)
+    return peak / 1024
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def print_table(rows, columns):
+    """
+    Print benchmark rows as an aligned text table.
+
+    Args:
+    rows (list): Dicts with one entry per column.
+    columns (list): Column names in display order.
+    """
+    cells = [[str(row.get(column, "")) for column in columns] for row in rows]
+    widths = [
+        max([len(column)] + [len(line[i]) for line in cells])
+        for i, column in enumerate(columns)
+    ]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
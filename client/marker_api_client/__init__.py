@@ -1,7 +1,8 @@
+import json
 import aiohttp
 import asyncio
 import requests
-from typing import List, Union, Dict, Any
+from typing import List, Union, Dict, Any, Iterator, AsyncIterator
 from enum import Enum
 from pydantic import BaseModel
 from tqdm import tqdm
@@ -41,6 +42,22 @@ class BatchConversionResponse(BaseModel):
     status: str
 
 
+class SimpleBatchConversionResponse(BaseModel):
+    status: str
+    results: List[Dict[str, Any]]
+
+
+class StreamFrame(BaseModel):
+    type: str
+    page: int = None
+    pages: int = None
+    markdown: str = None
+    images: Dict[str, str] = None
+    filename: str = None
+    metadata: Dict[str, Any] = None
+    message: str = None
+
+
 class MarkerAPIClient:
     def __init__(self, base_url: str):
         self.base_url = base_url.rstrip("/")
@@ -135,7 +152,7 @@ class MarkerAPIClient:
         )
         response.raise_for_status()
         logger.info("Batch conversion request successful")
-        return BatchConversionResponse(**response.json())
+        return self._batch_response(response.json())
 
     async def aload_data(
         self, file_paths: Union[str, List[str]], show_progress: bool = False
@@ -176,7 +193,56 @@ class MarkerAPIClient:
         ) as response:
             response.raise_for_status()
             logger.info("Async batch conversion request successful")
-            return BatchConversionResponse(**(await response.json()))
+            return self._batch_response(await response.json())
+
+    def _batch_response(
+        self, data: Dict[str, Any]
+    ) -> Union[BatchConversionResponse, SimpleBatchConversionResponse]:
+        # The simple server converts the batch in the request, the distributed
+        # server returns a task id to poll
+        if self.server_type == ServerType.simple:
+            return SimpleBatchConversionResponse(**data)
+        return BatchConversionResponse(**data)
+
+    def iter_convert(self, file_path: str, chunk_size: int = 64 * 1024) -> Iterator[StreamFrame]:
+        if self.server_type != ServerType.simple:
+            raise ValueError("iter_convert is only available for simple server type")
+        with open(file_path, "rb") as file:
+            logger.info(f"Sending streaming request to convert {file_path}")
+            response = self.session.post(
+                f"{self.base_url}/convert/stream",
+                files={"pdf_file": file},
+                stream=True,
+            )
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines(chunk_size=chunk_size):
+                if line:
+                    yield StreamFrame(**json.loads(line))
+        logger.info(f"Finished streaming conversion of {file_path}")
+
+    async def aiter_convert(self, file_path: str) -> AsyncIterator[StreamFrame]:
+        if self.server_type != ServerType.simple:
+            raise ValueError("aiter_convert is only available for simple server type")
+        logger.info(f"Sending async streaming request to convert {file_path}")
+        with open(file_path, "rb") as file:
+            data = aiohttp.FormData()
+            data.add_field("pdf_file", file)
+            async with self.async_session.post(
+                f"{self.base_url}/convert/stream", data=data
+            ) as response:
+                response.raise_for_status()
+                # Frames carry base64 images, so lines can exceed aiohttp's readline limit
+                buffer = b""
+                async for chunk in response.content.iter_any():
+                    buffer += chunk
+                    while b"\n" in buffer:
+                        line, buffer = buffer.split(b"\n", 1)
+                        if line.strip():
+                            yield StreamFrame(**json.loads(line))
+                if buffer.strip():
+                    yield StreamFrame(**json.loads(buffer))
+        logger.info(f"Finished async streaming conversion of {file_path}")
 
     def get_result(self, task_id: str) -> ConversionResponse:
         if self.server_type != ServerType.distributed:
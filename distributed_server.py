@@ -1,9 +1,12 @@
 import argparse
+import asyncio
 import uvicorn
 import logging
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Header, Query, WebSocket
 from celery.exceptions import TimeoutError
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from pydantic import AnyHttpUrl
 from marker_api.celery_worker import celery_app
 from marker_api.utils import print_markerapi_text_art
 from marker.logger import configure_logging
@@ -14,11 +17,23 @@ from marker_api.celery_routes import (
     celery_convert_pdf_concurrent_await,
     celery_batch_convert,   
     celery_batch_result,
+    celery_batch_file,
+    celery_batch_files,
+    celery_task_events_sse,
+    celery_task_events_ws,
 )
 import gradio as gr
 from marker_api.demo import demo_ui
+from marker_api.image_delivery import ImageFormat, TaskImageMode, image_response
+from marker_api.fastpath import ConversionMode
+from marker_api.queues import queue_stats
+from marker_api.uploads import UploadLimitMiddleware
+from marker_api.webhooks import WEBHOOKS_ENABLED, run_dispatcher
+from marker_api.workers import registry
 from marker_api.model.schema import (
     BatchConversionResponse,
+    BatchFileEntry,
+    BatchFilesResponse,
     BatchResultResponse,
     CeleryResultResponse,
     CeleryTaskResponse,
@@ -27,9 +42,7 @@ from marker_api.model.schema import (
     ServerType,
 )
 from fastapi import UploadFile
-from starlette.datastructures import Headers
-import io
-from typing import List
+from typing import List, Optional
 from webdav3.client import Client
 import os
 from tqdm import tqdm
@@ -41,8 +54,26 @@ from datetime import datetime
 configure_logging()
 logger = logging.getLogger(__name__)
 
+
+# The worker registry and the webhook dispatcher run next to the API, see
+# marker_api.workers and marker_api.webhooks
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background = [asyncio.create_task(registry.run())]
+    if WEBHOOKS_ENABLED:
+        background.append(asyncio.create_task(run_dispatcher()))
+    yield
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
+
 # Global variable to hold model list
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Upload limits are enforced while the body arrives, before form parsing;
+# added first so that CORS also wraps its responses
+app.add_middleware(UploadLimitMiddleware)
 
 logger.info("Configuring CORS middleware")
 app.add_middleware(
@@ -236,7 +267,8 @@ def server():
     Returns:
     HealthResponse: A welcome message, server type, and number of workers (if distributed).
     """
-    worker_count = len(celery_app.control.inspect().stats() or {})
+    # Workers are counted from their heartbeats, see marker_api.workers
+    worker_count = registry.worker_count
     server_type = ServerType.distributed if worker_count > 0 else ServerType.simple
     return HealthResponse(
         message="Welcome to Marker-api",
@@ -245,6 +277,60 @@ def server():
     )
 
 
+@app.get("/capacity")
+def capacity():
+    """
+    Endpoint to report the capacity of the cluster for autoscalers.
+
+    Returns:
+    dict: Busy and idle workers, depth, consumers and recent throughput of
+    every queue, and free memory, as of the last registry refresh.
+    """
+    return registry.capacity()
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Endpoint to report the result cache counters of every Celery worker.
+
+    Returns:
+    dict: Cache statistics keyed by worker hostname.
+    """
+    replies = celery_app.control.broadcast("cache_stats", reply=True, timeout=1.0)
+    workers = {}
+    for reply in replies or []:
+        workers.update(reply)
+    return {"workers": workers}
+
+
+@app.get("/queues")
+def queues():
+    """
+    Endpoint to report depth and latency percentiles of the Celery queues.
+
+    Returns:
+    dict: Stats of the interactive, bulk and oversized queues, with the share
+    of tasks within the configured SLA.
+    """
+    return queue_stats()
+
+
+@app.get("/images/{key}")
+def get_image(
+    key: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Endpoint to download an image written to the output store by a worker.
+
+    Returns:
+    Response: The image, with ETag and Range support.
+    """
+    return image_response(key, range_header, if_none_match)
+
+
 def is_celery_alive() -> bool:
     logger.debug("Checking if Celery is alive")
     try:
@@ -275,35 +361,74 @@ def setup_routes(app: FastAPI, celery_live: bool):
         #     return await celery_result(task_id)
 
         @app.post("/batch_convert", response_model=BatchConversionResponse)
-        async def batch_convert(pdf_files: List[UploadFile] = File(...)):
+        async def batch_convert(
+            pdf_files: List[UploadFile] = File(...),
+            image_mode: TaskImageMode = "inline",
+            image_format: ImageFormat = "png",
+            image_quality: Optional[int] = Query(None, ge=0, le=100),
+            conversion_mode: Optional[ConversionMode] = None,
+            callback_url: Optional[AnyHttpUrl] = None,
+            callback_per_file: bool = False,
+        ):
             print("Check pdf_files:", pdf_files)
-            return await celery_batch_convert(pdf_files)
+            return await celery_batch_convert(
+                pdf_files,
+                image_mode,
+                image_format,
+                image_quality,
+                conversion_mode,
+                str(callback_url) if callback_url else None,
+                callback_per_file,
+            )
 
         @app.get("/batch_convert/result/{task_id}", response_model=BatchResultResponse)
         async def get_batch_result(task_id: str):
             return await celery_batch_result(task_id)
 
+        @app.get(
+            "/batch_convert/result/{task_id}/files", response_model=BatchFilesResponse
+        )
+        async def get_batch_files(
+            task_id: str,
+            cursor: int = Query(0, ge=0),
+            limit: int = Query(100, ge=1, le=1000),
+            include_results: bool = False,
+        ):
+            return await celery_batch_files(task_id, cursor, limit, include_results)
+
+        @app.get(
+            "/batch_convert/result/{task_id}/files/{file}", response_model=BatchFileEntry
+        )
+        async def get_batch_file(task_id: str, file: str):
+            return await celery_batch_file(task_id, file)
+
+        @app.get("/events/{task_id}")
+        async def task_events_sse(task_id: str):
+            return await celery_task_events_sse(task_id)
+
+        @app.websocket("/ws/events/{task_id}")
+        async def task_events_ws(websocket: WebSocket, task_id: str):
+            await celery_task_events_ws(websocket, task_id)
+
         # New
         @app.post("/batch_convert_local", response_model=BatchConversionResponse)
-        async def batch_convert_local():
-            input_folder = "input"
-            pdf_files = []
-            for filename in os.listdir(input_folder):
-                if filename.lower().endswith(".pdf"):
-                    file_path = os.path.join(input_folder, filename)
-                    with open(file_path, "rb") as f:
-                        file_bytes = f.read()
-                        upload_file = UploadFile(
-                            filename=filename,
-                            file=io.BytesIO(file_bytes),
-                            headers=Headers({
-                                "content-disposition": f'form-data; name="pdf_files"; filename="{filename}"',
-                                "content-type": "application/pdf"
-                            })
-                        )
-                        pdf_files.append(upload_file)
-            print("Check pdf_files:", pdf_files)
-            return await celery_batch_convert(pdf_files)
+        async def batch_convert_local(
+            image_mode: TaskImageMode = "inline",
+            image_format: ImageFormat = "png",
+            image_quality: Optional[int] = Query(None, ge=0, le=100),
+            conversion_mode: Optional[ConversionMode] = None,
+            callback_url: Optional[AnyHttpUrl] = None,
+            callback_per_file: bool = False,
+        ):
+            return await celery_batch_convert_local(
+                "input",
+                image_mode,
+                image_format,
+                image_quality,
+                conversion_mode,
+                str(callback_url) if callback_url else None,
+                callback_per_file,
+            )
         
         logger.info("Adding real-time conversion route")
     else:
@@ -0,0 +1,280 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from marker_api.utils import DeviceType, get_ram_available
+
+logger = logging.getLogger(__name__)
+
+# Threads sharing the models; sized from the hardware when unset
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+VRAM_PER_TASK = float(os.environ.get("VRAM_PER_TASK", 4.5))
+CPU_CORES_PER_WORKER = int(os.environ.get("CPU_CORES_PER_WORKER", 8))
+# Pages a request may run per round of the fair queue
+FAIR_QUEUE_QUANTUM = int(os.environ.get("FAIR_QUEUE_QUANTUM", 10))
+ADMISSION_MAX_PAGES = int(os.environ.get("ADMISSION_MAX_PAGES", 500))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 32))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 5))
+
+# Weight of the latest sample in the moving averages
+EWMA_ALPHA = 0.2
+
+
+def default_inference_workers() -> int:
+    """
+    Number of inference threads for this machine.
+
+    On GPU, one thread per VRAM_PER_TASK GB of free VRAM. On CPU torch already
+    spreads one conversion over the cores, so one thread per
+    CPU_CORES_PER_WORKER cores.
+    """
+    device_type, ram_available = get_ram_available()
+    if device_type == DeviceType.GPU:
+        return max(1, int(ram_available / 1024 / VRAM_PER_TASK))
+    return max(1, (os.cpu_count() or 1) // CPU_CORES_PER_WORKER)
+
+
+class Job:
+    def __init__(self, fn, args, cost: int):
+        self.fn = fn
+        self.args = args
+        self.cost = max(1, cost)
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class InferenceExecutor:
+    """
+    Process-wide executor for blocking conversions, with admission control
+    and fair queuing.
+
+    Requests are admitted by pages in flight (queued plus running), so one
+    300-page PDF weighs as much as 300 one-page PDFs. When the page budget or
+    the queue is full the request is rejected at once with 429 and a
+    Retry-After estimate, instead of piling up behind the models.
+
+    Admitted work is queued per flow (one flow per request) and the worker
+    threads pick jobs by deficit round robin weighted by pages: every round
+    a flow may run FAIR_QUEUE_QUANTUM pages, so a large batch cannot starve
+    the small requests queued behind it.
+    """
+
+    def __init__(
+        self,
+        workers: int = INFERENCE_WORKERS,
+        max_pages: int = ADMISSION_MAX_PAGES,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        quantum: int = FAIR_QUEUE_QUANTUM,
+    ):
+        self.workers = workers or default_inference_workers()
+        self.max_pages = max_pages
+        self.max_queue = max_queue
+        self.quantum = max(1, quantum)
+        self.lock = threading.RLock()
+        self.job_ready = threading.Condition(self.lock)
+        self.flows = OrderedDict()
+        self.deficits = {}
+        self.threads = []
+        self.pages_in_flight = 0
+        self.requests_in_flight = 0
+        self.queued = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_wait = 0.0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.seconds_per_page = 0.0
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the pages in flight are likely done.
+        """
+        estimate = self.pages_in_flight * self.seconds_per_page / self.workers
+        return max(ADMISSION_RETRY_AFTER, int(estimate) + 1)
+
+    def admit(self, pages: int):
+        pages = max(1, pages)
+        with self.lock:
+            # A document larger than the budget is still admitted when idle
+            over_budget = (
+                self.pages_in_flight > 0
+                and self.pages_in_flight + pages > self.max_pages
+            )
+            queue_full = self.requests_in_flight >= self.max_queue + self.workers
+            if over_budget or queue_full:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Server is at capacity, retry later",
+                    headers={"Retry-After": str(self.retry_after())},
+                )
+            self.pages_in_flight += pages
+            self.requests_in_flight += 1
+            self.admitted += 1
+        return pages
+
+    def release(self, pages: int):
+        with self.lock:
+            self.pages_in_flight = max(0, self.pages_in_flight - pages)
+            self.requests_in_flight = max(0, self.requests_in_flight - 1)
+
+    @asynccontextmanager
+    async def admission(self, pages: int):
+        """
+        Hold pages of the admission budget for the duration of a request.
+
+        Raises HTTP 429 with Retry-After when the budget or queue is full.
+        """
+        pages = self.admit(pages)
+        try:
+            yield
+        finally:
+            self.release(pages)
+
+    def _record_wait(self, wait: float):
+        with self.lock:
+            self.last_wait = wait
+            self.max_wait = max(self.max_wait, wait)
+            self.avg_wait += EWMA_ALPHA * (wait - self.avg_wait)
+
+    def _record_run(self, seconds: float, pages: int):
+        with self.lock:
+            sample = seconds / max(1, pages)
+            if self.seconds_per_page == 0.0:
+                self.seconds_per_page = sample
+            else:
+                self.seconds_per_page += EWMA_ALPHA * (sample - self.seconds_per_page)
+
+    def _start(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work,
+                name=f"inference-{len(self.threads)}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def _next_job(self):
+        """
+        Pop the next job by deficit round robin. Called with the lock held.
+        """
+        while self.flows:
+            flow, jobs = next(iter(self.flows.items()))
+            job = jobs[0]
+            if self.deficits[flow] >= job.cost:
+                jobs.popleft()
+                self.deficits[flow] -= job.cost
+                if not jobs:
+                    del self.flows[flow]
+                    del self.deficits[flow]
+                return job
+            self.deficits[flow] += self.quantum
+            self.flows.move_to_end(flow)
+        return None
+
+    def _work(self):
+        while True:
+            with self.job_ready:
+                job = self._next_job()
+                while job is None:
+                    self.job_ready.wait()
+                    job = self._next_job()
+                self.queued -= 1
+                self.running += 1
+            started = time.perf_counter()
+            self._record_wait(started - job.enqueued)
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                self._record_run(time.perf_counter() - started, job.cost)
+
+    def submit(self, flow, fn, *args, pages: int = 1) -> Future:
+        """
+        Queue a blocking function on the inference threads.
+
+        Args:
+        flow: Key of the request the job belongs to; jobs of one flow run in
+        order, different flows share the threads fairly.
+        fn: The blocking function.
+        args: Its positional arguments.
+        pages (int): Pages the job works on, its weight in the fair queue.
+
+        Returns:
+        concurrent.futures.Future: The future of the result.
+        """
+        job = Job(fn, args, pages)
+        with self.job_ready:
+            self._start()
+            if flow not in self.flows:
+                self.flows[flow] = deque()
+                self.deficits[flow] = 0
+            self.flows[flow].append(job)
+            self.queued += 1
+            self.job_ready.notify()
+        return job.future
+
+    async def call(self, fn, *args, pages: int = 1, flow=None):
+        """
+        Run a blocking function on an inference thread and await the result.
+
+        Without a flow the call is a flow of its own.
+        """
+        flow = flow if flow is not None else object()
+        return await asyncio.wrap_future(self.submit(flow, fn, *args, pages=pages))
+
+    async def run(self, pages: int, fn, *args):
+        """
+        Admit a request of the given number of pages and run fn for it.
+        """
+        async with self.admission(pages):
+            return await self.call(fn, *args, pages=pages)
+
+    async def iterate(self, iterator, pages_per_item: int = 1):
+        """
+        Drive a blocking iterator on the inference threads, one item per call.
+
+        The caller is responsible for holding an admission for the request.
+        """
+        flow = object()
+        done = object()
+        while True:
+            item = await self.call(next, iterator, done, pages=pages_per_item, flow=flow)
+            if item is done:
+                return
+            yield item
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "flows": len(self.flows),
+                "pages_in_flight": self.pages_in_flight,
+                "max_pages": self.max_pages,
+                "max_queue": self.max_queue,
+                "saturated": self.pages_in_flight >= self.max_pages
+                or self.requests_in_flight >= self.max_queue + self.workers,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "wait_seconds_avg": round(self.avg_wait, 3),
+                "wait_seconds_last": round(self.last_wait, 3),
+                "wait_seconds_max": round(self.max_wait, 3),
+                "seconds_per_page": round(self.seconds_per_page, 3),
+            }
+
+
+inference_executor = InferenceExecutor()
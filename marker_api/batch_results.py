@@ -0,0 +1,160 @@
+import json
+import time
+import logging
+from marker_api.celery_worker import get_redis
+from marker_api.events import publish_event
+from marker_api.webhooks import queue_file_callback
+from marker_api.result_store import RESULT_TTL_SECONDS, pack_result, unpack_result
+
+logger = logging.getLogger(__name__)
+
+# Finished files in completion order, the position is the cursor
+FILES_KEY = "marker:batch_files:{batch_id}"
+# "index:{i}" and "name:{filename}" to the position in FILES_KEY, plus totals
+INDEX_KEY = "marker:batch_index:{batch_id}"
+
+
+def start_batch(batch_id: str, total: int):
+    """
+    Register a batch before any of its files is converted.
+
+    Args:
+    batch_id (str): Task id of the batch.
+    total (int): Number of files in the batch.
+    """
+    index_key = INDEX_KEY.format(batch_id=batch_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(index_key, "total", total)
+        pipe.expire(index_key, RESULT_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not register batch {batch_id}: {str(e)}")
+
+
+def record_file_result(batch_id: str, index: int, result: dict):
+    """
+    Publish the result of one file of a batch as soon as it is done.
+
+    The result goes through the result store, so large results are
+    compressed and offloaded like task results.
+
+    Args:
+    batch_id (str): Task id of the batch.
+    index (int): Position of the file in the submission.
+    result (dict): The conversion result or error of the file.
+    """
+    files_key = FILES_KEY.format(batch_id=batch_id)
+    index_key = INDEX_KEY.format(batch_id=batch_id)
+    try:
+        entry = json.dumps(
+            {
+                "index": index,
+                "filename": result.get("filename"),
+                "status": result.get("status"),
+                "finished_at": time.time(),
+                "result": pack_result(result),
+            }
+        )
+        client = get_redis()
+        position = client.rpush(files_key, entry) - 1
+        pipe = client.pipeline()
+        pipe.hset(
+            index_key,
+            mapping={f"index:{index}": position, f"name:{result.get('filename')}": position},
+        )
+        pipe.expire(files_key, RESULT_TTL_SECONDS)
+        pipe.expire(index_key, RESULT_TTL_SECONDS)
+        pipe.execute()
+        event = {
+            "index": index,
+            "filename": result.get("filename"),
+            "status": result.get("status"),
+            "cursor": position + 1,
+        }
+        publish_event(batch_id, {"type": "file", **event})
+        queue_file_callback(batch_id, event)
+    except Exception as e:
+        # The batch result still carries every file, only early access is lost
+        logger.warning(f"Could not publish result {index} of batch {batch_id}: {str(e)}")
+
+
+def _entry(raw: bytes, position: int, include_result: bool) -> dict:
+    entry = json.loads(raw)
+    entry["cursor"] = position + 1
+    packed = entry.pop("result")
+    result = unpack_result(packed) if include_result else None
+    if result is not None and result.get("status") == "Error":
+        entry["error"] = result.get("error")
+    elif result is not None:
+        entry["result"] = result
+    return entry
+
+
+def batch_progress(batch_id: str) -> dict:
+    """
+    Return the total and completed file counts of a batch.
+    """
+    client = get_redis()
+    total = client.hget(INDEX_KEY.format(batch_id=batch_id), "total")
+    completed = client.llen(FILES_KEY.format(batch_id=batch_id))
+    return {"total": int(total) if total is not None else None, "completed": completed}
+
+
+def list_file_results(
+    batch_id: str, cursor: int = 0, limit: int = 100, include_results: bool = False
+) -> dict:
+    """
+    List the files of a batch finished since a cursor.
+
+    Args:
+    batch_id (str): Task id of the batch.
+    cursor (int): next_cursor of the previous call, 0 to start over.
+    limit (int): Maximum number of files returned.
+    include_results (bool): Whether to return the full results or only the listing.
+
+    Returns:
+    dict: The finished files, next_cursor to poll with, and the counts.
+    """
+    cursor = max(0, cursor)
+    raw_entries = get_redis().lrange(
+        FILES_KEY.format(batch_id=batch_id), cursor, cursor + max(1, limit) - 1
+    )
+    files = [
+        _entry(raw, cursor + offset, include_results)
+        for offset, raw in enumerate(raw_entries)
+    ]
+    progress = batch_progress(batch_id)
+    return {
+        "total": progress["total"],
+        "completed": progress["completed"],
+        "cursor": cursor,
+        "next_cursor": cursor + len(files),
+        "files": files,
+    }
+
+
+def get_file_result(batch_id: str, file: str):
+    """
+    Return the result of one file of a batch.
+
+    Args:
+    batch_id (str): Task id of the batch.
+    file (str): Index of the file in the submission, or its file name.
+
+    Returns:
+    dict: The entry with the full result, or None while it is not done.
+    """
+    client = get_redis()
+    index_key = INDEX_KEY.format(batch_id=batch_id)
+    position = None
+    if file.isdigit():
+        position = client.hget(index_key, f"index:{file}")
+    if position is None:
+        position = client.hget(index_key, f"name:{file}")
+    if position is None:
+        return None
+    raw = client.lindex(FILES_KEY.format(batch_id=batch_id), int(position))
+    if raw is None:
+        return None
+    return _entry(raw, int(position), include_result=True)
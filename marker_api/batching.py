@@ -0,0 +1,359 @@
+import os
+import logging
+import traceback
+import pypdfium2 as pdfium
+from surya.detection import batch_text_detection
+from surya.layout import batch_layout_detection
+from surya.ordering import batch_ordering
+from marker_api.models import MARKER_ENGINE, convert_single_pdf
+from marker.utils import flush_cuda_memory
+from marker.tables.table import format_tables
+from marker.layout import layout as marker_layout
+from marker.layout import order as marker_order
+from marker.layout.layout import annotate_block_types
+from marker.layout.order import sort_blocks_in_reading_order
+from marker.ocr import detection as marker_detection
+from marker.ocr.lang import replace_langs_with_codes, validate_langs
+from marker.ocr.recognition import run_ocr
+from marker.pdf.extract_text import get_text_blocks
+from marker.pdf.images import render_image
+from marker.cleaners.headers import filter_header_footer, filter_common_titles
+from marker.equations.equations import replace_equations
+from marker.pdf.utils import find_filetype
+from marker.postprocessors.editor import edit_full_text
+from marker.cleaners.code import identify_code_blocks, indent_blocks
+from marker.cleaners.bullets import replace_bullets
+from marker.cleaners.headings import split_heading_blocks
+from marker.cleaners.fontstyle import find_bold_italic
+from marker.postprocessors.markdown import merge_spans, merge_lines, get_full_text
+from marker.cleaners.text import cleanup_text
+from marker.images.extract import extract_images
+from marker.images.save import images_to_dict
+from marker.settings import settings
+
+logger = logging.getLogger(__name__)
+
+BATCH_PAGE_BUDGET = int(os.environ.get("BATCH_PAGE_BUDGET", 64))
+BATCH_MULTIPLIER = int(os.environ.get("BATCH_MULTIPLIER", 1))
+# Files per task when a batch job is spread over the workers, 0 runs the
+# whole batch in one task
+BATCH_PART_FILES = int(os.environ.get("BATCH_PART_FILES", 4))
+
+
+def split_batch(items, part_files: int = BATCH_PART_FILES):
+    """
+    Function to split the files of a batch job into parts of consecutive files.
+
+    Args:
+    items (list): The files of the batch.
+    part_files (int): Maximum number of files per part, 0 for a single part.
+
+    Returns:
+    list: The parts, each a list of files.
+    """
+    if part_files <= 0:
+        return [list(items)] if items else []
+    return [list(items[i : i + part_files]) for i in range(0, len(items), part_files)]
+
+
+def plan_page_batches(page_counts, page_budget: int = BATCH_PAGE_BUDGET):
+    """
+    Function to group documents into inference batches by page budget.
+
+    Documents are taken in order and added to the current group until it
+    would exceed the budget. A document larger than the budget gets a group
+    of its own.
+
+    Args:
+    page_counts (list): (document id, page count) tuples.
+    page_budget (int): Target number of pages per group.
+
+    Returns:
+    list: Lists of document ids, one list per group.
+    """
+    groups = []
+    current = []
+    current_pages = 0
+    for doc_id, page_count in page_counts:
+        page_count = max(1, page_count)
+        if current and current_pages + page_count > page_budget:
+            groups.append(current)
+            current = []
+            current_pages = 0
+        current.append(doc_id)
+        current_pages += page_count
+    if current:
+        groups.append(current)
+    return groups
+
+
+class BatchDocument:
+    """
+    Per-document state while its pages go through shared inference batches.
+    """
+
+    def __init__(self, doc_id, pdf_file, metadata=None):
+        self.doc_id = doc_id
+        self.pdf_file = pdf_file
+        self.metadata = metadata or {}
+        self.doc = None
+        self.pages = []
+        self.images = {}
+        self.out_meta = {}
+        self.langs = None
+        self.bad_span_ids = None
+
+    def render(self, dpi: int):
+        """
+        Page images at the given DPI, rendered once and shared by the models
+        that use the same resolution.
+        """
+        if dpi not in self.images:
+            self.images[dpi] = [
+                render_image(self.doc[pnum], dpi=dpi) for pnum in range(len(self.pages))
+            ]
+        return self.images[dpi]
+
+    def close(self):
+        self.images = {}
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+
+
+def _prepare(document: BatchDocument):
+    langs = document.metadata.get("languages")
+    langs = replace_langs_with_codes(list(langs) if langs else None)
+    validate_langs(langs)
+    document.langs = langs
+
+    filetype = find_filetype(document.pdf_file)
+    document.out_meta = {"languages": langs, "filetype": filetype}
+    if filetype == "other":
+        return False
+
+    document.doc = pdfium.PdfDocument(document.pdf_file)
+    pages, toc = get_text_blocks(document.doc, document.pdf_file)
+    document.out_meta.update({"toc": toc, "pages": len(pages)})
+
+    max_len = min(len(pages), len(document.doc))
+    document.pages = pages[:max_len]
+    return True
+
+
+def _annotate(document: BatchDocument):
+    document.bad_span_ids = filter_header_footer(document.pages)
+    document.out_meta["block_stats"] = {"header_footer": len(document.bad_span_ids)}
+    annotate_block_types(document.pages)
+
+
+def _render(document: BatchDocument, model_list, batch_multiplier: int):
+    """
+    Run the document-level steps and build the markdown.
+
+    Equations are cut out of the source PDF and headers, code and headings are
+    cleaned up with statistics over the whole document, so these steps run
+    per document once the shared model batches are done.
+    """
+    texify_model, _, _, edit_model, _, _ = model_list
+    doc = document.doc
+    pages = document.pages
+    out_meta = document.out_meta
+
+    sort_blocks_in_reading_order(pages)
+
+    code_block_count = identify_code_blocks(pages)
+    out_meta["block_stats"]["code"] = code_block_count
+    indent_blocks(pages)
+
+    table_count = format_tables(pages)
+    out_meta["block_stats"]["table"] = table_count
+
+    for page in pages:
+        for block in page.blocks:
+            block.filter_spans(document.bad_span_ids)
+            block.filter_bad_span_types()
+
+    filtered, eq_stats = replace_equations(
+        doc, pages, texify_model, batch_multiplier=batch_multiplier
+    )
+    out_meta["block_stats"]["equations"] = eq_stats
+
+    if settings.EXTRACT_IMAGES:
+        extract_images(doc, pages)
+
+    split_heading_blocks(pages)
+    find_bold_italic(pages)
+
+    merged_lines = merge_spans(filtered)
+    text_blocks = merge_lines(merged_lines)
+    text_blocks = filter_common_titles(text_blocks)
+    full_text = get_full_text(text_blocks)
+    full_text = cleanup_text(full_text)
+    full_text = replace_bullets(full_text)
+
+    full_text, edit_stats = edit_full_text(
+        full_text, edit_model, batch_multiplier=batch_multiplier
+    )
+    out_meta["postprocess_stats"] = {"edit": edit_stats}
+
+    return full_text, images_to_dict(pages), out_meta
+
+
+def _shared_inputs(documents, dpi: int):
+    images = [image for document in documents for image in document.render(dpi)]
+    pages = [page for document in documents for page in document.pages]
+    return images, pages
+
+
+def _batch_size(module, batch_multiplier: int) -> int:
+    # Same batch sizes as the marker wrappers around the surya models
+    return int(module.get_batch_size() * batch_multiplier)
+
+
+def _convert_group(documents, model_list, batch_multiplier: int):
+    _, layout_model, order_model, _, detection_model, ocr_model = model_list
+    results = {}
+
+    active = []
+    for document in documents:
+        try:
+            if _prepare(document):
+                active.append(document)
+            else:
+                results[document.doc_id] = ("", {}, document.out_meta)
+        except Exception as e:
+            logger.error(f"Error preparing document {document.doc_id}: {str(e)}")
+            results[document.doc_id] = e
+
+    if not active:
+        return results
+
+    # Text line detection runs over the pages of every document at once
+    images, pages = _shared_inputs(active, settings.SURYA_DETECTOR_DPI)
+    predictions = batch_text_detection(
+        images,
+        detection_model,
+        detection_model.processor,
+        batch_size=_batch_size(marker_detection, batch_multiplier),
+    )
+    for page, prediction in zip(pages, predictions):
+        page.text_lines = prediction
+
+    # OCR re-renders pages from the source document, so it stays per document
+    with_text = []
+    for document in active:
+        try:
+            document.pages, ocr_stats = run_ocr(
+                document.doc,
+                document.pages,
+                document.langs,
+                ocr_model,
+                batch_multiplier=batch_multiplier,
+                ocr_all_pages=settings.OCR_ALL_PAGES,
+            )
+        except Exception as e:
+            logger.error(f"Error running OCR on {document.doc_id}: {str(e)}")
+            results[document.doc_id] = e
+            continue
+        document.out_meta["ocr_stats"] = ocr_stats
+        if len([b for p in document.pages for b in p.blocks]) == 0:
+            results[document.doc_id] = ("", {}, document.out_meta)
+            continue
+        with_text.append(document)
+    flush_cuda_memory()
+    if not with_text:
+        return results
+
+    images, pages = _shared_inputs(with_text, settings.SURYA_LAYOUT_DPI)
+    layout_results = batch_layout_detection(
+        images,
+        layout_model,
+        layout_model.processor,
+        detection_results=[page.text_lines for page in pages],
+        batch_size=_batch_size(marker_layout, batch_multiplier),
+    )
+    for page, layout_result in zip(pages, layout_results):
+        page.layout = layout_result
+    for document in with_text:
+        _annotate(document)
+
+    images, pages = _shared_inputs(with_text, settings.SURYA_ORDER_DPI)
+    order_results = batch_ordering(
+        images,
+        [
+            [block.bbox for block in page.layout.bboxes][: settings.ORDER_MAX_BBOXES]
+            for page in pages
+        ],
+        order_model,
+        order_model.processor,
+        batch_size=_batch_size(marker_order, batch_multiplier),
+    )
+    for page, order_result in zip(pages, order_results):
+        page.order = order_result
+    flush_cuda_memory()
+
+    for document in with_text:
+        try:
+            results[document.doc_id] = _render(document, model_list, batch_multiplier)
+        except Exception as e:
+            logger.error(f"Error rendering document {document.doc_id}: {str(e)}")
+            results[document.doc_id] = e
+    flush_cuda_memory()
+    return results
+
+
+def convert_documents_batched(
+    documents, model_list, batch_multiplier: int = BATCH_MULTIPLIER
+):
+    """
+    Function to convert several PDFs with shared model batches.
+
+    The detection, layout and reading-order models run once over the pages of
+    all documents in the group, so many small documents fill the same
+    inference batches a single large document would. The outputs are routed
+    back to each document by page and the document-level steps of
+    marker.convert.convert_single_pdf run per document, in the same order as
+    in marker-pdf 0.2.17.
+
+    If the shared stages fail, or with the stand-in engine of MARKER_ENGINE=stub,
+    every document of the group is converted on its own with
+    convert_single_pdf.
+
+    Args:
+    documents (list): (document id, pdf path or bytes, metadata) tuples.
+    model_list: The list of loaded models.
+    batch_multiplier (int): Multiplier for the marker model batch sizes.
+
+    Returns:
+    dict: Document id to (markdown, images, metadata) or the exception raised
+    for that document.
+    """
+    if MARKER_ENGINE != "stub":
+        batch = [
+            BatchDocument(doc_id, pdf_file, metadata)
+            for doc_id, pdf_file, metadata in documents
+        ]
+        try:
+            return _convert_group(batch, model_list, batch_multiplier)
+        except Exception as e:
+            logger.warning(
+                f"Batched conversion failed, converting documents one by one: {str(e)}"
+            )
+            logger.debug(traceback.format_exc())
+        finally:
+            for document in batch:
+                document.close()
+
+    results = {}
+    for doc_id, pdf_file, metadata in documents:
+        try:
+            results[doc_id] = convert_single_pdf(
+                pdf_file,
+                model_list,
+                metadata=metadata,
+                batch_multiplier=batch_multiplier,
+            )
+        except Exception as e:
+            results[doc_id] = e
+    return results
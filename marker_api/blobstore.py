@@ -0,0 +1,253 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE = os.environ.get("BLOB_STORE", "local")
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "blobs")
+BLOB_STORE_BUCKET = os.environ.get("BLOB_STORE_BUCKET", "marker-api")
+BLOB_STORE_PREFIX = os.environ.get("BLOB_STORE_PREFIX", "payloads/")
+# Point this at MinIO or another S3-compatible stand-in for local testing
+BLOB_STORE_ENDPOINT_URL = os.environ.get("BLOB_STORE_ENDPOINT_URL") or None
+BLOB_TTL_SECONDS = int(os.environ.get("BLOB_TTL_SECONDS", 24 * 3600))
+BLOB_GC_INTERVAL = int(os.environ.get("BLOB_GC_INTERVAL", 600))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def new_blob_ref(digest: str) -> str:
+    """
+    Build a blob reference from the SHA-256 of the payload.
+
+    The random suffix keeps two uploads of the same file independent, so the
+    first task to finish cannot garbage-collect the payload of the second.
+    """
+    return f"{digest}.{uuid.uuid4().hex[:12]}"
+
+
+def digest_from_ref(blob_ref: str) -> str:
+    """
+    Return the SHA-256 digest of the payload a reference points to.
+    """
+    return blob_ref.split(".", 1)[0]
+
+
+def hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class BlobStore:
+    """
+    Storage for PDF payloads shared by the API and the Celery workers.
+
+    Celery messages only carry the blob reference. Workers stream the payload
+    to a local path, and the blob is deleted once the task is done.
+    """
+
+    def put_bytes(self, data: bytes) -> str:
+        raise NotImplementedError
+
+    def put_file(self, path: str, digest: str = None) -> str:
+        raise NotImplementedError
+
+    @contextmanager
+    def local_path(self, blob_ref: str):
+        """Yield a local file path with the content of the blob."""
+        raise NotImplementedError
+
+    def get_bytes(self, blob_ref: str) -> bytes:
+        with self.local_path(blob_ref) as path:
+            with open(path, "rb") as f:
+                return f.read()
+
+    def delete(self, blob_ref: str):
+        raise NotImplementedError
+
+    def gc_expired(self, ttl: int = BLOB_TTL_SECONDS) -> int:
+        """Delete blobs older than ttl seconds and return how many were removed."""
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blob store on a filesystem shared by the API and the workers (a host
+    folder or a Docker/NFS volume).
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, blob_ref: str) -> str:
+        if os.sep in blob_ref or "/" in blob_ref:
+            raise ValueError(f"Invalid blob reference: {blob_ref}")
+        return os.path.join(self.root, blob_ref[:2], blob_ref)
+
+    def _commit(self, tmp_path: str, digest: str) -> str:
+        blob_ref = new_blob_ref(digest)
+        path = self._path(blob_ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return blob_ref
+
+    def _tmp_path(self) -> str:
+        return os.path.join(self.root, f".{uuid.uuid4().hex}.tmp")
+
+    def put_bytes(self, data: bytes) -> str:
+        tmp_path = self._tmp_path()
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return self._commit(tmp_path, hashlib.sha256(data).hexdigest())
+
+    def put_file(self, path: str, digest: str = None) -> str:
+        digest = digest or hash_file(path)
+        tmp_path = self._tmp_path()
+        try:
+            # A hard link is free when the file is on the same filesystem. It
+            # keeps the mtime of the source, gc_expired goes by the ctime the
+            # link sets
+            os.link(path, tmp_path)
+        except OSError:
+            shutil.copyfile(path, tmp_path)
+        return self._commit(tmp_path, digest)
+
+    @contextmanager
+    def local_path(self, blob_ref: str):
+        path = self._path(blob_ref)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Blob {blob_ref} does not exist")
+        yield path
+
+    def delete(self, blob_ref: str):
+        try:
+            os.remove(self._path(blob_ref))
+        except FileNotFoundError:
+            pass
+
+    def gc_expired(self, ttl: int = BLOB_TTL_SECONDS) -> int:
+        cutoff = time.time() - ttl
+        removed = 0
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    # A blob hard-linked from an old input file has an old
+                    # mtime, its ctime is the time it was stored
+                    stat = os.stat(path)
+                    if max(stat.st_mtime, stat.st_ctime) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+class S3BlobStore(BlobStore):
+    """
+    Blob store on S3 or an S3-compatible service such as MinIO.
+    """
+
+    def __init__(
+        self,
+        bucket: str = BLOB_STORE_BUCKET,
+        prefix: str = BLOB_STORE_PREFIX,
+        endpoint_url: str = BLOB_STORE_ENDPOINT_URL,
+    ):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError(
+                "BLOB_STORE=s3 requires boto3. Install it with `pip install boto3`."
+            )
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, blob_ref: str) -> str:
+        return f"{self.prefix}{blob_ref}"
+
+    def put_bytes(self, data: bytes) -> str:
+        blob_ref = new_blob_ref(hashlib.sha256(data).hexdigest())
+        self.client.put_object(Bucket=self.bucket, Key=self._key(blob_ref), Body=data)
+        return blob_ref
+
+    def put_file(self, path: str, digest: str = None) -> str:
+        blob_ref = new_blob_ref(digest or hash_file(path))
+        self.client.upload_file(path, self.bucket, self._key(blob_ref))
+        return blob_ref
+
+    @contextmanager
+    def local_path(self, blob_ref: str):
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self.client.download_fileobj(self.bucket, self._key(blob_ref), f)
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete(self, blob_ref: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(blob_ref))
+
+    def gc_expired(self, ttl: int = BLOB_TTL_SECONDS) -> int:
+        cutoff = time.time() - ttl
+        removed = 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                if item["LastModified"].timestamp() < cutoff:
+                    self.client.delete_object(Bucket=self.bucket, Key=item["Key"])
+                    removed += 1
+        return removed
+
+
+_blob_store = None
+_blob_store_lock = threading.Lock()
+_last_gc = 0.0
+
+
+def get_blob_store() -> BlobStore:
+    """
+    Return the process-wide blob store selected by BLOB_STORE.
+    """
+    global _blob_store
+    with _blob_store_lock:
+        if _blob_store is None:
+            if BLOB_STORE == "s3":
+                _blob_store = S3BlobStore()
+            elif BLOB_STORE == "local":
+                _blob_store = LocalBlobStore()
+            else:
+                raise ValueError(f"Unknown BLOB_STORE: {BLOB_STORE}")
+    return _blob_store
+
+
+def maybe_gc_expired():
+    """
+    Sweep expired blobs at most once every BLOB_GC_INTERVAL seconds.
+
+    Blobs are deleted when their task finishes; the sweep catches payloads of
+    tasks that were lost or failed before cleaning up.
+    """
+    global _last_gc
+    now = time.time()
+    if now - _last_gc < BLOB_GC_INTERVAL:
+        return
+    _last_gc = now
+    try:
+        removed = get_blob_store().gc_expired()
+        if removed:
+            logger.info(f"Removed {removed} expired blobs")
+    except Exception as e:
+        logger.warning(f"Blob garbage collection failed: {str(e)}")
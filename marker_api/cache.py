@@ -0,0 +1,304 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from importlib import metadata as importlib_metadata
+from marker_api.models import INFERENCE_PROFILE, profile_model_names
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+RESULT_CACHE_MEMORY_MB = float(os.environ.get("RESULT_CACHE_MEMORY_MB", 256))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "cache/results")
+RESULT_CACHE_DISK_MB = float(os.environ.get("RESULT_CACHE_DISK_MB", 2048))
+
+# Packages whose upgrade can change the conversion output
+ENGINE_PACKAGES = ("marker-pdf", "surya-ocr", "texify", "pdftext")
+
+
+def get_engine_version() -> str:
+    """
+    Build a version string for the conversion engine.
+
+    Returns:
+    str: The installed versions of the packages that produce the output.
+    """
+    versions = []
+    for package in ENGINE_PACKAGES:
+        try:
+            version = importlib_metadata.version(package)
+        except importlib_metadata.PackageNotFoundError:
+            version = "missing"
+        versions.append(f"{package}={version}")
+    return ";".join(versions)
+
+
+ENGINE_VERSION = get_engine_version()
+# Quantized models change the output, so do the profile and the models it
+# applies to, see INFERENCE_PROFILE in marker_api.models
+if INFERENCE_PROFILE != "fp32":
+    ENGINE_VERSION += f";profile={INFERENCE_PROFILE}:{','.join(profile_model_names())}"
+
+
+def hash_pdf(pdf_content: bytes) -> str:
+    """
+    Compute the SHA-256 digest of a PDF payload.
+
+    Args:
+    pdf_content (bytes): The content of the PDF file.
+
+    Returns:
+    str: The hex digest of the content.
+    """
+    return hashlib.sha256(pdf_content).hexdigest()
+
+
+def make_cache_key(pdf_digest: str, options: dict = None) -> str:
+    """
+    Build the cache key for a conversion.
+
+    Args:
+    pdf_digest (str): SHA-256 digest of the PDF bytes.
+    options (dict): Conversion options that influence the output.
+
+    Returns:
+    str: The hex digest identifying the conversion result.
+    """
+    key_data = json.dumps(
+        {"pdf": pdf_digest, "options": options or {}, "engine": ENGINE_VERSION},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for conversion results.
+
+    Results are kept as serialized JSON in a bounded in-memory LRU and in a
+    size-capped directory on disk. The disk tier can be shared by several
+    processes (API workers and Celery workers on the same host or volume).
+    """
+
+    def __init__(
+        self,
+        cache_dir=RESULT_CACHE_DIR,
+        memory_limit_mb=RESULT_CACHE_MEMORY_MB,
+        disk_limit_mb=RESULT_CACHE_DISK_MB,
+    ):
+        self.cache_dir = cache_dir
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.disk_limit = int(disk_limit_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+        self._disk_bytes = 0
+        if self.disk_limit > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = self.disk_usage()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, payload: str):
+        size = len(payload)
+        if size > self.memory_limit:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._memory[key] = payload
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_limit:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def get(self, key: str):
+        """
+        Look up a conversion result.
+
+        Args:
+        key (str): The cache key built by make_cache_key.
+
+        Returns:
+        dict: A fresh copy of the cached result, or None on a miss.
+        """
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return json.loads(payload)
+
+        if self.disk_limit > 0:
+            path = self._disk_path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    payload = f.read()
+                # Bump the mtime so disk eviction is least-recently-used
+                os.utime(path)
+            except (FileNotFoundError, OSError):
+                payload = None
+            if payload is not None:
+                self._remember(key, payload)
+                with self._lock:
+                    self.counters["disk_hits"] += 1
+                return json.loads(payload)
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key: str, result: dict):
+        """
+        Store a conversion result in both tiers.
+
+        Args:
+        key (str): The cache key built by make_cache_key.
+        result (dict): A JSON-serializable conversion result.
+        """
+        payload = json.dumps(result, ensure_ascii=False)
+        self._remember(key, payload)
+        with self._lock:
+            self.counters["stores"] += 1
+
+        data = payload.encode("utf-8")
+        if self.disk_limit <= 0 or len(data) > self.disk_limit:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            # An overwritten entry no longer counts towards the disk usage
+            try:
+                replaced_size = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {str(e)}")
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - replaced_size
+            over_limit = self._disk_bytes > self.disk_limit
+        if over_limit:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                # Temporary files are entries still being written
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        # Evict down to 90% of the cap so we don't rescan on every store
+        target = int(self.disk_limit * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.counters["evictions"] += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    def disk_usage(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+        return total
+
+    def stats(self) -> dict:
+        """
+        Return the hit/miss counters and the size of both tiers.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["disk_bytes"] = self._disk_bytes
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["engine"] = ENGINE_VERSION
+        return stats
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Return the process-wide result cache, or None when caching is disabled.
+    """
+    global _result_cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+    return _result_cache
+
+
+def cached_conversion(pdf_digest: str, options: dict, convert):
+    """
+    Run a conversion through the result cache.
+
+    Args:
+    pdf_digest (str): SHA-256 digest of the PDF bytes (see hash_pdf).
+    options (dict): Conversion options that are part of the cache key.
+    convert (callable): Produces the JSON-serializable result on a miss.
+
+    Returns:
+    tuple: The result and whether it was served from the cache.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return convert(), False
+
+    key = make_cache_key(pdf_digest, options)
+    result = cache.get(key)
+    if result is not None:
+        logger.info(f"Result cache hit for {key}")
+        return result, True
+
+    logger.debug(f"Result cache miss for {key}")
+    result = convert()
+    cache.put(key, result)
+    return result, False
@@ -1,17 +1,92 @@
-from fastapi import UploadFile, File
+from fastapi import UploadFile, File, WebSocket, WebSocketDisconnect
 from celery.result import AsyncResult
-from fastapi.responses import JSONResponse
+from celery.utils import uuid
+from fastapi.responses import JSONResponse, StreamingResponse
 from marker_api.celery_tasks import convert_pdf_to_markdown, process_batch
+from marker_api.blobstore import get_blob_store
+from marker_api.events import sse_frame, task_events, wait_for_task
+from marker_api.batch_results import batch_progress, get_file_result, list_file_results
+from marker_api.pages import get_page_count
+from marker_api.queues import choose_queue
+from marker_api.result_store import unpack_result
+from marker_api.uploads import spooled_uploads
+from marker_api.webhooks import register_callback
 import logging
 import asyncio
+import os
 from typing import List
 
 logger = logging.getLogger(__name__)
 
 
-async def celery_convert_pdf(pdf_file: UploadFile = File(...)):
-    contents = await pdf_file.read()
-    task_id = convert_pdf_to_markdown.delay(pdf_file.filename, contents)
+def image_options(image_mode: str = "inline", image_format: str = "png", image_quality: int = None):
+    """
+    Image delivery options sent along with a conversion task.
+
+    With image_mode=url the worker writes the images to the output store and
+    the task result only carries their URLs.
+    """
+    return {"mode": image_mode, "format": image_format, "quality": image_quality}
+
+
+async def store_uploads(pdf_files: List[UploadFile], interactive: bool = True):
+    """
+    Spool uploaded PDFs to disk and put them in the blob store.
+
+    Only the references travel through the broker; the worker fetches the
+    payload and deletes it when the task is done. The spooled files are also
+    inspected for their page counts to pick the queue of the submission.
+
+    Returns:
+    tuple: Blob references in upload order, and the queue name.
+    """
+    blob_store = get_blob_store()
+    blob_refs = []
+    page_counts = []
+    sizes = []
+    async with spooled_uploads(pdf_files) as uploads:
+        for upload in uploads:
+            blob_ref = await asyncio.to_thread(
+                blob_store.put_file, upload.path, upload.sha256
+            )
+            blob_refs.append(blob_ref)
+            page_counts.append(await asyncio.to_thread(get_page_count, upload.path))
+            sizes.append(upload.size)
+    return blob_refs, choose_queue(page_counts, sizes, interactive)
+
+
+async def store_upload(pdf_file: UploadFile, interactive: bool = True):
+    (blob_ref,), queue = await store_uploads([pdf_file], interactive)
+    return blob_ref, queue
+
+
+async def submission_id(callback_url: str = None, callback_per_file: bool = False) -> str:
+    """
+    Return the task id of a new submission, with its callback registered
+    before the task can finish.
+    """
+    task_id = uuid()
+    if callback_url:
+        await asyncio.to_thread(register_callback, task_id, callback_url, callback_per_file)
+    return task_id
+
+
+async def celery_convert_pdf(
+    pdf_file: UploadFile = File(...),
+    image_mode: str = "inline",
+    image_format: str = "png",
+    image_quality: int = None,
+    conversion_mode: str = None,
+):
+    blob_ref, queue = await store_upload(pdf_file)
+    task_id = convert_pdf_to_markdown.apply_async(
+        (pdf_file.filename, blob_ref),
+        {
+            "image_options": image_options(image_mode, image_format, image_quality),
+            "conversion_mode": conversion_mode,
+        },
+        queue=queue,
+    )
     return {"task_id": str(task_id), "status": "Processing"}
 
 
@@ -21,7 +96,7 @@ async def celery_result(task_id: str):
         return JSONResponse(
             status_code=202, content={"task_id": str(task_id), "status": "Processing"}
         )
-    result = task.get()
+    result = await asyncio.to_thread(lambda: unpack_result(task.get()))
     return {"task_id": task_id, "status": "Success", "result": result}
 
 
@@ -29,31 +104,49 @@ async def celery_offline_root():
     return {"message": "Celery is offline. No API is available."}
 
 
-async def celery_convert_pdf_sync(pdf_file: UploadFile = File(...)):
-    contents = await pdf_file.read()
-    task = convert_pdf_to_markdown.delay(pdf_file.filename, contents)
-    result = task.get(timeout=600)  # 10-minute timeout
+async def celery_convert_pdf_sync(
+    pdf_file: UploadFile = File(...),
+    image_mode: str = "inline",
+    image_format: str = "png",
+    image_quality: int = None,
+    conversion_mode: str = None,
+):
+    blob_ref, queue = await store_upload(pdf_file)
+    task = convert_pdf_to_markdown.apply_async(
+        (pdf_file.filename, blob_ref),
+        {
+            "image_options": image_options(image_mode, image_format, image_quality),
+            "conversion_mode": conversion_mode,
+        },
+        queue=queue,
+    )
+    result = unpack_result(task.get(timeout=600))  # 10-minute timeout
     return {"status": "Success", "result": result}
 
 
-async def celery_convert_pdf_concurrent_await(pdf_file: UploadFile = File(...)):
-    contents = await pdf_file.read()
+async def celery_convert_pdf_concurrent_await(
+    pdf_file: UploadFile = File(...),
+    image_mode: str = "inline",
+    image_format: str = "png",
+    image_quality: int = None,
+    conversion_mode: str = None,
+):
+    blob_ref, queue = await store_upload(pdf_file)
 
     # Start the Celery task
-    task = convert_pdf_to_markdown.delay(pdf_file.filename, contents)
-
-    # Define an asynchronous function to check task status
-    async def check_task_status():
-        while True:
-            if task.ready():
-                return task.get()
-            await asyncio.sleep(1)  # Wait for 1 second before checking again
+    task = convert_pdf_to_markdown.apply_async(
+        (pdf_file.filename, blob_ref),
+        {
+            "image_options": image_options(image_mode, image_format, image_quality),
+            "conversion_mode": conversion_mode,
+        },
+        queue=queue,
+    )
 
     try:
-        # Wait for the task to complete with a timeout
-        result = await asyncio.wait_for(
-            check_task_status(), timeout=600
-        )  # 10-minute timeout
+        # Woken by the completion event of the task, with a 10-minute timeout
+        await wait_for_task(task.id, timeout=600)
+        result = await asyncio.to_thread(lambda: unpack_result(task.get()))
         return {"status": "Success", "result": result}
     except asyncio.TimeoutError:
         return JSONResponse(
@@ -107,38 +200,124 @@ async def celery_convert_pdf_concurrent_await(pdf_file: UploadFile = File(...)):
 #         )
 
 
-async def celery_batch_convert(pdf_files: List[UploadFile] = File(...)):
-    batch_data = []
-    for pdf_file in pdf_files:
-        contents = await pdf_file.read()
-        batch_data.append((pdf_file.filename, contents))
-
+async def celery_batch_convert(
+    pdf_files: List[UploadFile] = File(...),
+    image_mode: str = "inline",
+    image_format: str = "png",
+    image_quality: int = None,
+    conversion_mode: str = None,
+    callback_url: str = None,
+    callback_per_file: bool = False,
+):
+    blob_refs, queue = await store_uploads(pdf_files, interactive=False)
+    batch_data = [
+        (pdf_file.filename, blob_ref) for pdf_file, blob_ref in zip(pdf_files, blob_refs)
+    ]
+
+    task_id = await submission_id(callback_url, callback_per_file)
     # Start a single task to process the entire batch
-    task = process_batch.delay(batch_data)
+    task = process_batch.apply_async(
+        (batch_data,),
+        {
+            "image_options": image_options(image_mode, image_format, image_quality),
+            "conversion_mode": conversion_mode,
+        },
+        queue=queue,
+        task_id=task_id,
+    )
 
     return {"task_id": str(task.id), "status": "Processing", "total": len(batch_data)}
 
 
-async def celery_batch_convert_local(pdf_files: List[UploadFile] = File(...)):
+async def celery_batch_convert_local(
+    input_folder: str = "input",
+    image_mode: str = "inline",
+    image_format: str = "png",
+    image_quality: int = None,
+    conversion_mode: str = None,
+    callback_url: str = None,
+    callback_per_file: bool = False,
+):
+    blob_store = get_blob_store()
     batch_data = []
-    for pdf_file in pdf_files:
-        contents = await pdf_file.read()
-        batch_data.append((pdf_file.filename, contents))
-
+    page_counts = []
+    sizes = []
+    for filename in sorted(os.listdir(input_folder)):
+        if filename.lower().endswith(".pdf"):
+            file_path = os.path.join(input_folder, filename)
+            # Files are linked or copied into the store, never read into memory
+            blob_ref = await asyncio.to_thread(blob_store.put_file, file_path)
+            batch_data.append((filename, blob_ref))
+            page_counts.append(await asyncio.to_thread(get_page_count, file_path))
+            sizes.append(os.path.getsize(file_path))
+
+    task_id = await submission_id(callback_url, callback_per_file)
     # Start a single task to process the entire batch
-    task = process_batch.delay(batch_data)
+    task = process_batch.apply_async(
+        (batch_data,),
+        {
+            "image_options": image_options(image_mode, image_format, image_quality),
+            "conversion_mode": conversion_mode,
+        },
+        queue=choose_queue(page_counts, sizes, interactive=False),
+        task_id=task_id,
+    )
 
     return {"task_id": str(task.id), "status": "Processing", "total": len(batch_data)}
 
 
+def batch_status(task: AsyncResult) -> str:
+    if not task.ready():
+        return "Processing"
+    return "Success" if task.successful() else "Error"
+
+
+async def celery_batch_files(
+    task_id: str, cursor: int = 0, limit: int = 100, include_results: bool = False
+):
+    """
+    List the files of a batch finished since the cursor, while the batch runs.
+
+    Clients poll with the next_cursor of the previous response to only get
+    the files finished since then.
+    """
+    listing = await asyncio.to_thread(
+        list_file_results, task_id, cursor, limit, include_results
+    )
+    return {"task_id": task_id, "status": batch_status(AsyncResult(task_id)), **listing}
+
+
+async def celery_batch_file(task_id: str, file: str):
+    """
+    Return the result of one file of a batch by its index or file name.
+    """
+    entry = await asyncio.to_thread(get_file_result, task_id, file)
+    if entry is not None:
+        return entry
+    task = AsyncResult(task_id)
+    if not task.ready():
+        return JSONResponse(
+            status_code=202,
+            content={"task_id": str(task_id), "file": file, "status": "Processing"},
+        )
+    return JSONResponse(
+        status_code=404,
+        content={"task_id": str(task_id), "file": file, "status": "Not found"},
+    )
+
+
 async def celery_batch_result(task_id: str):
     task = AsyncResult(task_id)
 
     if not task.ready():
-        # Check if we can access task information
-        if task.info and isinstance(task.info, dict) and "current" in task.info:
+        # Files are counted as they finish, also while the parts of a split
+        # batch run on other workers
+        progress = await asyncio.to_thread(batch_progress, task_id)
+        current, total = progress["completed"], progress["total"]
+        if not total and isinstance(task.info, dict) and "current" in task.info:
             current = task.info["current"]
             total = task.info["total"]
+        if total:
             return JSONResponse(
                 status_code=202,
                 content={
@@ -158,7 +337,7 @@ async def celery_batch_result(task_id: str):
             )
 
     try:
-        results = task.get()
+        results = await asyncio.to_thread(lambda: unpack_result(task.get()))
         return JSONResponse(
             status_code=200,
             content={
@@ -180,3 +359,36 @@ async def celery_batch_result(task_id: str):
                 "message": "An error occurred while retrieving the results",
             },
         )
+
+
+async def celery_task_events_sse(task_id: str):
+    """
+    Stream the events of a task or batch as Server-Sent Events.
+
+    The stream starts with the current state, sends a "file" event for every
+    finished file of a batch and ends with the final "task" event. The
+    result is then fetched from the result endpoints.
+    """
+
+    async def frames():
+        async for event in task_events(task_id):
+            yield sse_frame(event)
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def celery_task_events_ws(websocket: WebSocket, task_id: str):
+    """
+    Send the events of a task or batch over a WebSocket, as JSON messages.
+    """
+    await websocket.accept()
+    try:
+        async for event in task_events(task_id):
+            await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.debug(f"Event listener of task {task_id} disconnected")
@@ -1,26 +1,77 @@
-from celery import Task
+from celery import Task, chord, group, states
 from marker_api.celery_worker import celery_app
-from marker.convert import convert_single_pdf
-from marker.models import load_all_models
-import io
+from marker.settings import settings
 import logging
-from marker_api.utils import process_image_to_base64
-from celery.signals import worker_process_init
+from contextlib import ExitStack
+from marker_api.cache import cached_conversion, get_result_cache, make_cache_key
+from marker_api.blobstore import digest_from_ref, get_blob_store, maybe_gc_expired
+from marker_api.batching import convert_documents_batched, plan_page_batches, split_batch
+from marker_api.image_delivery import deliver_images, encode_images, image_cache_options
+from marker_api.fastpath import conversion_cache_options, convert_pdf, resolve_mode
+from marker_api.pages import (
+    get_page_count,
+    should_fan_out,
+    split_page_ranges,
+    stitch_page_ranges,
+)
+from marker_api.queues import record_latency
+from marker_api.result_store import get_result_store, pack_result, unpack_result
+from marker_api.batch_results import record_file_result, start_batch
+from marker_api.events import publish_task_done
+from marker_api.webhooks import queue_task_callback
+from marker_api import workers
+from marker_api.topology import apply_layout
+from marker_api.models import SHARED_MODELS, get_models, load_models
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_init,
+    worker_ready,
+    worker_shutdown,
+)
+from celery.worker.control import inspect_command
+import base64
 import json
 import os
+import time
 import yaml
 
 logger = logging.getLogger(__name__)
 
+OUTPUT_FOLDER = '/home/dataq/marker-system/marker-api/output'
+
 model_list = None
 metadata_dict = None
+task_started = {}
+
+
+@worker_init.connect
+def apply_worker_layout(**kwargs):
+    # Pin to the cores handed over by the launcher before any model is loaded
+    apply_layout()
+
+
+@worker_init.connect
+def load_shared_models(**kwargs):
+    # The main process loads the models before the prefork pool forks the
+    # children, which then share the weights instead of loading their own
+    global model_list
+    if not SHARED_MODELS:
+        return
+    if settings.TORCH_DEVICE_MODEL == "cuda":
+        logger.warning("Models on CUDA cannot be shared with forked children, not sharing")
+        return
+    model_list = load_models(share_memory=True)
+    print("Models loaded in the main process, shared with the pool")
 
 
 @worker_process_init.connect
 def initialize_models(**kwargs):
     global model_list, metadata_dict
     if not model_list:
-        model_list = load_all_models()
+        model_list = get_models()
         print("Models loaded at worker startup")
     if metadata_dict is None:
         metadata_path = os.path.join(os.path.dirname(__file__), '../metadata_template.json')
@@ -31,6 +82,130 @@ def initialize_models(**kwargs):
         print("Metadata loaded at worker startup")
 
 
+@task_postrun.connect
+def collect_expired_blobs(**kwargs):
+    maybe_gc_expired()
+    get_result_store().maybe_gc_expired()
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    # Custom headers show up as attributes of task.request on the worker
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+@task_prerun.connect
+def mark_task_started(task_id=None, task=None, **kwargs):
+    task_started[task_id] = time.time()
+    # Runs in the pool process executing the task, not in the process that
+    # sends the heartbeat
+    hostname = getattr(task.request, "hostname", None) if task else None
+    if hostname:
+        workers.record_task_started(hostname, task_id, task.name)
+
+
+@task_postrun.connect
+def record_queue_latency(task_id=None, task=None, state=None, **kwargs):
+    started = task_started.pop(task_id, None)
+    if started is None or task is None:
+        return
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    enqueued_at = getattr(task.request, "enqueued_at", None) or started
+    if queue:
+        record_latency(
+            queue, started - enqueued_at, time.time() - started, failed=state == "FAILURE"
+        )
+
+
+@task_postrun.connect
+def mark_task_finished(task=None, state=None, **kwargs):
+    hostname = getattr(task.request, "hostname", None) if task else None
+    if hostname:
+        workers.record_task_finished(hostname, failed=state == states.FAILURE)
+
+
+@worker_ready.connect
+def start_worker_heartbeat(sender=None, **kwargs):
+    # The worker registry of the server is fed by these heartbeats
+    task_consumer = getattr(sender, "task_consumer", None)
+    queues = [queue.name for queue in task_consumer.queues] if task_consumer else None
+    # The sender is the consumer, the pool size is set on its worker
+    concurrency = getattr(getattr(sender, "controller", None), "concurrency", None) or 1
+    workers.start_heartbeat(getattr(sender, "hostname", None), queues, concurrency)
+
+
+@worker_shutdown.connect
+def stop_worker_heartbeat(**kwargs):
+    workers.stop_heartbeat()
+
+
+@task_postrun.connect
+def notify_task_done(task_id=None, task=None, state=None, args=None, **kwargs):
+    # The result is stored by now. A batch that split itself ends with state
+    # IGNORED and is announced by its aggregating task, which has its id
+    publish_task_done(task_id, state)
+    queue_task_callback(task_id, state)
+    # A failed part fails the whole batch, whose aggregating task never runs
+    if task is not None and task.name == "process_batch_part" and state == states.FAILURE:
+        publish_task_done(args[0], state)
+        queue_task_callback(args[0], state)
+
+
+@inspect_command()
+def cache_stats(state):
+    """Report this worker's result cache counters."""
+    cache = get_result_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+
+def unpack_image_options(image_options):
+    """
+    Return the (mode, format, quality) of the image options sent with a task.
+    """
+    image_options = image_options or {}
+    return (
+        image_options.get("mode", "inline"),
+        image_options.get("format", "png"),
+        image_options.get("quality"),
+    )
+
+
+def conversion_cache_key(blob_ref, metadata, image_options, conversion_mode=None):
+    _, image_format, image_quality = unpack_image_options(image_options)
+    options = {
+        "metadata": metadata,
+        **image_cache_options(image_format, image_quality),
+        **conversion_cache_options(conversion_mode),
+    }
+    return make_cache_key(digest_from_ref(blob_ref), options)
+
+
+def convert_documents(documents, conversion_mode=None):
+    """
+    Convert (id, path, metadata) documents of a batch.
+
+    Full conversions share the model batches across documents. With the fast
+    path the pages are classified per document, so documents are converted
+    one by one and only their OCR pages reach the models.
+
+    Returns:
+    dict: Document id to (markdown, images, metadata), or the exception.
+    """
+    if resolve_mode(conversion_mode) == "full":
+        return convert_documents_batched(documents, model_list)
+    outputs = {}
+    for doc_id, pdf_path, metadata in documents:
+        try:
+            outputs[doc_id] = convert_pdf(
+                pdf_path, model_list, conversion_mode, metadata=metadata
+            )
+        except Exception as e:
+            logger.error(f"Error converting document {doc_id}: {str(e)}")
+            outputs[doc_id] = e
+    return outputs
+
+
 class PDFConversionTask(Task):
     abstract = True
 
@@ -77,44 +252,239 @@ def save_markdown(out_folder, fname, full_text, images, out_metadata):
 
     for filename, image in images.items():
         image_filepath = os.path.join(subfolder_path, filename)
-        image.save(image_filepath, "PNG")
+        if isinstance(image, str):
+            # Page-range results arrive already encoded as base64 PNG
+            with open(image_filepath, "wb") as f:
+                f.write(base64.b64decode(image))
+        else:
+            image.save(image_filepath, "PNG")
 
     return subfolder_path
 
 @celery_app.task(
     ignore_result=False, bind=True, base=PDFConversionTask, name="convert_pdf"
 )
-def convert_pdf_to_markdown(self, filename, pdf_content):
-    pdf_file = io.BytesIO(pdf_content)
-    out_folder = '/home/dataq/marker-system/marker-api/output'
+def convert_pdf_to_markdown(
+    self, filename, blob_ref, allow_fanout=True, image_options=None, conversion_mode=None
+):
+    out_folder = OUTPUT_FOLDER
     # 
     print("Check metadata_dict:", metadata_dict)
     metadata = metadata_dict.get(filename, {})
     print("Check metadata:", metadata)
-    markdown_text, images, out_metadata = convert_single_pdf(pdf_file, model_list, metadata=metadata)
+    image_mode, image_format, image_quality = unpack_image_options(image_options)
+    options = {
+        "metadata": metadata,
+        **image_cache_options(image_format, image_quality),
+        **conversion_cache_options(conversion_mode),
+    }
+    blob_store = get_blob_store()
+    replaced = False
+
+    def convert():
+        nonlocal replaced
+        with blob_store.local_path(blob_ref) as pdf_path:
+            if allow_fanout:
+                page_count = get_page_count(pdf_path)
+                if should_fan_out(page_count):
+                    # The chord callback takes over this task id, its result
+                    # and the cleanup of the blob
+                    replaced = True
+                    raise self.replace(
+                        fan_out_page_ranges(
+                            filename,
+                            blob_ref,
+                            metadata,
+                            page_count,
+                            image_options,
+                            queue=(self.request.delivery_info or {}).get("routing_key"),
+                            conversion_mode=conversion_mode,
+                        )
+                    )
+            markdown_text, images, out_metadata = convert_pdf(
+                pdf_path, model_list, conversion_mode, metadata=metadata
+            )
+        return finish_conversion(
+            out_folder,
+            filename,
+            markdown_text,
+            images,
+            metadata,
+            image_format,
+            image_quality,
+            out_metadata.get("page_modes"),
+        )
+
+    try:
+        # Identical PDFs with the same template metadata reuse the previous result
+        result, cached = cached_conversion(digest_from_ref(blob_ref), options, convert)
+    finally:
+        if not replaced:
+            blob_store.delete(blob_ref)
+    return pack_result(conversion_result(filename, result, metadata, cached, image_mode))
+
+
+def finish_conversion(
+    out_folder,
+    filename,
+    markdown_text,
+    images,
+    metadata,
+    image_format="png",
+    image_quality=None,
+    page_modes=None,
+):
+    """
+    Save a converted document and encode its images for the task result.
+
+    Returns:
+    dict: The markdown and base64 images, as stored in the result cache, and
+    the page modes of fast path conversions.
+    """
     if len(markdown_text.strip()) > 0:
-        # Merge custom metadata with out_metadata
-        if metadata:
-            out_metadata.update(metadata)
         save_markdown(out_folder, filename, markdown_text, images, metadata)
     else:
         print(f"Empty file. Could not convert.")
-    merged_metadata = {**out_metadata, **metadata}
-    image_data = {}
-    for i, (img_filename, image) in enumerate(images.items()):
-        logger.debug(f"Processing image {img_filename}")
-        image_base64 = process_image_to_base64(image, img_filename)
-        image_data[img_filename] = image_base64
+    markdown_text, image_data = encode_images(
+        markdown_text, images, image_format, image_quality
+    )
+    conversion = {"markdown": markdown_text, "images": image_data}
+    if page_modes is not None:
+        conversion["page_modes"] = page_modes
+    return conversion
+
 
+def conversion_result(filename, conversion, metadata, cached=False, image_mode="inline"):
+    # With image_mode=url only the image URLs go through the result backend
+    conversion = deliver_images(conversion, image_mode)
+    if conversion.get("page_modes") is not None:
+        metadata = {**metadata, "page_modes": conversion["page_modes"]}
     return {
         "filename": filename,
-        "markdown": markdown_text,
+        "markdown": conversion["markdown"],
         "metadata": metadata,
-        "images": image_data,
+        "images": conversion["images"],
         "status": "ok",
+        "cached": cached,
     }
 
 
+def fan_out_page_ranges(
+    filename,
+    blob_ref,
+    metadata,
+    page_count,
+    image_options=None,
+    queue=None,
+    conversion_mode=None,
+):
+    """
+    Build a chord that converts a large PDF as page ranges on many workers.
+
+    Args:
+    filename (str): The name of the PDF file.
+    blob_ref (str): Blob store reference of the PDF file.
+    metadata (dict): Template metadata for the file.
+    page_count (int): The number of pages of the PDF.
+    image_options (dict): Image mode, format and quality of the result.
+    queue (str): Queue of the page-range tasks, defaults to the task routes.
+    conversion_mode (str): auto, full or text, see marker_api.fastpath.
+
+    Returns:
+    celery.canvas.Signature: The chord of page-range tasks and the stitch task.
+    """
+    page_ranges = split_page_ranges(page_count)
+    logger.info(
+        f"Splitting {filename} ({page_count} pages) into {len(page_ranges)} page ranges"
+    )
+    options = {"queue": queue} if queue else {}
+    header = group(
+        convert_pdf_page_range.s(
+            blob_ref, start_page, max_pages, metadata, image_options, conversion_mode
+        ).set(**options)
+        for start_page, max_pages in page_ranges
+    )
+    return chord(
+        header,
+        stitch_page_range_results.s(
+            filename, metadata, blob_ref, image_options, conversion_mode
+        ).set(**options),
+    ).on_error(fail_page_ranges.s(blob_ref))
+
+
+@celery_app.task(
+    ignore_result=False, bind=True, base=PDFConversionTask, name="convert_pdf_page_range"
+)
+def convert_pdf_page_range(
+    self, blob_ref, start_page, max_pages, metadata, image_options=None, conversion_mode=None
+):
+    _, image_format, image_quality = unpack_image_options(image_options)
+    with get_blob_store().local_path(blob_ref) as pdf_path:
+        markdown_text, images, out_metadata = convert_pdf(
+            pdf_path, model_list, conversion_mode, start_page, max_pages, metadata
+        )
+    markdown_text, image_data = encode_images(
+        markdown_text, images, image_format, image_quality
+    )
+    return pack_result(
+        {
+            "start_page": start_page,
+            "markdown": markdown_text,
+            "images": image_data,
+            "metadata": out_metadata,
+        }
+    )
+
+
+@celery_app.task(name="fail_page_ranges")
+def fail_page_ranges(request, exc, traceback, blob_ref):
+    """
+    Errback of a fanned-out conversion with a failed page range.
+
+    The stitch task, which has the id of the original task, never runs, so
+    the failure is announced here and the PDF is removed from the blob store.
+    Celery calls it in the worker of the last page range, with the request
+    of the stitch task.
+    """
+    task_id = request.id
+    # Celery stores the failure after its errbacks, waiters woken by the
+    # event must already find it
+    celery_app.backend.mark_as_failure(task_id, exc)
+    publish_task_done(task_id, states.FAILURE)
+    queue_task_callback(task_id, states.FAILURE)
+    get_blob_store().delete(blob_ref)
+
+
+@celery_app.task(
+    ignore_result=False, bind=True, base=PDFConversionTask, name="stitch_page_ranges"
+)
+def stitch_page_range_results(
+    self, parts, filename, metadata, blob_ref, image_options=None, conversion_mode=None
+):
+    get_blob_store().delete(blob_ref)
+    parts = [unpack_result(part) for part in parts]
+    markdown_text, image_data, out_metadata = stitch_page_ranges(parts)
+    if len(markdown_text.strip()) > 0:
+        save_markdown(OUTPUT_FOLDER, filename, markdown_text, image_data, metadata)
+    else:
+        print(f"Empty file. Could not convert.")
+
+    conversion = {"markdown": markdown_text, "images": image_data}
+    if out_metadata.get("page_modes") is not None:
+        conversion["page_modes"] = out_metadata["page_modes"]
+    cache = get_result_cache()
+    if cache is not None:
+        cache.put(
+            conversion_cache_key(blob_ref, metadata, image_options, conversion_mode),
+            conversion,
+        )
+
+    image_mode, _, _ = unpack_image_options(image_options)
+    result = conversion_result(filename, conversion, metadata, image_mode=image_mode)
+    result.update({"pages": out_metadata.get("pages"), "page_ranges": len(parts)})
+    return pack_result(result)
+
+
 # @celery_app.task(
 #     ignore_result=False, bind=True, base=PDFConversionTask, name="process_batch"
 # )
@@ -133,18 +503,155 @@ def convert_pdf_to_markdown(self, filename, pdf_content):
 @celery_app.task(
     ignore_result=False, bind=True, base=PDFConversionTask, name="process_batch"
 )
-def process_batch(self, batch_data):
-    results = []
+def process_batch(self, batch_data, image_options=None, conversion_mode=None):
+    """
+    Convert a batch of files.
+
+    The batch is split into parts of BATCH_PART_FILES files that run as a
+    chord on all workers; the aggregating task takes over this task id, so
+    /batch_convert/result/{task_id} works as before. Every file is published
+    as soon as it is done (see batch_results), which also drives progress.
+    """
+    batch_id = self.request.id
     total = len(batch_data)
-    for i, (filename, pdf_content) in enumerate(batch_data, start=1):
-        try:
-            result = convert_pdf_to_markdown(filename, pdf_content)
-            results.append(result)
-        except Exception as e:
-            logger.error(f"Error processing {filename}: {str(e)}")
-            results.append({"filename": filename, "status": "Error", "error": str(e)})
+    start_batch(batch_id, total)
+    items = [(i, filename, blob_ref) for i, (filename, blob_ref) in enumerate(batch_data)]
+    parts = split_batch(items)
+
+    if len(parts) > 1:
+        logger.info(f"Splitting batch {batch_id} ({total} files) into {len(parts)} parts")
+        queue = (self.request.delivery_info or {}).get("routing_key")
+        options = {"queue": queue} if queue else {}
+        raise self.replace(
+            chord(
+                group(
+                    process_batch_part.s(batch_id, part, image_options, conversion_mode).set(
+                        **options
+                    )
+                    for part in parts
+                ),
+                aggregate_batch.s(total).set(**options),
+            )
+        )
+
+    def progress(completed):
+        self.update_state(state="PROGRESS", meta={"current": completed, "total": total})
+
+    outputs = convert_batch_items(batch_id, items, image_options, conversion_mode, progress)
+    return pack_result([outputs[i] for i in range(total)])
+
+
+@celery_app.task(
+    ignore_result=False, bind=True, base=PDFConversionTask, name="process_batch_part"
+)
+def process_batch_part(self, batch_id, items, image_options=None, conversion_mode=None):
+    outputs = convert_batch_items(batch_id, items, image_options, conversion_mode)
+    return pack_result([[i, result] for i, result in outputs.items()])
+
+
+@celery_app.task(
+    ignore_result=False, bind=True, base=PDFConversionTask, name="aggregate_batch"
+)
+def aggregate_batch(self, parts, total):
+    results = [None] * total
+    for part in parts:
+        for i, result in unpack_result(part):
+            results[i] = result
+    return pack_result(results)
+
+
+def convert_batch_items(
+    batch_id, items, image_options=None, conversion_mode=None, progress=None
+):
+    """
+    Convert files of a batch job in one task.
+
+    Cached files are answered first, the others are converted with their
+    pages shared across documents in the model batches.
+
+    Args:
+    batch_id (str): Task id of the batch job.
+    items (list): (index in the batch, filename, blob_ref) of the files.
+    image_options (dict): Image mode, format and quality of the results.
+    conversion_mode (str): auto, full or text, see marker_api.fastpath.
+    progress (callable): Called with the number of finished files.
+
+    Returns:
+    dict: Index in the batch to the result of the file.
+    """
+    image_mode, image_format, image_quality = unpack_image_options(image_options)
+    results = {}
+    cache = get_result_cache()
+    blob_store = get_blob_store()
+
+    def finish(i, result):
+        # Every file is published as soon as it is done, see batch_results
+        results[i] = result
+        record_file_result(batch_id, i, result)
+
+    pending = {}
+    for i, filename, blob_ref in items:
+        metadata = metadata_dict.get(filename, {})
+        cache_key = conversion_cache_key(blob_ref, metadata, image_options, conversion_mode)
+        conversion = cache.get(cache_key) if cache else None
+        if conversion is not None:
+            finish(
+                i,
+                conversion_result(
+                    filename, conversion, metadata, cached=True, image_mode=image_mode
+                ),
+            )
+            blob_store.delete(blob_ref)
+        else:
+            pending[i] = (filename, blob_ref, metadata, cache_key)
+    if results and progress:
+        progress(len(results))
+
+    with ExitStack() as stack:
+        pdf_paths = {}
+        for i, (filename, blob_ref, _, _) in pending.items():
+            try:
+                pdf_paths[i] = stack.enter_context(blob_store.local_path(blob_ref))
+            except Exception as e:
+                logger.error(f"Error fetching {filename}: {str(e)}")
+                finish(i, {"filename": filename, "status": "Error", "error": str(e)})
+
+        # Pages of several small documents share the same model batches
+        page_counts = [(i, get_page_count(pdf_path)) for i, pdf_path in pdf_paths.items()]
+        for group_ids in plan_page_batches(page_counts):
+            documents = [(i, pdf_paths[i], pending[i][2]) for i in group_ids]
+            outputs = convert_documents(documents, conversion_mode)
+            for i in group_ids:
+                filename, blob_ref, metadata, cache_key = pending[i]
+                try:
+                    output = outputs[i]
+                    if isinstance(output, Exception):
+                        raise output
+                    markdown_text, images, out_metadata = output
+                    conversion = finish_conversion(
+                        OUTPUT_FOLDER,
+                        filename,
+                        markdown_text,
+                        images,
+                        metadata,
+                        image_format,
+                        image_quality,
+                        out_metadata.get("page_modes"),
+                    )
+                    if cache is not None:
+                        cache.put(cache_key, conversion)
+                    result = conversion_result(
+                        filename, conversion, metadata, image_mode=image_mode
+                    )
+                except Exception as e:
+                    logger.error(f"Error processing {filename}: {str(e)}")
+                    result = {"filename": filename, "status": "Error", "error": str(e)}
+                finish(i, result)
+
+            if progress:
+                progress(len(results))
 
-        # Update progress
-        self.update_state(state="PROGRESS", meta={"current": i, "total": total})
+    for filename, blob_ref, _, _ in pending.values():
+        blob_store.delete(blob_ref)
 
     return results
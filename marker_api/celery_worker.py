@@ -1,19 +1,58 @@
 import os
+import redis
 from celery import Celery
 from dotenv import load_dotenv
+from kombu import Queue
+from marker_api.result_store import RESULT_TTL_SECONDS
 import multiprocessing
 
 multiprocessing.set_start_method("spawn")
 
 load_dotenv(".env")
 
+REDIS_URL = os.environ.get("REDIS_HOST", "redis://localhost:6379/0")
+# Unacknowledged tasks are redelivered after this long, keep it above the
+# longest conversion
+CELERY_VISIBILITY_TIMEOUT = int(os.environ.get("CELERY_VISIBILITY_TIMEOUT", 12 * 3600))
+
+INTERACTIVE_QUEUE = "interactive"
+BULK_QUEUE = "bulk"
+OVERSIZED_QUEUE = "oversized"
+QUEUES = [INTERACTIVE_QUEUE, BULK_QUEUE, OVERSIZED_QUEUE]
+
 celery_app = Celery(
     "celery_app",
-    broker=os.environ.get("REDIS_HOST", "redis://localhost:6379/0"),
-    backend=os.environ.get("REDIS_HOST", "redis://localhost:6379/0"),
+    broker=REDIS_URL,
+    backend=REDIS_URL,
     include=["marker_api.celery_tasks"],
 )
 
+celery_app.conf.update(
+    # Workers started without -Q consume every queue
+    task_queues=[Queue(name, routing_key=name) for name in QUEUES],
+    task_default_queue=BULK_QUEUE,
+    task_routes={"celery.ping": {"queue": INTERACTIVE_QUEUE}},
+    # A worker only reserves the task it runs, so a long bulk job never holds
+    # interactive tasks in its prefetch buffer
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    broker_transport_options={"visibility_timeout": CELERY_VISIBILITY_TIMEOUT},
+    # Results are packed by marker_api.result_store and expire from Redis
+    result_expires=RESULT_TTL_SECONDS,
+)
+
+_redis = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    Return a shared client for the Redis instance used as broker and backend.
+    """
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
 
 @celery_app.task(name="celery.ping")
 def ping():
@@ -3,20 +3,28 @@ import os
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = (
     "1"  # For some reason, transformers decided to use .isin for a simple op, which is not supported on MPS
 )
-os.environ["IN_STREAMLIT"] = "true"  # Avoid multiprocessing inside surya
-os.environ["PDFTEXT_CPU_WORKERS"] = "1"  # Avoid multiprocessing inside pdftext
+# Defaults only, the CPU layout of the pool sets them per process
+os.environ.setdefault("IN_STREAMLIT", "true")  # Avoid multiprocessing inside surya
+os.environ.setdefault("PDFTEXT_CPU_WORKERS", "1")  # Avoid multiprocessing inside pdftext
 
 import pypdfium2  # Needs to be at the top to avoid warnings
 import argparse
 import torch.multiprocessing as mp
 from tqdm import tqdm
 import math
+import queue
 
-from marker.convert import convert_single_pdf
 from marker.output import markdown_exists, save_markdown
 from marker.pdf.utils import find_filetype
 from marker.pdf.extract_text import get_length_of_text
-from marker.models import load_all_models
+from marker_api.models import convert_single_pdf, load_models
+from marker_api.topology import (
+    CPU_LAYOUTS,
+    WORKER_CPU_LAYOUT,
+    apply_layout,
+    describe_layout,
+    plan_layout,
+)
 from marker.settings import settings
 from marker.logger import configure_logging
 import traceback
@@ -25,9 +33,15 @@ import json
 configure_logging()
 
 
-def worker_init(shared_model):
+def worker_init(shared_model, slots=None):
+    if slots is not None:
+        try:
+            apply_layout(slots.get_nowait())
+        except queue.Empty:
+            # A replacement for a process that died, its slot is taken
+            pass
     if shared_model is None:
-        shared_model = load_all_models()
+        shared_model = load_models()
 
     global model_refs
     model_refs = shared_model
@@ -95,6 +109,12 @@ def main():
         default=5,
         help="Number of worker processes to use.  Peak VRAM usage per process is 5GB, but avg is closer to 3.5GB.",
     )
+    parser.add_argument(
+        "--cpu_layout",
+        default=WORKER_CPU_LAYOUT,
+        choices=CPU_LAYOUTS,
+        help="How the CPU cores are split across the worker processes.",
+    )
     parser.add_argument(
         "--metadata_file",
         type=str,
@@ -146,12 +166,13 @@ def main():
 
         model_lst = None
     else:
-        model_lst = load_all_models()
+        model_lst = load_models(share_memory=True)
 
-        for model in model_lst:
-            if model is None:
-                continue
-            model.share_memory()
+    slots = mp.Queue()
+    layout = plan_layout(total_processes, args.cpu_layout)
+    for slot in layout:
+        slots.put(slot)
+    print(describe_layout(args.cpu_layout, layout))
 
     print(
         f"Converting {len(files_to_convert)} pdfs in chunk {args.chunk_idx + 1}/{args.num_chunks} with {total_processes} processes, and storing in {out_folder}"
@@ -162,7 +183,7 @@ def main():
     ]
 
     with mp.Pool(
-        processes=total_processes, initializer=worker_init, initargs=(model_lst,)
+        processes=total_processes, initializer=worker_init, initargs=(model_lst, slots)
     ) as pool:
         list(
             tqdm(
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import redis.asyncio as aioredis
+from celery import states
+from celery.result import AsyncResult
+from marker_api.celery_worker import REDIS_URL, get_redis
+
+logger = logging.getLogger(__name__)
+
+# Pub/sub is fire-and-forget, waiters also check the result backend this often
+# in case an event was lost
+EVENTS_POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", 15))
+# Keep-alive interval of the SSE and WebSocket streams
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", 15))
+
+EVENTS_CHANNEL = "marker:task_events:{task_id}"
+
+_async_redis = {}
+
+
+def publish_event(task_id: str, event: dict):
+    """
+    Publish an event of a task to its waiters.
+
+    Args:
+    task_id (str): The task, for batches the batch task id.
+    event (dict): The event, with a "type" of "task" or "file".
+    """
+    try:
+        get_redis().publish(
+            EVENTS_CHANNEL.format(task_id=task_id),
+            json.dumps({"task_id": task_id, "time": time.time(), **event}),
+        )
+    except Exception as e:
+        # Waiters fall back to polling the result backend
+        logger.warning(f"Could not publish event of task {task_id}: {str(e)}")
+
+
+def publish_task_done(task_id: str, state: str):
+    """
+    Publish that a task has finished, if the state is final.
+    """
+    if state in states.READY_STATES:
+        publish_event(task_id, {"type": "task", "state": state})
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Return a Redis client for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_redis.get(loop)
+    if client is None:
+        client = aioredis.Redis.from_url(REDIS_URL)
+        _async_redis[loop] = client
+    return client
+
+
+def task_state_event(task_id: str, task: AsyncResult = None) -> dict:
+    task = task or AsyncResult(task_id)
+    return {"type": "task", "task_id": task_id, "state": task.state, "time": time.time()}
+
+
+async def task_events(task_id: str, heartbeat: float = EVENTS_HEARTBEAT_SECONDS):
+    """
+    Iterate over the events of a task until it has finished.
+
+    The current state is sent first, then every published event: "file"
+    events for every finished file of a batch and a final "task" event.
+    A "heartbeat" event is sent when nothing happened for a while; it also
+    re-checks the result backend, so a lost event only delays the end.
+
+    Args:
+    task_id (str): The task or batch task id.
+    heartbeat (float): Seconds without events before a heartbeat.
+
+    Returns:
+    AsyncIterator[dict]: The events.
+    """
+    task = AsyncResult(task_id)
+    pubsub = get_async_redis().pubsub()
+    # Subscribe before reading the state, so no event falls in between
+    await pubsub.subscribe(EVENTS_CHANNEL.format(task_id=task_id))
+    try:
+        event = await asyncio.to_thread(task_state_event, task_id, task)
+        yield event
+        if event["state"] in states.READY_STATES:
+            return
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=heartbeat
+            )
+            if message is None:
+                event = await asyncio.to_thread(task_state_event, task_id, task)
+                if event["state"] in states.READY_STATES:
+                    yield event
+                    return
+                yield {"type": "heartbeat", "task_id": task_id, "time": time.time()}
+                continue
+            event = json.loads(message["data"])
+            yield event
+            if event.get("type") == "task" and event.get("state") in states.READY_STATES:
+                return
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+
+async def wait_for_task(task_id: str, timeout: float = None) -> AsyncResult:
+    """
+    Wait until a task has finished, woken by its completion event.
+
+    Args:
+    task_id (str): The task id.
+    timeout (float): Seconds to wait, raises asyncio.TimeoutError after.
+
+    Returns:
+    AsyncResult: The finished task.
+    """
+
+    async def wait():
+        async for event in task_events(task_id, heartbeat=EVENTS_POLL_SECONDS):
+            if event["type"] == "task" and event["state"] in states.READY_STATES:
+                return
+
+    await asyncio.wait_for(wait(), timeout=timeout)
+    return AsyncResult(task_id)
+
+
+def sse_frame(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
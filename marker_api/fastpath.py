@@ -0,0 +1,293 @@
+import os
+import logging
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from typing import Literal
+from marker.pdf.utils import find_filetype
+from marker.pdf.extract_text import get_length_of_text, get_text_blocks
+from marker.ocr.heuristics import detect_bad_ocr
+from marker.ocr.lang import replace_langs_with_codes
+from marker.cleaners.headers import filter_header_footer
+from marker.cleaners.code import identify_code_blocks, indent_blocks
+from marker.cleaners.bullets import replace_bullets
+from marker.cleaners.fontstyle import find_bold_italic
+from marker.cleaners.text import cleanup_text
+from marker.postprocessors.markdown import merge_spans, merge_lines, get_full_text
+from marker_api.pages import convert_page_range, stitch_page_ranges
+
+logger = logging.getLogger(__name__)
+
+# auto: text layer where it is usable, full: every page through the models,
+# text: text layer only, no models
+ConversionMode = Literal["auto", "full", "text"]
+
+CONVERSION_MODE = os.environ.get("CONVERSION_MODE", "full")
+# A page needs at least this many characters in its text layer
+FASTPATH_MIN_CHARS = int(os.environ.get("FASTPATH_MIN_CHARS", 100))
+# Pages with images covering more than this fraction go through the models
+FASTPATH_MAX_IMAGE_AREA = float(os.environ.get("FASTPATH_MAX_IMAGE_AREA", 0.1))
+# Every run of model pages is a separate convert_single_pdf; with more runs
+# than this the whole document goes through the models in one pass
+FASTPATH_MAX_FULL_RUNS = int(os.environ.get("FASTPATH_MAX_FULL_RUNS", 2))
+
+TEXT_PAGE = "text"
+FULL_PAGE = "full"
+
+
+def resolve_mode(mode: str = None) -> str:
+    return mode or CONVERSION_MODE
+
+
+def conversion_cache_options(mode: str = None) -> dict:
+    """
+    Cache key options of a conversion mode. Empty for full conversions, so
+    existing cache entries stay valid.
+    """
+    mode = resolve_mode(mode)
+    if mode == "full":
+        return {}
+    options = {"conversion_mode": mode}
+    if mode == "auto":
+        options["fastpath"] = [
+            FASTPATH_MIN_CHARS,
+            FASTPATH_MAX_IMAGE_AREA,
+            FASTPATH_MAX_FULL_RUNS,
+        ]
+    return options
+
+
+def image_area_fraction(pdf_page) -> float:
+    """
+    Function to measure how much of a page is covered by embedded images.
+
+    Args:
+    pdf_page (pypdfium2.PdfPage): The page.
+
+    Returns:
+    float: Summed area of the image objects over the page area.
+    """
+    width, height = pdf_page.get_size()
+    page_area = width * height
+    if page_area <= 0:
+        return 0.0
+    image_area = 0.0
+    for image in pdf_page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]):
+        left, bottom, right, top = image.get_pos()
+        image_area += max(0.0, right - left) * max(0.0, top - bottom)
+    return min(1.0, image_area / page_area)
+
+
+def has_usable_text(page, pdf_page) -> bool:
+    """
+    Function to decide whether the text layer of a page can be used as is.
+
+    The page needs enough embedded text, the text must not look like bad OCR
+    (marker's own heuristic) and images must not cover a large part of the
+    page, since figures and scans are only found by the layout model.
+
+    Args:
+    page (marker.schema.page.Page): The page as extracted by pdftext.
+    pdf_page (pypdfium2.PdfPage): The same page in pdfium.
+
+    Returns:
+    bool: True if the page can skip the models.
+    """
+    text = page.prelim_text
+    if len(text.strip()) < FASTPATH_MIN_CHARS or detect_bad_ocr(text):
+        return False
+    return image_area_fraction(pdf_page) <= FASTPATH_MAX_IMAGE_AREA
+
+
+def classify_pages(doc, pages, first_page: int = 0):
+    """
+    Function to classify every page as text-layer-good or needs the models.
+
+    Args:
+    doc (pypdfium2.PdfDocument): The document.
+    pages (list): The pages extracted by pdftext, starting at first_page.
+    first_page (int): Document page number of the first page.
+
+    Returns:
+    list: TEXT_PAGE or FULL_PAGE for every page.
+    """
+    page_modes = []
+    for i, page in enumerate(pages):
+        pdf_page = doc[first_page + i]
+        try:
+            usable = has_usable_text(page, pdf_page)
+        finally:
+            pdf_page.close()
+        page_modes.append(TEXT_PAGE if usable else FULL_PAGE)
+    return page_modes
+
+
+def page_runs(page_modes):
+    """
+    Function to group consecutive pages with the same mode.
+
+    Returns:
+    list: (mode, first page, page count) tuples in page order.
+    """
+    runs = []
+    for i, page_mode in enumerate(page_modes):
+        if runs and runs[-1][0] == page_mode:
+            runs[-1][2] += 1
+        else:
+            runs.append([page_mode, i, 1])
+    return [tuple(run) for run in runs]
+
+
+def render_text_pages(pages, bad_span_ids):
+    """
+    Function to build markdown from the text layer of pages, without models.
+
+    Every block is taken as a text block; code blocks, bold and italic are
+    found with the same heuristics marker uses after layout detection.
+
+    Returns:
+    tuple: The markdown and the number of code blocks.
+    """
+    for page in pages:
+        for block in page.blocks:
+            block.block_type = "Text"
+            block.filter_spans(bad_span_ids)
+            block.filter_bad_span_types()
+
+    code_block_count = identify_code_blocks(pages)
+    indent_blocks(pages)
+    find_bold_italic(pages)
+
+    merged_lines = merge_spans(pages)
+    text_blocks = merge_lines(merged_lines)
+    full_text = get_full_text(text_blocks)
+    full_text = cleanup_text(full_text)
+    full_text = replace_bullets(full_text)
+    return full_text, code_block_count
+
+
+def convert_pdf(
+    pdf_file,
+    model_list,
+    mode: str = None,
+    start_page: int = None,
+    max_pages: int = None,
+    metadata: dict = None,
+):
+    """
+    Function to convert a PDF, sending pages with a usable text layer through
+    a text-only path.
+
+    In auto mode every page is classified first. Pages with good embedded text
+    are converted from the text layer alone, the other pages run through
+    convert_single_pdf as consecutive page ranges, and the parts are stitched
+    back together. When model pages are scattered over more than
+    FASTPATH_MAX_FULL_RUNS runs, the whole range is converted in one model
+    pass instead. The decision of every page is reported in the "page_modes"
+    metadata.
+
+    Args:
+    pdf_file: Path, bytes or file-like object of the PDF.
+    model_list: The list of loaded models.
+    mode (str): auto, full or text, defaults to CONVERSION_MODE.
+    start_page (int): The first page to convert.
+    max_pages (int): The number of pages to convert.
+    metadata (dict): Optional metadata such as languages.
+
+    Returns:
+    tuple: The markdown, images and metadata, with image names numbered by
+    document page.
+    """
+    mode = resolve_mode(mode)
+    start_page = start_page or 0
+    if mode == "full":
+        return convert_page_range(pdf_file, model_list, start_page, max_pages, metadata)
+
+    filetype = find_filetype(pdf_file)
+    # A quick look at the whole text layer spares the per-page extraction
+    # for scans without any text
+    if filetype != "pdf" or (
+        mode == "auto" and not start_page and get_length_of_text(pdf_file) == 0
+    ):
+        full_text, images, out_meta = convert_page_range(
+            pdf_file, model_list, start_page, max_pages, metadata
+        )
+        out_meta["page_modes"] = [FULL_PAGE] * out_meta.get("pages", 0)
+        return full_text, images, out_meta
+
+    doc = pdfium.PdfDocument(pdf_file)
+    try:
+        pages, toc = get_text_blocks(doc, pdf_file, max_pages, start_page)
+        if mode == "text":
+            page_modes = [TEXT_PAGE] * len(pages)
+        else:
+            page_modes = classify_pages(doc, pages, start_page)
+    finally:
+        doc.close()
+    runs = page_runs(page_modes)
+    full_runs = sum(1 for page_mode, _, _ in runs if page_mode == FULL_PAGE)
+    if full_runs > FASTPATH_MAX_FULL_RUNS:
+        # Loading and batching the models per run costs more than the text
+        # pages save
+        logger.debug(f"Fast path: {full_runs} runs of model pages, converting in one pass")
+        full_text, images, out_meta = convert_page_range(
+            pdf_file, model_list, start_page, max_pages, metadata
+        )
+        out_meta["page_modes"] = [FULL_PAGE] * out_meta.get("pages", 0)
+        return full_text, images, out_meta
+    logger.debug(
+        f"Fast path: {page_modes.count(TEXT_PAGE)} of {len(pages)} pages from the text layer"
+    )
+
+    # Headers and footers are found over all pages, like in a full conversion
+    bad_span_ids = filter_header_footer(pages)
+    langs = (metadata or {}).get("languages")
+    parts = []
+    for page_mode, first, count in runs:
+        run_start = start_page + first
+        if page_mode == FULL_PAGE:
+            full_text, images, out_meta = convert_page_range(
+                pdf_file, model_list, run_start, count, metadata
+            )
+        else:
+            run_pages = pages[first : first + count]
+            header_footer = sum(
+                1
+                for page in run_pages
+                for block in page.blocks
+                for line in block.lines
+                for span in line.spans
+                if span.span_id in bad_span_ids
+            )
+            full_text, code_block_count = render_text_pages(run_pages, bad_span_ids)
+            images = {}
+            out_meta = {
+                "languages": replace_langs_with_codes(list(langs) if langs else None),
+                "filetype": filetype,
+                "toc": toc,
+                "pages": count,
+                "ocr_stats": {
+                    "ocr_pages": 0,
+                    "ocr_failed": 0,
+                    "ocr_success": 0,
+                    "ocr_engine": "none",
+                },
+                "block_stats": {
+                    "header_footer": header_footer,
+                    "code": code_block_count,
+                    "table": 0,
+                },
+            }
+        parts.append(
+            {
+                "start_page": run_start,
+                "markdown": full_text,
+                "images": images,
+                "metadata": out_meta,
+            }
+        )
+
+    if not parts:
+        return "", {}, {"filetype": filetype, "toc": toc, "pages": 0, "page_modes": []}
+    full_text, images, out_meta = stitch_page_ranges(parts)
+    out_meta["page_modes"] = page_modes
+    return full_text, images, out_meta
@@ -0,0 +1,410 @@
+import os
+import io
+import re
+import json
+import time
+import uuid
+import base64
+import hashlib
+import logging
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal, Optional
+from PIL import Image
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_STORE_DIR = os.environ.get("OUTPUT_STORE_DIR", "output_store")
+OUTPUT_STORE_TTL_SECONDS = int(os.environ.get("OUTPUT_STORE_TTL_SECONDS", 7 * 24 * 3600))
+OUTPUT_STORE_GC_INTERVAL = int(os.environ.get("OUTPUT_STORE_GC_INTERVAL", 3600))
+IMAGE_URL_PREFIX = os.environ.get("IMAGE_URL_PREFIX", "/images")
+IMAGE_ENCODE_WORKERS = int(
+    os.environ.get("IMAGE_ENCODE_WORKERS", min(4, os.cpu_count() or 1))
+)
+
+ImageMode = Literal["inline", "url", "zip", "none"]
+# Celery results are built on the worker, so there is no zip response there
+TaskImageMode = Literal["inline", "url", "none"]
+ImageFormat = Literal["png", "webp", "jpeg"]
+
+# PIL format, file extension and MIME type of each output format
+IMAGE_FORMATS = {
+    "png": ("PNG", "png", "image/png"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+MIME_TYPES = {ext: mime for _, ext, mime in IMAGE_FORMATS.values()}
+IMAGE_KEY_RE = re.compile(r"^[0-9a-f]{64}\.(png|webp|jpg)$")
+
+
+def save_image(image: Image.Image, fp, image_format: str = "png", quality: Optional[int] = None):
+    """
+    Save an image in the requested output format.
+
+    Args:
+    image (PIL.Image.Image): The image to save.
+    fp: A path or a binary file object.
+    image_format (str): One of png, webp or jpeg.
+    quality (int): WebP/JPEG quality (1-100) or PNG compression level (0-9).
+    """
+    pil_format = IMAGE_FORMATS[image_format][0]
+    if image_format == "png":
+        compress_level = 6 if quality is None else min(max(quality, 0), 9)
+        image.save(fp, format=pil_format, compress_level=compress_level)
+    else:
+        if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(fp, format=pil_format, quality=quality or 85)
+
+
+def encode_image(image: Image.Image, image_format: str = "png", quality: Optional[int] = None) -> bytes:
+    """
+    Encode an image in memory.
+
+    Returns:
+    bytes: The encoded image.
+    """
+    buffer = io.BytesIO()
+    save_image(image, buffer, image_format, quality)
+    return buffer.getvalue()
+
+
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+
+def get_encode_pool() -> ThreadPoolExecutor:
+    """
+    Return the process-wide pool that encodes images.
+
+    The pool is shared by all requests, so concurrent conversions never use
+    more than IMAGE_ENCODE_WORKERS threads for encoding. Pillow releases the
+    GIL while compressing, so the threads run in parallel.
+    """
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            _encode_pool = ThreadPoolExecutor(
+                max_workers=IMAGE_ENCODE_WORKERS, thread_name_prefix="image-encode"
+            )
+    return _encode_pool
+
+
+def encode_images(markdown: str, images: dict, image_format: str = "png", quality: Optional[int] = None):
+    """
+    Encode the images of a document as base64 in the requested format.
+
+    Images are encoded in memory, in parallel on the shared encode pool, and
+    renamed to the extension of the format; the markdown links follow the new
+    names.
+
+    Args:
+    markdown (str): The markdown of the document.
+    images (dict): Image name to PIL image.
+    image_format (str): One of png, webp or jpeg.
+    quality (int): WebP/JPEG quality (1-100) or PNG compression level (0-9).
+
+    Returns:
+    tuple: The markdown and the image name to base64 data mapping.
+    """
+
+    def encode(item):
+        name, image = item
+        try:
+            return base64.b64encode(encode_image(image, image_format, quality)).decode("utf-8")
+        except Exception as e:
+            logger.error(f"Error processing image {name}: {str(e)}")
+            return ""
+
+    if len(images) > 1 and IMAGE_ENCODE_WORKERS > 1:
+        encoded = get_encode_pool().map(encode, images.items())
+    else:
+        encoded = map(encode, images.items())
+
+    renames = {name: image_filename(name, image_format) for name in images}
+    image_data = dict(zip(renames.values(), encoded))
+    return rename_image_links(markdown, renames), image_data
+
+
+def image_cache_options(image_format: str = "png", quality: Optional[int] = None) -> dict:
+    """
+    Return the result cache options for an image encoding.
+
+    The default PNG encoding adds nothing, so existing cache entries stay valid.
+    """
+    if image_format == "png" and quality is None:
+        return {}
+    return {"image_format": image_format, "image_quality": quality}
+
+
+def image_filename(name: str, image_format: str) -> str:
+    """
+    Return the image name with the extension of the output format.
+    """
+    extension = IMAGE_FORMATS[image_format][1]
+    return f"{os.path.splitext(name)[0]}.{extension}"
+
+
+def rename_image_links(markdown: str, renames: dict) -> str:
+    """
+    Point the markdown image links at new names or URLs.
+
+    Args:
+    markdown (str): Markdown with links like ![0_image_0.png](0_image_0.png).
+    renames (dict): Old image name to new name or URL.
+
+    Returns:
+    str: The markdown with updated link targets.
+    """
+    for old, new in renames.items():
+        if old != new:
+            markdown = markdown.replace(f"]({old})", f"]({new})")
+    return markdown
+
+
+class OutputStore:
+    """
+    Content-addressed store for extracted images, served by the API.
+
+    Images are stored once under the SHA-256 of their bytes, so identical
+    images from repeated conversions share a file and the key doubles as a
+    strong ETag. The folder has to be shared with the Celery workers for the
+    distributed server.
+    """
+
+    def __init__(self, root: str = OUTPUT_STORE_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        if not IMAGE_KEY_RE.match(key):
+            raise ValueError(f"Invalid image key: {key}")
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data: bytes, extension: str) -> str:
+        key = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = self.path(key)
+        if os.path.exists(path):
+            # Refresh the mtime so the TTL sweep keeps images still in use
+            os.utime(path)
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return key
+
+    def gc_expired(self, ttl: int = OUTPUT_STORE_TTL_SECONDS) -> int:
+        cutoff = time.time() - ttl
+        removed = 0
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+_output_store = None
+_last_gc = 0.0
+
+
+def get_output_store() -> OutputStore:
+    global _output_store
+    if _output_store is None:
+        _output_store = OutputStore()
+    return _output_store
+
+
+def maybe_gc_output_store():
+    """
+    Sweep images older than OUTPUT_STORE_TTL_SECONDS at most once every
+    OUTPUT_STORE_GC_INTERVAL seconds.
+    """
+    global _last_gc
+    now = time.time()
+    if now - _last_gc < OUTPUT_STORE_GC_INTERVAL:
+        return
+    _last_gc = now
+    try:
+        removed = get_output_store().gc_expired()
+        if removed:
+            logger.info(f"Removed {removed} expired images from the output store")
+    except Exception as e:
+        logger.warning(f"Output store garbage collection failed: {str(e)}")
+
+
+def externalize_images(markdown: str, images: dict):
+    """
+    Write base64 images to the output store and replace them with URLs.
+
+    Args:
+    markdown (str): The markdown of the document.
+    images (dict): Image name to base64 data.
+
+    Returns:
+    tuple: The markdown linking to the URLs and the image name to URL mapping.
+    """
+    maybe_gc_output_store()
+    store = get_output_store()
+    urls = {}
+    for name, image_base64 in images.items():
+        extension = os.path.splitext(name)[1].lstrip(".") or "png"
+        key = store.put(base64.b64decode(image_base64), extension)
+        urls[name] = f"{IMAGE_URL_PREFIX}/{key}"
+    return rename_image_links(markdown, urls), urls
+
+
+def deliver_images(result: dict, image_mode: str) -> dict:
+    """
+    Apply the requested image delivery mode to a conversion result.
+
+    Results are always produced (and cached) with inline base64 images; url
+    mode moves them to the output store. zip responses are built separately
+    with zip_results.
+
+    Args:
+    result (dict): A conversion result with markdown and images.
+    image_mode (str): One of inline, url, zip or none.
+
+    Returns:
+    dict: The result with images as base64, URLs or left out.
+    """
+    if image_mode == "url":
+        markdown, urls = externalize_images(result["markdown"], result["images"])
+        return {**result, "markdown": markdown, "images": urls}
+    if image_mode == "none":
+        return {**result, "images": {}}
+    return result
+
+
+def zip_results(results) -> bytes:
+    """
+    Package conversion results as a zip archive.
+
+    Every document gets a folder with its markdown, its metadata and its
+    images as binary files. Folders are named after the file; documents with
+    the same name get their position in the results appended.
+
+    Args:
+    results (list): Conversion results with filename, markdown, metadata and
+    base64 images.
+
+    Returns:
+    bytes: The zip archive.
+    """
+    buffer = io.BytesIO()
+    # Compared case-insensitively, like the filesystems archives are extracted to
+    folders = set()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for index, result in enumerate(results, start=1):
+            stem = os.path.splitext(os.path.basename(result["filename"] or "document"))[0]
+            folder = stem
+            suffix = index
+            while folder.lower() in folders:
+                folder = f"{stem}_{suffix}"
+                suffix += 1
+            folders.add(folder.lower())
+            archive.writestr(f"{folder}/{stem}.md", result.get("markdown", ""))
+            archive.writestr(
+                f"{folder}/{stem}_meta.json",
+                json.dumps(result.get("metadata", {}), indent=4, ensure_ascii=False),
+            )
+            for name, image_base64 in (result.get("images") or {}).items():
+                # Images are already compressed, deflating them again is wasted work
+                archive.writestr(
+                    f"{folder}/{name}",
+                    base64.b64decode(image_base64),
+                    compress_type=zipfile.ZIP_STORED,
+                )
+    return buffer.getvalue()
+
+
+def zip_response(results, archive_name: str) -> Response:
+    return Response(
+        content=zip_results(results),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{archive_name}.zip"'},
+    )
+
+
+def parse_range(range_header: str, size: int):
+    """
+    Parse a single-range "bytes=start-end" header.
+
+    Returns:
+    tuple: Inclusive (start, end) byte offsets, or None if the range cannot be
+    satisfied.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def image_response(key: str, range_header: str = None, if_none_match: str = None) -> Response:
+    """
+    Serve an image of the output store with ETag and Range support.
+
+    Args:
+    key (str): The image key from the URL.
+    range_header (str): The Range request header.
+    if_none_match (str): The If-None-Match request header.
+
+    Returns:
+    Response: 200 with the image, 206 with a byte range, 304 if the client
+    copy is current or 416 for an unsatisfiable range.
+    """
+    try:
+        path = get_output_store().path(key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    media_type = MIME_TYPES[key.rsplit(".", 1)[1]]
+    etag = f'"{key.split(".")[0]}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # The key is the content hash, so the URL never changes content
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if if_none_match and (if_none_match.strip() == "*" or etag in if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    if range_header:
+        size = os.path.getsize(path)
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        with open(path, "rb") as f:
+            f.seek(start)
+            content = f.read(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(
+            content=content, status_code=206, media_type=media_type, headers=headers
+        )
+
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -0,0 +1,433 @@
+"""
+Start a pool of Celery worker processes subscribed to the queues by weight.
+
+    python -m marker_api.launcher --workers 4
+
+WORKER_QUEUE_WEIGHTS decides how the worker processes are split across the
+interactive, bulk and oversized queues. With the default "interactive=2,
+bulk=1,oversized=1" and 4 workers, two processes only take interactive
+tasks, so small uploads never wait behind batch jobs.
+
+    python -m marker_api.launcher --workers auto
+
+With --workers auto the number of processes follows the memory of the
+machine: free VRAM on GPU, available system RAM on CPU, divided by the
+footprint of one model-holding worker. The footprint is WORKER_RAM_MB (or
+VRAM_PER_TASK on GPU) until a worker has loaded its models, then the
+measured peak of the workers. The pool grows while a whole worker fits
+above MEMORY_RESERVE_MB and shrinks when free memory drops below it.
+
+Every worker gets a slot of the CPU layout of marker_api.topology
+(WORKER_CPU_LAYOUT, --cpu-layout): its own cores and matching thread
+counts. With --workers auto the layout is planned for --max-workers, so
+started workers never have to be moved.
+"""
+import os
+import sys
+import math
+import time
+import signal
+import socket
+import argparse
+import logging
+import subprocess
+from marker_api.queues import parse_queue_values
+from marker_api.topology import (
+    CPU_LAYOUTS,
+    WORKER_CPU_LAYOUT,
+    describe_layout,
+    plan_layout,
+    worker_env,
+)
+from marker_api.utils import DeviceType, get_ram_available
+
+logger = logging.getLogger(__name__)
+
+WORKER_QUEUE_WEIGHTS = os.environ.get(
+    "WORKER_QUEUE_WEIGHTS", "interactive=2,bulk=1,oversized=1"
+)
+# A number of processes, or "auto" to size the pool from memory
+WORKER_PROCESSES = os.environ.get("WORKER_PROCESSES", "1")
+WORKER_MIN_PROCESSES = int(os.environ.get("WORKER_MIN_PROCESSES", 1))
+WORKER_MAX_PROCESSES = int(os.environ.get("WORKER_MAX_PROCESSES", os.cpu_count() or 1))
+# Estimated RAM of one worker on CPU until a worker has loaded its models
+WORKER_RAM_MB = int(os.environ.get("WORKER_RAM_MB", 5000))
+VRAM_PER_TASK = float(os.environ.get("VRAM_PER_TASK", 4.5))
+# Memory kept free for the system and conversion peaks
+MEMORY_RESERVE_MB = int(os.environ.get("MEMORY_RESERVE_MB", 1024))
+LAUNCHER_CHECK_SECONDS = float(os.environ.get("LAUNCHER_CHECK_SECONDS", 15))
+# Workers younger than this are still loading their models: they are not
+# measured and no other resize happens meanwhile
+LAUNCHER_WARMUP_SECONDS = float(os.environ.get("LAUNCHER_WARMUP_SECONDS", 120))
+
+
+def assign_queues(workers: int, weights: dict):
+    """
+    Split worker processes across queues in proportion to their weights.
+
+    Every queue with a positive weight gets at least one worker and the rest
+    is handed out by largest remainder. With fewer workers than queues every
+    worker takes all of them, so no queue is left without a consumer.
+
+    Args:
+    workers (int): Number of worker processes.
+    weights (dict): Queue name to weight.
+
+    Returns:
+    list: The -Q value (comma-separated queues) of every worker process.
+    """
+    queues = [queue for queue, weight in weights.items() if weight > 0]
+    if not queues or workers <= 0:
+        return []
+    if workers < len(queues):
+        return [",".join(queues)] * workers
+    total = sum(weights[queue] for queue in queues)
+    shares = {queue: workers * weights[queue] / total for queue in queues}
+    counts = {queue: max(1, int(shares[queue])) for queue in queues}
+    by_remainder = sorted(
+        queues, key=lambda queue: shares[queue] - int(shares[queue]), reverse=True
+    )
+    while sum(counts.values()) < workers:
+        for queue in by_remainder:
+            if sum(counts.values()) >= workers:
+                break
+            counts[queue] += 1
+    while sum(counts.values()) > workers:
+        largest = max(queues, key=lambda queue: counts[queue])
+        counts[largest] -= 1
+    return [queue for queue in queues for _ in range(counts[queue])]
+
+
+def target_workers(
+    running: int,
+    available_mb: float,
+    footprint_mb: float,
+    reserve_mb: float = MEMORY_RESERVE_MB,
+    min_workers: int = WORKER_MIN_PROCESSES,
+    max_workers: int = WORKER_MAX_PROCESSES,
+) -> int:
+    """
+    Number of worker processes that fit in memory.
+
+    available_mb is measured with the running workers loaded, so the pool
+    only grows by whole workers that fit above the reserve, and shrinks by
+    as many workers as it takes to get back above it.
+
+    Args:
+    running (int): Worker processes running now.
+    available_mb (float): Free memory, minus what starting workers will still take.
+    footprint_mb (float): Memory of one worker.
+    reserve_mb (float): Memory to keep free.
+    min_workers (int): Lower bound, even under memory pressure.
+    max_workers (int): Upper bound.
+
+    Returns:
+    int: The number of worker processes to run.
+    """
+    free = available_mb - reserve_mb
+    if free < 0:
+        target = running - math.ceil(-free / footprint_mb)
+    else:
+        target = running + int(free // footprint_mb)
+    return max(min_workers, min(max_workers, target))
+
+
+def process_memory_mb(pid: int):
+    """
+    Current and peak resident memory of a process, in MB.
+
+    Returns:
+    tuple: VmRSS and VmHWM, or (0, 0) if the process is gone.
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value = line.split(":", 1)
+                    values[name] = int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        pass
+    return values.get("VmRSS", 0), values.get("VmHWM", 0)
+
+
+def process_vram_mb(pids) -> dict:
+    """
+    VRAM used by each of the given processes on the first GPU, in MB.
+    """
+    import pynvml
+
+    pynvml.nvmlInit()
+    try:
+        handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+        return {
+            process.pid: (process.usedGpuMemory or 0) / 1024**2
+            for process in pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+            if process.pid in pids
+        }
+    finally:
+        pynvml.nvmlShutdown()
+
+
+class WorkerPool:
+    """
+    The worker processes of the launcher, resized to a target count.
+    """
+
+    def __init__(self, weights: dict, loglevel: str = "info", slots: list = None):
+        self.weights = weights
+        self.loglevel = loglevel
+        self.slots = slots or [None]
+        self.workers = []
+        self.stopping = []
+        self.next_index = 0
+
+    def free_slot(self) -> int:
+        """
+        The least used slot of the layout, so workers only share cores when
+        there are more workers than slots.
+        """
+        used = [w["slot"] for w in self.workers + self.stopping]
+        return min(range(len(self.slots)), key=lambda slot: (used.count(slot), slot))
+
+    def start(self, queues: str):
+        index = self.next_index
+        self.next_index += 1
+        slot = self.free_slot()
+        print(f"Starting worker {index} on queues {queues}")
+        process = subprocess.Popen(
+            worker_command(queues, index, self.loglevel),
+            env=dict(os.environ, **worker_env(self.slots[slot])),
+        )
+        self.workers.append(
+            {"queues": queues, "process": process, "started": time.time(), "slot": slot}
+        )
+
+    def stop(self, worker):
+        # Celery finishes the running task before a warm shutdown
+        print(f"Stopping worker on queues {worker['queues']} (pid {worker['process'].pid})")
+        worker["process"].send_signal(signal.SIGTERM)
+        self.workers.remove(worker)
+        self.stopping.append(worker)
+
+    def reap(self):
+        """
+        Forget processes that have exited, e.g. after an out-of-memory kill.
+        """
+        for worker in list(self.workers):
+            if worker["process"].poll() is not None:
+                logger.warning(
+                    f"Worker on queues {worker['queues']} exited with {worker['process'].returncode}"
+                )
+                self.workers.remove(worker)
+        self.stopping = [w for w in self.stopping if w["process"].poll() is None]
+
+    def covered(self, workers) -> bool:
+        queues = {queue for worker in workers for queue in worker["queues"].split(",")}
+        return all(queue in queues for queue, weight in self.weights.items() if weight > 0)
+
+    def removable(self, target: list):
+        """
+        The worker to stop next: the newest one, as it is the least likely to
+        be busy, preferring queues above their share, that leaves no queue
+        without a consumer.
+        """
+        running = [worker["queues"] for worker in self.workers]
+        candidates = sorted(
+            reversed(self.workers),
+            key=lambda w: running.count(w["queues"]) <= target.count(w["queues"]),
+        )
+        for worker in candidates:
+            if self.covered([w for w in self.workers if w is not worker]):
+                return worker
+        return None
+
+    def resize(self, count: int):
+        """
+        Start and stop workers to run count workers, moving towards the queue
+        split of assign_queues without restarting workers that can stay.
+        """
+        target = assign_queues(count, self.weights)
+        missing = list(target)
+        for worker in self.workers:
+            if worker["queues"] in missing:
+                missing.remove(worker["queues"])
+        while len(self.workers) > count:
+            worker = self.removable(target)
+            if worker is None:
+                # Only workers of different queues are left, replace them
+                # with workers taking all queues
+                for worker in list(self.workers):
+                    self.stop(worker)
+                missing = target
+                break
+            self.stop(worker)
+        for queues in missing[: max(0, count - len(self.workers))]:
+            self.start(queues)
+
+    def warming_up(self) -> list:
+        now = time.time()
+        return [w for w in self.workers if now - w["started"] < LAUNCHER_WARMUP_SECONDS]
+
+    def terminate(self):
+        for worker in self.workers + self.stopping:
+            if worker["process"].poll() is None:
+                worker["process"].send_signal(signal.SIGTERM)
+
+    def wait(self) -> int:
+        exit_code = 0
+        for worker in self.workers + self.stopping:
+            exit_code = worker["process"].wait() or exit_code
+        return exit_code
+
+
+def measure_memory(pool: WorkerPool, footprint_mb: float):
+    """
+    Measure the free memory and the footprint of one worker.
+
+    Returns:
+    tuple: Free memory minus what warming-up workers will still take, and
+    the footprint of one worker, both in MB.
+    """
+    device_type, available_mb = get_ram_available()
+    pids = {worker["process"].pid for worker in pool.workers}
+    if device_type == DeviceType.GPU:
+        try:
+            usage = process_vram_mb(pids)
+        except Exception as e:
+            logger.warning(f"Could not read the VRAM of the workers: {str(e)}")
+            usage = {}
+        current = dict(usage)
+        peaks = usage
+    else:
+        memory = {pid: process_memory_mb(pid) for pid in pids}
+        current = {pid: rss for pid, (rss, _) in memory.items()}
+        peaks = {pid: peak for pid, (_, peak) in memory.items()}
+
+    warming = {worker["process"].pid for worker in pool.warming_up()}
+    loaded = [peak for pid, peak in peaks.items() if pid not in warming and peak]
+    if loaded:
+        footprint_mb = max(loaded)
+    # Workers still loading their models will take the rest of a footprint
+    pending = sum(max(0, footprint_mb - current.get(pid, 0)) for pid in warming)
+    return available_mb - pending, footprint_mb
+
+
+def run_autoscaled(pool: WorkerPool, min_workers: int, max_workers: int):
+    """
+    Keep the pool sized to the memory of the machine until it is stopped.
+    """
+    device_type, _ = get_ram_available()
+    footprint_mb = VRAM_PER_TASK * 1024 if device_type == DeviceType.GPU else WORKER_RAM_MB
+    stopped = []
+
+    def stop(signum, frame):
+        stopped.append(signum)
+        pool.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopped:
+        pool.reap()
+        available_mb, footprint_mb = measure_memory(pool, footprint_mb)
+        running = len(pool.workers)
+        target = target_workers(
+            running, available_mb, footprint_mb, MEMORY_RESERVE_MB, min_workers, max_workers
+        )
+        # Nothing is resized while workers are loading, except to relieve pressure
+        if target != running and (target < running or not pool.warming_up()):
+            print(
+                f"Resizing the pool from {running} to {target} workers: "
+                f"{available_mb:.0f} MB {device_type.value} free, "
+                f"{footprint_mb:.0f} MB per worker"
+            )
+            pool.resize(target)
+        time.sleep(LAUNCHER_CHECK_SECONDS)
+    return pool.wait()
+
+
+def worker_command(queues: str, index: int, loglevel: str = "info"):
+    return [
+        sys.executable,
+        "-m",
+        "celery",
+        "-A",
+        "marker_api.celery_worker.celery_app",
+        "worker",
+        "--pool=solo",
+        f"--loglevel={loglevel}",
+        "-Q",
+        queues,
+        "-n",
+        f"{queues.split(',')[0]}-{index}@{socket.gethostname()}",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start Celery workers per queue.")
+    parser.add_argument(
+        "--workers",
+        default=WORKER_PROCESSES,
+        help='Number of worker processes, or "auto" to size the pool from memory',
+    )
+    parser.add_argument(
+        "--inference-profile",
+        default=None,
+        help="INFERENCE_PROFILE of the workers: fp32, int8 or bf16",
+    )
+    parser.add_argument(
+        "--cpu-layout",
+        default=WORKER_CPU_LAYOUT,
+        choices=CPU_LAYOUTS,
+        help="How the CPU cores are split across the workers",
+    )
+    parser.add_argument("--min-workers", type=int, default=WORKER_MIN_PROCESSES)
+    parser.add_argument("--max-workers", type=int, default=WORKER_MAX_PROCESSES)
+    parser.add_argument(
+        "--weights", default=WORKER_QUEUE_WEIGHTS, help='Queue weights, e.g. "interactive=2,bulk=1"'
+    )
+    parser.add_argument("--loglevel", default="info")
+    args = parser.parse_args()
+    if args.inference_profile:
+        # Inherited by the worker processes
+        os.environ["INFERENCE_PROFILE"] = args.inference_profile
+
+    if args.workers == "auto":
+        weights = parse_queue_values(args.weights)
+        if not assign_queues(1, weights):
+            parser.error("No queues to consume, check --weights")
+        slots = plan_layout(args.max_workers, args.cpu_layout)
+        print(describe_layout(args.cpu_layout, slots))
+        pool = WorkerPool(weights, args.loglevel, slots)
+        pool.resize(max(1, args.min_workers))
+        sys.exit(run_autoscaled(pool, args.min_workers, args.max_workers))
+
+    assignment = assign_queues(int(args.workers), parse_queue_values(args.weights))
+    if not assignment:
+        parser.error("No worker processes to start, check --workers and --weights")
+
+    slots = plan_layout(len(assignment), args.cpu_layout)
+    print(describe_layout(args.cpu_layout, slots))
+    processes = []
+    for index, queues in enumerate(assignment):
+        command = worker_command(queues, index, args.loglevel)
+        print(f"Starting worker {index} on queues {queues}")
+        processes.append(subprocess.Popen(command, env=dict(os.environ, **worker_env(slots[index]))))
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    exit_code = 0
+    for process in processes:
+        exit_code = process.wait() or exit_code
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,8 @@ class GeneralMetadata(BaseModel):
     languages: Optional[Union[str, List[str]]] = None
     toc: Optional[List[Dict[str, Any]]] = None
     pages: Optional[int] = None
+    # "text" or "full" for every page when the fast path is enabled
+    page_modes: Optional[List[str]] = None
     custom_metadata: Dict[str, Any] = Field(default_factory=dict)
 
 
@@ -49,6 +51,7 @@ class PDFConversionResult(BaseModel):
     metadata: GeneralMetadata
     images: Dict[str, str]
     status: str
+    cached: Optional[bool] = None
 
 
 class ConversionResponse(BaseModel):
@@ -56,6 +59,11 @@ class ConversionResponse(BaseModel):
     result: Optional[PDFConversionResult] = None
 
 
+class SimpleBatchConversionResponse(BaseModel):
+    status: str
+    results: List[PDFConversionResult]
+
+
 class CeleryTaskResponse(BaseModel):
     task_id: str
     status: str
@@ -72,6 +80,26 @@ class BatchConversionResponse(BaseModel):
     status: str
 
 
+class BatchFileEntry(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    status: Optional[str] = None
+    finished_at: float
+    cursor: int
+    result: Optional[PDFConversionResult] = None
+    error: Optional[str] = None
+
+
+class BatchFilesResponse(BaseModel):
+    task_id: str
+    status: str
+    total: Optional[int] = None
+    completed: int
+    cursor: int
+    next_cursor: int
+    files: List[BatchFileEntry]
+
+
 class BatchResultResponse(BaseModel):
     task_id: str
     status: str
@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import torch
+import shutil
+import hashlib
+import logging
+import threading
+import importlib.metadata
+from collections.abc import Sequence
+from marker.models import (
+    load_all_models,
+    setup_detection_model,
+    setup_layout_model,
+    setup_order_model,
+    setup_recognition_model,
+    setup_texify_model,
+)
+from marker.postprocessors.editor import load_editing_model
+from marker.settings import settings
+from marker_api import stub_engine
+
+logger = logging.getLogger(__name__)
+
+# marker, or stub for the stand-in engine of marker_api.stub_engine
+MARKER_ENGINE = os.environ.get("MARKER_ENGINE", "marker")
+if MARKER_ENGINE == "stub":
+    convert_single_pdf = stub_engine.convert_single_pdf
+else:
+    from marker.convert import convert_single_pdf
+
+# Load the models once in a parent process and share the weights with the
+# serving processes, see marker_api.prefork and the Celery worker_init hook
+SHARED_MODELS = os.environ.get("SHARED_MODELS", "false").lower() == "true"
+# How often a pre-fork parent logs the memory of its children
+MODEL_MEMORY_REPORT_SECONDS = int(os.environ.get("MODEL_MEMORY_REPORT_SECONDS", 300))
+# Folder of the memory-mapped model cache, empty to always load from the hub
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "")
+# fp32, or int8 (dynamic quantization of the linear layers) or bf16 on CPU
+INFERENCE_PROFILE = os.environ.get("INFERENCE_PROFILE", "fp32")
+# Models the profile applies to, comma-separated names of MODEL_NAMES
+INFERENCE_PROFILE_MODELS = os.environ.get(
+    "INFERENCE_PROFILE_MODELS", "texify,layout,order,edit,detection,ocr"
+)
+INFERENCE_PROFILES = ("fp32", "int8", "bf16")
+
+# Order of the models in the list of load_all_models
+MODEL_NAMES = ["texify", "layout", "order", "edit", "detection", "ocr"]
+MODEL_LOADERS = {
+    "texify": setup_texify_model,
+    "layout": setup_layout_model,
+    "order": setup_order_model,
+    "edit": load_editing_model,
+    "detection": setup_detection_model,
+    "ocr": setup_recognition_model,
+}
+MODEL_CACHE_MANIFEST = "manifest.json"
+
+
+def profile_model_names() -> list:
+    """
+    Names of the models the inference profile applies to, in MODEL_NAMES order.
+    """
+    names = INFERENCE_PROFILE_MODELS.split(",")
+    return [name for name in MODEL_NAMES if name in names]
+
+_model_list = None
+
+
+def load_models(share_memory: bool = False):
+    """
+    Function to load the models of a serving process.
+
+    With MODEL_CACHE_DIR set, the models are restored lazily from the
+    memory-mapped cache when it has an entry for them, and written to it
+    after a regular load otherwise.
+
+    Args:
+    share_memory (bool): Move the weights to shared memory, so processes
+    started afterwards use them without a copy. Cached models are already
+    shared through the page cache.
+
+    Returns:
+    list: The models, in the order of load_all_models.
+    """
+    if MARKER_ENGINE == "stub":
+        return stub_engine.load_stub_models()
+    if MODEL_CACHE_DIR:
+        cached = open_model_cache()
+        if cached is not None:
+            logger.info(f"Restoring the models from {cached.path}")
+            return cached
+    model_list = apply_inference_profile(load_all_models())
+    if MODEL_CACHE_DIR:
+        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+        save_model_cache(model_list, model_cache_path())
+    if share_memory:
+        share_models(model_list)
+    return model_list
+
+
+def cpu_supports_bf16() -> bool:
+    """
+    Function to check for native bf16 support (AVX512-BF16 or AMX), without
+    which bf16 is emulated and slower than fp32.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def apply_profile(name: str, model, profile: str = INFERENCE_PROFILE):
+    """
+    Function to apply an inference profile to one model.
+
+    Args:
+    name (str): Name of the model in MODEL_NAMES.
+    model: The model, quantized in place.
+    profile (str): One of INFERENCE_PROFILES.
+
+    Returns:
+    The model with the profile applied.
+    """
+    if model is None or profile == "fp32" or name not in profile_model_names():
+        return model
+    if profile == "int8":
+        # Weights of the linear layers are stored as int8, activations are
+        # quantized on the fly
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+    if profile == "bf16":
+        return model.to(torch.bfloat16)
+    raise ValueError(f"Unknown INFERENCE_PROFILE: {profile}")
+
+
+def apply_inference_profile(model_list, profile: str = INFERENCE_PROFILE):
+    """
+    Function to apply the inference profile to the models of load_all_models.
+
+    The quantized profiles are for CPU inference, on other devices the
+    models are left as loaded.
+
+    Returns:
+    list: The models.
+    """
+    if profile == "fp32":
+        return model_list
+    if profile not in INFERENCE_PROFILES:
+        raise ValueError(f"Unknown INFERENCE_PROFILE: {profile}")
+    if settings.TORCH_DEVICE_MODEL != "cpu":
+        logger.warning(f"INFERENCE_PROFILE={profile} only applies on CPU, using the default")
+        return model_list
+    if profile == "bf16" and not cpu_supports_bf16():
+        logger.warning("This CPU has no native bf16 support, bf16 will be slower than fp32")
+    logger.info(f"Applying the {profile} inference profile")
+    return [apply_profile(name, model, profile) for name, model in zip(MODEL_NAMES, model_list)]
+
+
+def share_models(model_list) -> bool:
+    """
+    Function to move the weights of the models to shared memory.
+
+    CUDA tensors are shared through CUDA IPC when they are sent to another
+    process, so this only copies CPU weights. MPS cannot be shared.
+
+    Returns:
+    bool: Whether the weights can be shared.
+    """
+    if settings.TORCH_DEVICE_MODEL == "mps":
+        logger.warning("Models on MPS cannot be shared, every process loads its own copy")
+        return False
+    for model in model_list:
+        if model is None:
+            continue
+        model.share_memory()
+    return True
+
+
+def model_cache_key() -> str:
+    """
+    Function to identify the models a cache entry was saved from.
+
+    The key covers the package versions and the settings that change the
+    loaded models, so an upgrade or a new device never restores stale weights.
+    """
+    versions = {}
+    for package in ("marker-pdf", "surya-ocr", "texify", "torch", "transformers"):
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    options = {
+        "versions": versions,
+        "device": settings.TORCH_DEVICE_MODEL,
+        "dtype": str(settings.MODEL_DTYPE),
+        "texify_dtype": str(settings.TEXIFY_DTYPE),
+        "texify": settings.TEXIFY_MODEL_NAME,
+        "layout": settings.LAYOUT_MODEL_CHECKPOINT,
+        "editor": settings.ENABLE_EDITOR_MODEL,
+        "profile": INFERENCE_PROFILE,
+        "profile_models": INFERENCE_PROFILE_MODELS,
+    }
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def model_cache_path() -> str:
+    return os.path.join(MODEL_CACHE_DIR, model_cache_key())
+
+
+def save_model_cache(model_list, path: str):
+    """
+    Function to write the models to the cache, one torch file per model.
+
+    The files are written to a temporary folder that is renamed into place
+    at the end, so a crash never leaves a partial cache behind.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        names = []
+        for name, model in zip(MODEL_NAMES, model_list):
+            if model is None:
+                names.append(None)
+                continue
+            torch.save(model, os.path.join(tmp_path, f"{name}.pt"))
+            names.append(name)
+        with open(os.path.join(tmp_path, MODEL_CACHE_MANIFEST), "w") as f:
+            json.dump({"models": names, "key": os.path.basename(path)}, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved the models to {path}")
+    except Exception as e:
+        logger.warning(f"Could not save the models to {path}: {str(e)}")
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def restore_model(path: str, name: str):
+    """
+    Function to restore one model from the cache.
+
+    The weights are memory-mapped: restoring only reads the module structure,
+    the pages of the weights are read on first use and shared between all
+    processes mapping the same file through the page cache.
+    """
+    model = torch.load(
+        os.path.join(path, f"{name}.pt"), map_location="cpu", mmap=True, weights_only=False
+    )
+    if settings.TORCH_DEVICE_MODEL != "cpu":
+        model = model.to(settings.TORCH_DEVICE_MODEL)
+    return model
+
+
+class LazyModelList(Sequence):
+    """
+    The models of a cache entry, each restored on first access.
+
+    It can be used wherever the list of load_all_models is expected. Sending
+    it to another process only sends the cache path, so every process maps
+    the same files instead of receiving a copy.
+    """
+
+    def __init__(self, path: str, names: list):
+        self.path = path
+        self.names = names
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        name = self.names[index]
+        if name is None:
+            return None
+        with self._lock:
+            if name not in self._models:
+                start = time.perf_counter()
+                try:
+                    self._models[name] = restore_model(self.path, name)
+                except Exception as e:
+                    logger.warning(f"Could not restore {name} from {self.path}: {str(e)}")
+                    model = MODEL_LOADERS[name]()
+                    if settings.TORCH_DEVICE_MODEL == "cpu":
+                        model = apply_profile(name, model)
+                    self._models[name] = model
+                logger.debug(f"Restored {name} in {time.perf_counter() - start:.2f}s")
+            return self._models[name]
+
+    def __reduce__(self):
+        return (LazyModelList, (self.path, self.names))
+
+    @property
+    def loaded(self) -> list:
+        return list(self._models)
+
+
+def open_model_cache():
+    """
+    Function to open the cache entry of the current models.
+
+    Returns:
+    LazyModelList: The cached models, or None if they are not cached yet.
+    """
+    path = model_cache_path()
+    try:
+        with open(os.path.join(path, MODEL_CACHE_MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return LazyModelList(path, manifest["models"])
+
+
+def set_models(model_list):
+    """
+    Function to install models loaded elsewhere, e.g. by a pre-fork parent.
+    """
+    global _model_list
+    _model_list = model_list
+
+
+def get_models():
+    """
+    Function to return the models of this process, loading them on first use.
+    """
+    global _model_list
+    if _model_list is None:
+        _model_list = load_models()
+    return _model_list
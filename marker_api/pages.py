@@ -0,0 +1,190 @@
+import os
+import re
+import logging
+import pypdfium2
+from marker_api.models import convert_single_pdf
+
+logger = logging.getLogger(__name__)
+
+PAGE_FANOUT_ENABLED = os.environ.get("PAGE_FANOUT_ENABLED", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+PAGE_FANOUT_THRESHOLD = int(os.environ.get("PAGE_FANOUT_THRESHOLD", 100))
+PAGE_FANOUT_CHUNK_PAGES = int(os.environ.get("PAGE_FANOUT_CHUNK_PAGES", 25))
+
+# Image names produced by marker look like "{page}_image_{index}.png"
+IMAGE_NAME_RE = re.compile(r"(?<![\w.])(\d+)(_image_\d+\.\w+)")
+
+
+def get_page_count(pdf_file) -> int:
+    """
+    Function to count the pages of a PDF without rendering it.
+
+    Args:
+    pdf_file: Path, bytes or file-like object of the PDF.
+
+    Returns:
+    int: The number of pages, 0 if the document cannot be opened.
+    """
+    try:
+        doc = pypdfium2.PdfDocument(pdf_file)
+    except Exception as e:
+        logger.warning(f"Could not open PDF to count pages: {str(e)}")
+        return 0
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def split_page_ranges(page_count: int, chunk_pages: int = PAGE_FANOUT_CHUNK_PAGES):
+    """
+    Function to split a document into consecutive page ranges.
+
+    Args:
+    page_count (int): Number of pages in the document.
+    chunk_pages (int): Maximum number of pages per range.
+
+    Returns:
+    list: (start_page, max_pages) tuples in page order.
+    """
+    chunk_pages = max(1, chunk_pages)
+    return [
+        (start, min(chunk_pages, page_count - start))
+        for start in range(0, page_count, chunk_pages)
+    ]
+
+
+def should_fan_out(page_count: int) -> bool:
+    return (
+        PAGE_FANOUT_ENABLED
+        and page_count > PAGE_FANOUT_THRESHOLD
+        and page_count > PAGE_FANOUT_CHUNK_PAGES
+    )
+
+
+def offset_image_names(markdown: str, images: dict, start_page: int):
+    """
+    Function to rename the images of a page range to document page numbers.
+
+    marker numbers pages relative to start_page, so the images of every range
+    would otherwise all start at "0_image_0.png".
+
+    Args:
+    markdown (str): The markdown of the page range.
+    images (dict): Image name to image mapping of the page range.
+    start_page (int): The first page of the range in the document.
+
+    Returns:
+    tuple: The markdown and images with document-level image names.
+    """
+    if not start_page:
+        return markdown, images
+
+    def rename(match):
+        return f"{int(match.group(1)) + start_page}{match.group(2)}"
+
+    markdown = IMAGE_NAME_RE.sub(rename, markdown)
+    images = {IMAGE_NAME_RE.sub(rename, name): image for name, image in images.items()}
+    return markdown, images
+
+
+def convert_page_range(pdf_file, model_list, start_page, max_pages, metadata=None):
+    """
+    Function to convert a page range of a PDF.
+
+    Args:
+    pdf_file: Path, bytes or file-like object of the PDF.
+    model_list: The list of loaded models.
+    start_page (int): The first page to convert.
+    max_pages (int): The number of pages to convert.
+    metadata (dict): Optional metadata such as languages.
+
+    Returns:
+    tuple: The markdown, images and metadata of the range, with image names
+    numbered by document page.
+    """
+    full_text, images, out_meta = convert_single_pdf(
+        pdf_file,
+        model_list,
+        max_pages=max_pages,
+        start_page=start_page,
+        metadata=metadata,
+    )
+    full_text, images = offset_image_names(full_text, images, start_page)
+    out_meta = offset_metadata_pages(out_meta, start_page)
+    return full_text, images, out_meta
+
+
+def offset_metadata_pages(out_meta: dict, start_page: int) -> dict:
+    if not start_page:
+        return out_meta
+    computed_toc = []
+    for entry in out_meta.get("computed_toc") or []:
+        entry = dict(entry)
+        if isinstance(entry.get("page"), int):
+            entry["page"] += start_page
+        computed_toc.append(entry)
+    return {**out_meta, "computed_toc": computed_toc}
+
+
+def _merge_values(merged, value):
+    if isinstance(merged, bool) or isinstance(value, bool):
+        return merged
+    if isinstance(merged, (int, float)) and isinstance(value, (int, float)):
+        return merged + value
+    if isinstance(merged, dict) and isinstance(value, dict):
+        out = dict(merged)
+        for key, item in value.items():
+            out[key] = _merge_values(out[key], item) if key in out else item
+        return out
+    return merged
+
+
+def merge_page_metadata(metadata_parts):
+    """
+    Function to merge the metadata of consecutive page ranges.
+
+    Counters (pages, OCR and block statistics) are summed, the computed table
+    of contents and the page modes are concatenated and everything else is taken from the first
+    range, since it describes the whole document (toc, languages, filetype).
+
+    Args:
+    metadata_parts (list): Metadata dicts in page order.
+
+    Returns:
+    dict: The metadata of the whole document.
+    """
+    merged = {}
+    for part in metadata_parts:
+        for key, value in part.items():
+            if key not in merged:
+                merged[key] = value
+            elif key in ("computed_toc", "page_modes"):
+                merged[key] = list(merged[key] or []) + list(value or [])
+            else:
+                merged[key] = _merge_values(merged[key], value)
+    return merged
+
+
+def stitch_page_ranges(parts):
+    """
+    Function to stitch converted page ranges back into one document.
+
+    Args:
+    parts (list): Dicts with start_page, markdown, images and metadata.
+
+    Returns:
+    tuple: The markdown, images and metadata of the whole document.
+    """
+    parts = sorted(parts, key=lambda part: part["start_page"])
+    markdown = "\n\n".join(
+        part["markdown"].strip() for part in parts if part["markdown"].strip()
+    )
+    images = {}
+    for part in parts:
+        images.update(part["images"])
+    metadata = merge_page_metadata([part["metadata"] for part in parts])
+    return markdown, images, metadata
@@ -0,0 +1,90 @@
+"""
+Serve an ASGI app from several processes sharing one copy of the models.
+
+    python server.py --workers 4
+
+The parent loads the models, moves their weights to shared memory and binds
+the listening socket. Every child receives the models and the socket through
+torch.multiprocessing, like the pool of marker_api.convert, so the weights
+are mapped into every child instead of being loaded again. The parent
+restarts children that die and logs the memory of every child every
+MODEL_MEMORY_REPORT_SECONDS; the PSS column is the real cost of a child.
+"""
+import time
+import signal
+import logging
+import uvicorn
+import torch.multiprocessing as mp
+from marker_api.models import MODEL_MEMORY_REPORT_SECONDS, load_models, set_models
+from marker_api.utils import process_memory
+
+logger = logging.getLogger(__name__)
+
+
+def serve_child(app: str, model_list, sock, host: str, port: int):
+    # The lifespan of the app finds the models through get_models
+    set_models(model_list)
+    config = uvicorn.Config(app, host=host, port=port)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def log_memory(processes):
+    parent = process_memory()
+    logger.info(
+        f"Parent {parent.get('pid')}: RSS {parent.get('rss_mb')} MB, PSS {parent.get('pss_mb')} MB"
+    )
+    for process in processes:
+        memory = process_memory(process.pid)
+        if memory:
+            logger.info(
+                f"Child {process.pid}: RSS {memory['rss_mb']} MB, "
+                f"PSS {memory['pss_mb']} MB, shared {memory['shared_mb']} MB"
+            )
+
+
+def serve(app: str, host: str, port: int, workers: int):
+    """
+    Function to run processes of an app that share the models of this process.
+
+    Args:
+    app (str): Import string of the app, e.g. "server:app".
+    host (str): Host to bind.
+    port (int): Port to bind.
+    workers (int): Number of serving processes.
+    """
+    model_list = load_models(share_memory=True)
+    sock = uvicorn.Config(app, host=host, port=port).bind_socket()
+    context = mp.get_context("spawn")
+    stopping = []
+
+    def start():
+        process = context.Process(
+            target=serve_child, args=(app, model_list, sock, host, port), daemon=False
+        )
+        process.start()
+        return process
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes = [start() for _ in range(workers)]
+    logger.info(f"Serving {app} on {host}:{port} with {workers} processes sharing the models")
+    last_report = time.monotonic()
+    while not stopping:
+        time.sleep(1)
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                logger.warning(f"Process {process.pid} exited with {process.exitcode}, restarting")
+                processes[i] = start()
+        if time.monotonic() - last_report >= MODEL_MEMORY_REPORT_SECONDS:
+            log_memory(processes)
+            last_report = time.monotonic()
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    sock.close()
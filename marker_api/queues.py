@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+from marker_api.celery_worker import (
+    BULK_QUEUE,
+    INTERACTIVE_QUEUE,
+    OVERSIZED_QUEUE,
+    QUEUES,
+    get_redis,
+)
+
+logger = logging.getLogger(__name__)
+
+# Single uploads up to this many pages go to the interactive queue
+ROUTE_INTERACTIVE_PAGES = int(os.environ.get("ROUTE_INTERACTIVE_PAGES", 20))
+# Submissions above either limit go to the oversized queue
+ROUTE_OVERSIZED_PAGES = int(os.environ.get("ROUTE_OVERSIZED_PAGES", 300))
+ROUTE_OVERSIZED_MB = int(os.environ.get("ROUTE_OVERSIZED_MB", 100))
+# Latency targets reported by /queues, e.g. "interactive=30,bulk=3600"
+QUEUE_SLA_SECONDS = os.environ.get("QUEUE_SLA_SECONDS", "interactive=30")
+QUEUE_LATENCY_SAMPLES = int(os.environ.get("QUEUE_LATENCY_SAMPLES", 1000))
+
+LATENCY_KEY = "marker:queue_latency:{queue}"
+COUNTERS_KEY = "marker:queue_counters:{queue}"
+
+
+def parse_queue_values(spec: str, cast=float) -> dict:
+    """
+    Parse a "queue=value,queue=value" setting.
+
+    Args:
+    spec (str): The setting, e.g. "interactive=3,bulk=2,oversized=1".
+    cast: Type of the values.
+
+    Returns:
+    dict: Queue name to value, for known queues only.
+    """
+    values = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        name = name.strip()
+        if name not in QUEUES:
+            logger.warning(f"Ignoring unknown queue {name}")
+            continue
+        values[name] = cast(value.strip())
+    return values
+
+
+def choose_queue(page_counts, sizes, interactive: bool = True) -> str:
+    """
+    Pick the queue of a submission from a cheap pre-inspection.
+
+    Args:
+    page_counts (list): Page count of every file of the submission.
+    sizes (list): Size in bytes of every file.
+    interactive (bool): Whether a client is waiting on the result. Batch
+    jobs are never interactive.
+
+    Returns:
+    str: The queue name.
+    """
+    total_pages = sum(page_counts)
+    total_bytes = sum(sizes)
+    if total_pages > ROUTE_OVERSIZED_PAGES or total_bytes > ROUTE_OVERSIZED_MB * 1024**2:
+        return OVERSIZED_QUEUE
+    if interactive and len(page_counts) == 1 and total_pages <= ROUTE_INTERACTIVE_PAGES:
+        return INTERACTIVE_QUEUE
+    return BULK_QUEUE
+
+
+def record_latency(queue: str, wait: float, run: float, failed: bool = False):
+    """
+    Store a latency sample of a finished task for its queue.
+
+    Samples are kept in a capped Redis list shared by all workers, so /queues
+    reports percentiles over the last QUEUE_LATENCY_SAMPLES tasks of the
+    whole cluster.
+    """
+    sample = json.dumps({"wait": wait, "run": run, "at": time.time()})
+    try:
+        pipe = get_redis().pipeline()
+        pipe.lpush(LATENCY_KEY.format(queue=queue), sample)
+        pipe.ltrim(LATENCY_KEY.format(queue=queue), 0, QUEUE_LATENCY_SAMPLES - 1)
+        pipe.hincrby(COUNTERS_KEY.format(queue=queue), "failed" if failed else "succeeded", 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record latency for queue {queue}: {str(e)}")
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return round(values[index], 3)
+
+
+def summarize(values) -> dict:
+    return {
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+    }
+
+
+def queue_stats() -> dict:
+    """
+    Report depth, throughput and latency percentiles of every queue.
+
+    Returns:
+    dict: Stats keyed by queue name. wait is the time from submission to the
+    start of the task, total adds the run time.
+    """
+    client = get_redis()
+    sla = parse_queue_values(QUEUE_SLA_SECONDS)
+    stats = {}
+    for queue in QUEUES:
+        samples = [
+            json.loads(sample)
+            for sample in client.lrange(LATENCY_KEY.format(queue=queue), 0, -1)
+        ]
+        counters = client.hgetall(COUNTERS_KEY.format(queue=queue))
+        waits = [sample["wait"] for sample in samples]
+        totals = [sample["wait"] + sample["run"] for sample in samples]
+        queue_info = {
+            # With the Redis transport a queue is a list named after it
+            "depth": client.llen(queue),
+            "succeeded": int(counters.get(b"succeeded", 0)),
+            "failed": int(counters.get(b"failed", 0)),
+            "samples": len(samples),
+            "wait_seconds": summarize(waits),
+            "run_seconds": summarize([sample["run"] for sample in samples]),
+            "total_seconds": summarize(totals),
+        }
+        if queue in sla:
+            within = sum(1 for total in totals if total <= sla[queue])
+            queue_info["sla_seconds"] = sla[queue]
+            queue_info["within_sla"] = round(within / len(totals), 4) if totals else None
+        stats[queue] = queue_info
+    return stats
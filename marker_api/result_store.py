@@ -0,0 +1,190 @@
+import os
+import json
+import gzip
+import time
+import base64
+import logging
+import threading
+from marker_api.blobstore import BLOB_STORE, LocalBlobStore, S3BlobStore
+
+logger = logging.getLogger(__name__)
+
+# zstd needs the zstandard package and falls back to gzip without it
+RESULT_COMPRESSION = os.environ.get("RESULT_COMPRESSION", "zstd")
+RESULT_COMPRESSION_LEVEL = int(os.environ.get("RESULT_COMPRESSION_LEVEL", 3))
+RESULT_TTL_SECONDS = int(os.environ.get("RESULT_TTL_SECONDS", 24 * 3600))
+# Compressed results above this size go to the result blob store, Redis only
+# keeps a pointer
+RESULT_OFFLOAD_KB = int(os.environ.get("RESULT_OFFLOAD_KB", 64))
+RESULT_STORE_DIR = os.environ.get("RESULT_STORE_DIR", "results")
+RESULT_STORE_PREFIX = os.environ.get("RESULT_STORE_PREFIX", "results/")
+RESULT_GC_INTERVAL = int(os.environ.get("RESULT_GC_INTERVAL", 600))
+
+# Marks a task result packed by this module
+ENVELOPE_KEY = "result_store"
+ENVELOPE_VERSION = 1
+
+CODECS = ("zstd", "gzip", "none")
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def resolve_codec(codec: str = RESULT_COMPRESSION) -> str:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown RESULT_COMPRESSION: {codec}")
+    if codec == "zstd" and _zstd() is None:
+        logger.warning("zstandard is not installed, compressing results with gzip")
+        return "gzip"
+    return codec
+
+
+def compress(data: bytes, codec: str, level: int = RESULT_COMPRESSION_LEVEL) -> bytes:
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=level).compress(data)
+    if codec == "gzip":
+        # gzip levels go up to 9, zstd levels up to 22
+        return gzip.compress(data, compresslevel=min(9, max(1, level)))
+    return data
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise RuntimeError(
+                "Result was compressed with zstd. Install zstandard with `pip install zstandard`."
+            )
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    return data
+
+
+class ResultStore:
+    """
+    Compact storage for Celery task results.
+
+    Tasks return a small envelope instead of the raw result: the result is
+    serialized and compressed, kept inline in the envelope when it is small
+    and written to a blob store otherwise, so the Redis result backend only
+    holds a pointer. Results expire after RESULT_TTL_SECONDS, in Redis
+    through result_expires and in the blob store through gc_expired.
+    """
+
+    def __init__(
+        self,
+        codec: str = RESULT_COMPRESSION,
+        level: int = RESULT_COMPRESSION_LEVEL,
+        offload_bytes: int = RESULT_OFFLOAD_KB * 1024,
+        ttl: int = RESULT_TTL_SECONDS,
+    ):
+        self.codec = resolve_codec(codec)
+        self.level = level
+        self.offload_bytes = offload_bytes
+        self.ttl = ttl
+        self._blob_store = None
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+
+    @property
+    def blob_store(self):
+        with self._lock:
+            if self._blob_store is None:
+                # Same backend as the PDF payloads, in a separate location so
+                # results follow their own TTL
+                if BLOB_STORE == "s3":
+                    self._blob_store = S3BlobStore(prefix=RESULT_STORE_PREFIX)
+                else:
+                    self._blob_store = LocalBlobStore(RESULT_STORE_DIR)
+        return self._blob_store
+
+    def pack(self, result) -> dict:
+        """
+        Pack a JSON-serializable result into an envelope for the result backend.
+
+        Args:
+        result: The task result.
+
+        Returns:
+        dict: The envelope, with the compressed result inline or a blob reference.
+        """
+        data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        compressed = compress(data, self.codec, self.level)
+        envelope = {
+            ENVELOPE_KEY: ENVELOPE_VERSION,
+            "codec": self.codec,
+            "size": len(data),
+            "stored": len(compressed),
+        }
+        if len(compressed) > self.offload_bytes:
+            envelope["blob_ref"] = self.blob_store.put_bytes(compressed)
+        else:
+            envelope["data"] = base64.b64encode(compressed).decode("ascii")
+        return envelope
+
+    def unpack(self, value):
+        """
+        Rehydrate a task result. Values that are not envelopes, such as results
+        stored before this module existed, are returned unchanged.
+        """
+        if not is_envelope(value):
+            return value
+        if "blob_ref" in value:
+            try:
+                compressed = self.blob_store.get_bytes(value["blob_ref"])
+            except FileNotFoundError:
+                raise FileNotFoundError(
+                    f"Result {value['blob_ref']} has expired or was removed"
+                )
+        else:
+            compressed = base64.b64decode(value["data"])
+        return json.loads(decompress(compressed, value["codec"]).decode("utf-8"))
+
+    def maybe_gc_expired(self):
+        """
+        Sweep offloaded results older than the TTL, at most once every
+        RESULT_GC_INTERVAL seconds.
+        """
+        now = time.time()
+        if now - self._last_gc < RESULT_GC_INTERVAL:
+            return
+        self._last_gc = now
+        try:
+            removed = self.blob_store.gc_expired(self.ttl)
+            if removed:
+                logger.info(f"Removed {removed} expired results")
+        except Exception as e:
+            logger.warning(f"Result garbage collection failed: {str(e)}")
+
+
+def is_envelope(value) -> bool:
+    return isinstance(value, dict) and value.get(ENVELOPE_KEY) == ENVELOPE_VERSION
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """
+    Return the process-wide result store.
+    """
+    global _result_store
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore()
+    return _result_store
+
+
+def pack_result(result) -> dict:
+    return get_result_store().pack(result)
+
+
+def unpack_result(value):
+    return get_result_store().unpack(value)
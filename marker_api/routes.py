@@ -1,78 +1,201 @@
 import os
 import time
-import base64
-from marker.convert import convert_single_pdf
+from typing import Literal
 from marker.logger import configure_logging
+from marker_api.cache import cached_conversion, get_result_cache, hash_pdf, make_cache_key
+from marker_api.fastpath import conversion_cache_options, convert_pdf
+from marker_api.pages import get_page_count, split_page_ranges, stitch_page_ranges
+from marker_api.image_delivery import encode_images, image_cache_options
 import logging
 
 # Initialize logging
 configure_logging()
 logger = logging.getLogger(__name__)
 
+STREAM_CHUNK_PAGES = int(os.environ.get("STREAM_CHUNK_PAGES", 1))
+# Framing of /convert/stream: newline-delimited JSON or Server-Sent Events
+StreamFormat = Literal["ndjson", "sse"]
+
 
 # Function to parse PDF and return markdown, metadata, and image data
-def parse_pdf_and_return_markdown(pdf_file: bytes, extract_images: bool, model_list):
+def parse_pdf_and_return_markdown(
+    pdf_file,
+    extract_images: bool,
+    model_list,
+    image_format: str = "png",
+    image_quality: int = None,
+    conversion_mode: str = None,
+):
     """
     Function to parse a PDF and extract text and images.
 
     Args:
-    pdf_file (bytes): The content of the PDF file.
+    pdf_file (str | bytes): Path of the spooled PDF file, or its content.
     extract_images (bool): Whether to extract images or not.
+    image_format (str): Output format of the images: png, webp or jpeg.
+    image_quality (int): WebP/JPEG quality or PNG compression level.
+    conversion_mode (str): auto, full or text, see marker_api.fastpath.
 
     Returns
     tuple: A tuple containing the full text, metadata, and image data (if extracted).
     """
     logger.debug("Parsing PDF file")
-    full_text, images, out_meta = convert_single_pdf(pdf_file, model_list)
+    full_text, images, out_meta = convert_pdf(pdf_file, model_list, conversion_mode)
     logger.debug(f"Images extracted: {list(images.keys())}")
     image_data = {}
     if extract_images:
-        for i, (filename, image) in enumerate(images.items()):
-            logger.debug(f"Processing image {filename}")
-
-            # Save image as PNG
-            image.save(filename, "PNG")
-
-            # Read the saved image file as bytes
-            with open(filename, "rb") as f:
-                image_bytes = f.read()
-
-            # Convert image to base64
-            image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-            image_data[f"{filename}"] = image_base64
-
-            # Remove the temporary image file
-            os.remove(filename)
+        # Encoded in memory: nothing touches the working directory, so
+        # concurrent requests cannot collide on names like 0_image_0.png
+        full_text, image_data = encode_images(
+            full_text, images, image_format, image_quality
+        )
 
     return full_text, out_meta, image_data
 
 
 # Function to process a single PDF file
-def process_pdf_file(file_content: bytes, filename: str, model_list):
+def process_pdf_file(
+    file_content,
+    filename: str,
+    model_list,
+    pdf_digest: str = None,
+    extract_images: bool = True,
+    image_format: str = "png",
+    image_quality: int = None,
+    conversion_mode: str = None,
+):
     """
     Function to process a single PDF file.
 
     Args:
-    file_content (bytes): The content of the PDF file.
+    file_content (str | bytes): Path of the spooled PDF file, or its content.
     filename (str): The name of the PDF file.
     model_list: The list of loaded models.
+    pdf_digest (str): SHA-256 of the file, computed from the content if omitted.
+    extract_images (bool): Whether to encode the extracted images.
+    image_format (str): Output format of the images: png, webp or jpeg.
+    image_quality (int): WebP/JPEG quality or PNG compression level.
+    conversion_mode (str): auto, full or text, see marker_api.fastpath.
 
     Returns:
     dict: A dictionary containing the filename, markdown text, metadata, image data, status, and processing time.
     """
     entry_time = time.time()
     logger.info(f"Entry time for {filename}: {entry_time}")
-    markdown_text, metadata, image_data = parse_pdf_and_return_markdown(
-        file_content, extract_images=True, model_list=model_list
-    )
+
+    def convert():
+        markdown_text, metadata, image_data = parse_pdf_and_return_markdown(
+            file_content,
+            extract_images=extract_images,
+            model_list=model_list,
+            image_format=image_format,
+            image_quality=image_quality,
+            conversion_mode=conversion_mode,
+        )
+        return {"markdown": markdown_text, "metadata": metadata, "images": image_data}
+
+    if pdf_digest is None:
+        pdf_digest = hash_pdf(file_content)
+    options = {
+        "extract_images": extract_images,
+        **image_cache_options(image_format, image_quality),
+        **conversion_cache_options(conversion_mode),
+    }
+    result, cached = cached_conversion(pdf_digest, options, convert)
     completion_time = time.time()
     logger.info(f"Model processes complete time for {filename}: {completion_time}")
     time_difference = completion_time - entry_time
     return {
         "filename": filename,
-        "markdown": markdown_text,
-        "metadata": metadata,
-        "images": image_data,
+        "markdown": result["markdown"],
+        "metadata": result["metadata"],
+        "images": result["images"],
         "status": "ok",
         "time": time_difference,
+        "cached": cached,
+    }
+
+
+# Function to convert a PDF page range by page range, for streaming responses
+def stream_pdf_file(
+    file_content,
+    filename: str,
+    model_list,
+    pdf_digest: str = None,
+    chunk_pages: int = STREAM_CHUNK_PAGES,
+    conversion_mode: str = None,
+):
+    """
+    Function to convert a PDF and yield each page range as soon as it is done.
+
+    Every range is converted on its own, so cross-page cleanup (headers and
+    footers) only sees chunk_pages pages at a time.
+
+    Args:
+    file_content (str | bytes): Path of the spooled PDF file, or its content.
+    filename (str): The name of the PDF file.
+    model_list: The list of loaded models.
+    pdf_digest (str): SHA-256 of the file, computed from the content if omitted.
+    chunk_pages (int): Number of pages converted and sent per frame.
+    conversion_mode (str): auto, full or text, see marker_api.fastpath.
+
+    Yields:
+    dict: "page" frames with the markdown and images of a page range, then
+    one "metadata" frame for the whole document.
+    """
+    entry_time = time.time()
+    logger.info(f"Entry time for streamed {filename}: {entry_time}")
+    cache = get_result_cache()
+    cache_key = make_cache_key(
+        pdf_digest or hash_pdf(file_content),
+        {
+            "extract_images": True,
+            "stream_chunk_pages": chunk_pages,
+            **conversion_cache_options(conversion_mode),
+        },
+    )
+    cached = cache.get(cache_key) if cache else None
+
+    if cached is not None:
+        parts = cached["parts"]
+        for part in parts:
+            yield page_frame(part)
+    else:
+        parts = []
+        page_count = get_page_count(file_content)
+        for start_page, max_pages in split_page_ranges(page_count, chunk_pages):
+            markdown_text, images, out_meta = convert_pdf(
+                file_content, model_list, conversion_mode, start_page, max_pages
+            )
+            markdown_text, image_data = encode_images(markdown_text, images)
+            part = {
+                "start_page": start_page,
+                "page_count": max_pages,
+                "markdown": markdown_text,
+                "images": image_data,
+                "metadata": out_meta,
+            }
+            parts.append(part)
+            yield page_frame(part)
+        if cache is not None:
+            cache.put(cache_key, {"parts": parts})
+
+    _, _, metadata = stitch_page_ranges(parts)
+    yield {
+        "type": "metadata",
+        "filename": filename,
+        "metadata": metadata,
+        "status": "ok",
+        "time": time.time() - entry_time,
+        "cached": cached is not None,
+    }
+
+
+def page_frame(part: dict) -> dict:
+    return {
+        "type": "page",
+        "page": part["start_page"],
+        "pages": part["page_count"],
+        "markdown": part["markdown"],
+        "images": part["images"],
     }
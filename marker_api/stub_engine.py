@@ -0,0 +1,147 @@
+"""
+A stand-in for the marker conversion engine, for load tests of the serving
+layer without models.
+
+    MARKER_ENGINE=stub python server.py
+
+With MARKER_ENGINE=stub, marker_api.models loads no models and its
+convert_single_pdf is the one of this module: it reads the real page count
+of the PDF, waits STUB_SECONDS_PER_PAGE per page and returns markdown, images
+and metadata shaped like those of marker.convert.convert_single_pdf, with
+STUB_CHARS_PER_PAGE characters and STUB_IMAGES_PER_PAGE images per page.
+Everything is derived from the content of the PDF, so the same file always
+takes the same time and yields the same output, and the result cache,
+fan-out, batching and streaming behave as with the real engine.
+"""
+import os
+import time
+import random
+import hashlib
+import logging
+import pypdfium2 as pdfium
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Mean conversion time of one page, about a GPU conversion of a text page
+STUB_SECONDS_PER_PAGE = float(os.environ.get("STUB_SECONDS_PER_PAGE", 0.5))
+# Relative spread of the time of a page, e.g. 0.2 for +-20%
+STUB_JITTER = float(os.environ.get("STUB_JITTER", 0.2))
+STUB_CHARS_PER_PAGE = int(os.environ.get("STUB_CHARS_PER_PAGE", 2000))
+STUB_IMAGES_PER_PAGE = float(os.environ.get("STUB_IMAGES_PER_PAGE", 0.5))
+# About 120 KB as PNG, like a figure of a scientific paper
+STUB_IMAGE_SIZE = os.environ.get("STUB_IMAGE_SIZE", "400x300")
+
+WORDS = (
+    "certificate of analysis sample batch method result limit unit test value "
+    "report laboratory total moisture protein content date number reference "
+    "standard procedure specification approved quality product"
+).split()
+
+# Stands in for the models of load_all_models, in the same order
+STUB_MODELS = ["texify", "layout", "order", "edit", "detection", "ocr"]
+
+
+def load_stub_models() -> list:
+    logger.warning("MARKER_ENGINE=stub: no models are loaded, conversions are simulated")
+    return list(STUB_MODELS)
+
+
+def read_pdf(fname):
+    """
+    Function to read the content of a path, bytes or file-like PDF.
+    """
+    if isinstance(fname, (bytes, bytearray)):
+        return bytes(fname)
+    if hasattr(fname, "read"):
+        position = fname.tell()
+        content = fname.read()
+        fname.seek(position)
+        return content
+    with open(fname, "rb") as f:
+        return f.read()
+
+
+def page_text(rng: random.Random, page: int, chars: int) -> str:
+    lines = [f"## Page {page + 1}", ""]
+    length = 0
+    while length < chars:
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 16))).capitalize() + "."
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
+def page_image(rng: random.Random) -> Image.Image:
+    width, height = (int(value) for value in STUB_IMAGE_SIZE.split("x"))
+    # Scaled-up noise: smooth areas that compress about like figures do
+    small = (max(1, width // 20), max(1, height // 20))
+    noise = Image.frombytes("RGB", small, rng.randbytes(small[0] * small[1] * 3))
+    return noise.resize((width, height), Image.BILINEAR)
+
+
+def convert_single_pdf(
+    fname,
+    model_lst=None,
+    max_pages: int = None,
+    start_page: int = None,
+    metadata: dict = None,
+    langs: list = None,
+    batch_multiplier: int = 1,
+    ocr_all_pages: bool = False,
+):
+    """
+    Function to simulate marker.convert.convert_single_pdf.
+
+    Args:
+    fname: Path, bytes or file-like object of the PDF.
+    model_lst: Ignored.
+    max_pages (int): The number of pages to convert.
+    start_page (int): The first page to convert.
+    metadata (dict): Optional metadata such as languages.
+
+    Returns:
+    tuple: The markdown, image name to PIL image mapping and metadata.
+    """
+    content = read_pdf(fname)
+    doc = pdfium.PdfDocument(content)
+    try:
+        page_count = len(doc)
+    finally:
+        doc.close()
+    start_page = start_page or 0
+    pages = max(0, page_count - start_page)
+    if max_pages is not None:
+        pages = min(pages, max_pages)
+
+    digest = hashlib.sha256(content).hexdigest()
+    parts = []
+    images = {}
+    seconds = 0.0
+    for page in range(pages):
+        # Seeded per document and page, so page ranges match whole documents
+        rng = random.Random(f"{digest}:{start_page + page}")
+        seconds += STUB_SECONDS_PER_PAGE * (1 + rng.uniform(-STUB_JITTER, STUB_JITTER))
+        text = page_text(rng, start_page + page, STUB_CHARS_PER_PAGE)
+        count = int(STUB_IMAGES_PER_PAGE) + (rng.random() < STUB_IMAGES_PER_PAGE % 1)
+        for index in range(count):
+            # Named relative to start_page, like marker
+            name = f"{page}_image_{index}.png"
+            images[name] = page_image(rng)
+            text += f"\n\n![{name}]({name})"
+        parts.append(text)
+    time.sleep(seconds)
+
+    langs = langs or (metadata or {}).get("languages") or ["English"]
+    out_meta = {
+        "languages": langs,
+        "filetype": "pdf",
+        "pdf_toc": [],
+        "computed_toc": [],
+        "pages": pages,
+        "ocr_stats": {"ocr_pages": 0, "ocr_failed": 0, "ocr_success": 0, "ocr_engine": "none"},
+        "block_stats": {"header_footer": 0, "code": 0, "table": 0, "equations": {}},
+        "postprocess_stats": {"edit": {}},
+        "engine": "stub",
+    }
+    return "\n\n".join(parts), images, out_meta
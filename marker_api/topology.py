@@ -0,0 +1,307 @@
+"""
+Lay out the CPU cores of a machine across model-holding worker processes.
+
+    python -m marker_api.topology --workers 4
+
+Without a layout every worker process starts thread pools as large as the
+machine (torch intra-op threads, OpenMP, pdftext processes), so four
+workers on 16 cores run 64 threads that evict each other from the caches.
+The layout reads the usable cores (affinity mask and cgroup CPU quota) and
+the NUMA nodes, and gives every worker:
+
+- pinned: a disjoint set of cores, within one NUMA node where possible, and
+  as many threads as cores in the set
+- shared: no pinning, the cores divided evenly into thread counts
+- none: the defaults of torch and the libraries
+
+The launcher hands the layout to its workers through the environment
+(WORKER_CPUS, OMP_NUM_THREADS, PDFTEXT_CPU_WORKERS) and every worker
+applies it with apply_layout before loading its models.
+"""
+import os
+import math
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# pinned, shared or none
+WORKER_CPU_LAYOUT = os.environ.get("WORKER_CPU_LAYOUT", "pinned")
+# Processes pdftext may start per worker, 0 to use the threads of the worker
+WORKER_PDFTEXT_PROCESSES = int(os.environ.get("WORKER_PDFTEXT_PROCESSES", 1))
+CPU_LAYOUTS = ("pinned", "shared", "none")
+
+NUMA_PATH = "/sys/devices/system/node"
+
+
+def parse_cpu_list(value: str) -> list:
+    """
+    Function to parse a kernel CPU list such as "0-3,8-11".
+    """
+    cpus = []
+    for part in value.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus) -> str:
+    """
+    Function to format CPUs as a kernel CPU list, the inverse of parse_cpu_list.
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def available_cpus() -> list:
+    """
+    Function to list the CPUs this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cgroup_cpu_limit():
+    """
+    Function to read the CPU quota of the container, in cores.
+
+    Returns:
+    float: The quota, or None without a quota.
+    """
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    # cgroup v1: a quota of -1 means no limit
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return quota / period
+
+
+def numa_nodes(cpus: list = None) -> dict:
+    """
+    Function to group CPUs by NUMA node.
+
+    Args:
+    cpus (list): The CPUs to group, by default the available ones.
+
+    Returns:
+    dict: The CPUs of every node that has some of them, all CPUs under node 0
+    on machines without NUMA information.
+    """
+    cpus = available_cpus() if cpus is None else cpus
+    nodes = {}
+    try:
+        entries = sorted(
+            int(name[4:]) for name in os.listdir(NUMA_PATH) if name[4:].isdigit()
+        )
+        for node in entries:
+            with open(os.path.join(NUMA_PATH, f"node{node}", "cpulist")) as f:
+                node_cpus = [cpu for cpu in parse_cpu_list(f.read()) if cpu in cpus]
+            if node_cpus:
+                nodes[node] = node_cpus
+    except (OSError, ValueError):
+        nodes = {}
+    assigned = {cpu for node_cpus in nodes.values() for cpu in node_cpus}
+    if not nodes or assigned != set(cpus):
+        return {0: list(cpus)}
+    return nodes
+
+
+def usable_cpus() -> list:
+    """
+    Function to list the CPUs the workers should use.
+
+    With a CPU quota below the number of available CPUs, only as many CPUs as
+    the quota allows are used: more threads than that only wait for their
+    share of the quota. The CPUs are taken node by node.
+    """
+    cpus = available_cpus()
+    limit = cgroup_cpu_limit()
+    if limit is None or limit >= len(cpus):
+        return cpus
+    count = max(1, math.floor(limit))
+    ordered = [cpu for node_cpus in numa_nodes(cpus).values() for cpu in node_cpus]
+    return sorted(ordered[:count])
+
+
+def split_workers(workers: int, nodes: dict) -> dict:
+    """
+    Function to split workers across NUMA nodes in proportion to their CPUs,
+    by largest remainder like assign_queues.
+    """
+    total = sum(len(cpus) for cpus in nodes.values())
+    shares = {node: workers * len(cpus) / total for node, cpus in nodes.items()}
+    counts = {node: int(share) for node, share in shares.items()}
+    remainders = sorted(nodes, key=lambda node: shares[node] - counts[node], reverse=True)
+    for node in remainders[: workers - sum(counts.values())]:
+        counts[node] += 1
+    return counts
+
+
+def plan_layout(workers: int, layout: str = WORKER_CPU_LAYOUT, cpus: list = None) -> list:
+    """
+    Function to plan the CPUs and threads of every worker process.
+
+    Args:
+    workers (int): Number of worker processes.
+    layout (str): One of CPU_LAYOUTS.
+    cpus (list): The CPUs to lay out, by default usable_cpus.
+
+    Returns:
+    list: One slot per worker, a dict with the CPUs (None when not pinned),
+    the NUMA node and the number of threads, or None for the none layout.
+    """
+    if layout not in CPU_LAYOUTS:
+        raise ValueError(f"Unknown WORKER_CPU_LAYOUT: {layout}")
+    if workers <= 0:
+        return []
+    if layout == "none":
+        return [None] * workers
+    cpus = usable_cpus() if cpus is None else cpus
+    if layout == "shared":
+        threads = max(1, len(cpus) // workers)
+        return [{"cpus": None, "node": None, "threads": threads} for _ in range(workers)]
+
+    nodes = numa_nodes(cpus)
+    slots = []
+    for node, count in split_workers(workers, nodes).items():
+        node_cpus = nodes[node]
+        for i in range(count):
+            if count <= len(node_cpus):
+                # Contiguous blocks, the first workers get the leftover CPUs
+                size, extra = divmod(len(node_cpus), count)
+                start = i * size + min(i, extra)
+                worker_cpus = node_cpus[start : start + size + (1 if i < extra else 0)]
+            else:
+                # More workers than CPUs, workers share single CPUs
+                worker_cpus = [node_cpus[i % len(node_cpus)]]
+            slots.append({"cpus": worker_cpus, "node": node, "threads": len(worker_cpus)})
+    return slots
+
+
+def worker_env(slot) -> dict:
+    """
+    Function to build the environment that hands a slot to a worker process.
+    """
+    if slot is None:
+        return {}
+    threads = str(slot["threads"])
+    pdftext = WORKER_PDFTEXT_PROCESSES or slot["threads"]
+    env = {
+        "OMP_NUM_THREADS": threads,
+        "MKL_NUM_THREADS": threads,
+        "PDFTEXT_CPU_WORKERS": str(min(pdftext, slot["threads"])),
+        # Surya would start a process pool of its own for postprocessing
+        "IN_STREAMLIT": "true",
+    }
+    if slot["cpus"] is not None:
+        env["WORKER_CPUS"] = format_cpu_list(slot["cpus"])
+    return env
+
+
+def apply_layout(slot=None):
+    """
+    Function to apply a slot to the current process.
+
+    Args:
+    slot (dict): The slot, by default the one handed over by worker_env.
+    """
+    if slot is None:
+        cpus = os.environ.get("WORKER_CPUS")
+        threads = os.environ.get("OMP_NUM_THREADS")
+        if not cpus and not threads:
+            return
+        slot = {
+            "cpus": parse_cpu_list(cpus) if cpus else None,
+            "threads": int(threads) if threads else None,
+        }
+    else:
+        # Libraries imported after this point read their settings from here
+        os.environ.update(worker_env(slot))
+
+    if slot["cpus"] and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, slot["cpus"])
+        except OSError as e:
+            logger.warning(f"Could not pin to CPUs {format_cpu_list(slot['cpus'])}: {str(e)}")
+    if slot["threads"]:
+        import torch
+
+        torch.set_num_threads(slot["threads"])
+        try:
+            torch.set_num_interop_threads(min(2, slot["threads"]))
+        except RuntimeError:
+            # Only possible before the first parallel operation
+            pass
+        try:
+            from marker.settings import settings
+
+            settings.PDFTEXT_CPU_WORKERS = int(
+                os.environ.get("PDFTEXT_CPU_WORKERS", settings.PDFTEXT_CPU_WORKERS)
+            )
+        except ImportError:
+            pass
+    logger.info(f"Worker layout: {describe_slot(slot)}")
+
+
+def describe_slot(slot) -> str:
+    if slot is None:
+        return "library defaults"
+    cpus = "any CPU" if not slot.get("cpus") else f"CPUs {format_cpu_list(slot['cpus'])}"
+    node = f" (node {slot['node']})" if slot.get("node") is not None else ""
+    return f"{cpus}{node}, {slot['threads']} threads"
+
+
+def describe_layout(layout: str, slots: list) -> str:
+    """
+    Function to describe the machine and a layout, one line per worker.
+    """
+    cpus = available_cpus()
+    limit = cgroup_cpu_limit()
+    nodes = numa_nodes(cpus)
+    lines = [
+        f"{len(cpus)} CPUs available, "
+        f"CPU quota {f'{limit:g} cores' if limit else 'none'}, "
+        f"{len(nodes)} NUMA node(s): "
+        + "; ".join(f"node {node}: {format_cpu_list(c)}" for node, c in nodes.items()),
+        f"Layout {layout} for {len(slots)} worker(s):",
+    ]
+    for index, slot in enumerate(slots):
+        lines.append(f"  worker {index}: {describe_slot(slot)}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the CPU layout of worker processes.")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--layout", default=WORKER_CPU_LAYOUT, choices=CPU_LAYOUTS)
+    args = parser.parse_args()
+    print(describe_layout(args.layout, plan_layout(args.workers, args.layout)))
+
+
+if __name__ == "__main__":
+    main()
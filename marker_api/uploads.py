@@ -0,0 +1,228 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import List
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR", "spool")
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_KB", 1024)) * 1024
+UPLOAD_MAX_REQUEST_BYTES = int(os.environ.get("UPLOAD_MAX_REQUEST_MB", 1024)) * 1024**2
+UPLOAD_MAX_INFLIGHT_BYTES = int(os.environ.get("UPLOAD_MAX_INFLIGHT_MB", 4096)) * 1024**2
+UPLOAD_RETRY_AFTER = int(os.environ.get("UPLOAD_RETRY_AFTER", 10))
+# Boundaries and part headers of a multipart body on top of the file bytes
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadBudget:
+    """
+    Global budget of upload bytes held by requests that are in flight.
+
+    Bytes are reserved while an upload is spooled and stay reserved until the
+    request that owns the spool file is done with it.
+    """
+
+    def __init__(self, max_bytes: int = UPLOAD_MAX_INFLIGHT_BYTES):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+
+    def reserve(self, size: int):
+        # Single event loop, so no lock is needed between check and update
+        if self.in_flight + size > self.max_bytes:
+            raise budget_exceeded()
+        self.in_flight += size
+
+    def release(self, size: int):
+        self.in_flight = max(0, self.in_flight - size)
+
+
+upload_budget = UploadBudget()
+
+
+def too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail="Upload exceeds the request size limit")
+
+
+def budget_exceeded() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many uploads in flight, retry later",
+        headers={"Retry-After": str(UPLOAD_RETRY_AFTER)},
+    )
+
+
+class UploadLimitMiddleware:
+    """
+    Enforce the upload limits while the body of a multipart request arrives.
+
+    Starlette reads the whole multipart body before a route runs, so the
+    limits are checked here rather than in the route:
+
+    - A Content-Length above UPLOAD_MAX_REQUEST_MB is rejected with HTTP 413
+      before any of the body is read.
+    - The body is reserved in the in-flight budget UPLOAD_MAX_INFLIGHT_MB,
+      up front when its length is declared and as it arrives otherwise, and
+      released when the response is sent; a full budget is HTTP 503 with
+      Retry-After.
+    - A body that grows past the request limit, e.g. a chunked one, is cut
+      off with HTTP 413 while it is received.
+
+    spooled_uploads checks the size of every file again once it is parsed.
+    """
+
+    def __init__(self, app, max_request_bytes: int = UPLOAD_MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_body_bytes = max_request_bytes + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        declared = content_length(scope)
+        reserved = 0
+        try:
+            if declared is not None:
+                if declared > self.max_body_bytes:
+                    raise too_large()
+                upload_budget.reserve(declared)
+                reserved = declared
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, e.status_code, e.headers)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received, reserved
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise too_large()
+                if received > reserved:
+                    upload_budget.reserve(received - reserved)
+                    reserved = received
+            return message
+
+        try:
+            await self.app(scope, receive_limited, send)
+        finally:
+            upload_budget.release(reserved)
+
+
+def is_multipart(scope) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"content-type":
+            return value.lower().startswith(b"multipart/form-data")
+    return False
+
+
+def content_length(scope):
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class SpooledUpload:
+    """
+    An upload written to the spool directory.
+
+    Attributes:
+    filename (str): The client filename.
+    path (str): Path of the spooled file, handed to the converter as-is.
+    sha256 (str): Digest computed while the upload was written.
+    size (int): Size in bytes.
+    """
+
+    def __init__(self, filename: str, path: str, sha256: str, size: int):
+        self.filename = filename
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def spool_upload(upload: UploadFile, request_limit: int = UPLOAD_MAX_REQUEST_BYTES):
+    """
+    Stream an upload to the spool directory in fixed-size chunks.
+
+    Args:
+    upload (UploadFile): The uploaded file.
+    request_limit (int): Bytes this upload may still use of the request limit.
+
+    Returns:
+    SpooledUpload: The spooled file.
+    """
+    if upload.size is not None and upload.size > request_limit:
+        raise too_large()
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}.pdf")
+    sha256 = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > request_limit:
+                    raise too_large()
+                sha256.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return SpooledUpload(upload.filename, path, sha256.hexdigest(), size)
+
+
+@asynccontextmanager
+async def spooled_uploads(uploads: List[UploadFile]):
+    """
+    Spool the uploads of a request and remove them when the request is done.
+
+    Raises HTTP 413 when the files of the request exceed UPLOAD_MAX_REQUEST_MB.
+    The in-flight budget covers the whole request body and is held by
+    UploadLimitMiddleware, which also rejects oversized bodies before they
+    are read.
+
+    Args:
+    uploads (List[UploadFile]): The uploaded files.
+
+    Yields:
+    List[SpooledUpload]: The spooled files, in upload order.
+    """
+    spooled = []
+    total = 0
+    try:
+        for upload in uploads:
+            item = await spool_upload(upload, UPLOAD_MAX_REQUEST_BYTES - total)
+            spooled.append(item)
+            total += item.size
+            # The upload buffer is no longer needed once it is on disk
+            await upload.close()
+        yield spooled
+    finally:
+        for item in spooled:
+            item.remove()
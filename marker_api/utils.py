@@ -1,3 +1,4 @@
+import os
 import base64
 import torch
 from enum import Enum
@@ -41,36 +42,163 @@ def process_image_to_base64(image: Image.Image, filename: str) -> str:
         return ""
 
 
+def _read_cgroup_value(path: str):
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except (OSError, ValueError):
+        return None
+    if not value.isdigit():
+        # "max" in cgroup v2 means no limit
+        return None
+    return int(value)
+
+
+def get_system_memory():
+    """
+    Function to get the total and available system RAM, in MB.
+
+    Inside a container the cgroup memory limit is taken into account, so the
+    numbers match what the processes of this container can actually use.
+
+    Returns:
+    tuple: Total and available RAM in MB.
+    """
+    total = available = None
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = {
+                line.split(":")[0]: int(line.split()[1]) * 1024 for line in f if line.strip()
+            }
+        total = meminfo["MemTotal"]
+        available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+    except (OSError, KeyError, ValueError, IndexError):
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        total = os.sysconf("SC_PHYS_PAGES") * page_size
+        available = os.sysconf("SC_AVPHYS_PAGES") * page_size
+
+    # cgroup v2, then v1
+    limit = _read_cgroup_value("/sys/fs/cgroup/memory.max")
+    usage = _read_cgroup_value("/sys/fs/cgroup/memory.current")
+    if limit is None:
+        limit = _read_cgroup_value("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+        usage = _read_cgroup_value("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    if limit is not None and limit < total:
+        total = limit
+        if usage is not None:
+            available = min(available, max(0, limit - usage))
+    return total // (1024**2), available // (1024**2)
+
+
+def get_gpu_memory(index: int = 0):
+    """
+    Function to get the total and free VRAM of a GPU, in MB.
+
+    Returns:
+    tuple: Total and free VRAM in MB.
+    """
+    # Initialize NVML to access GPU memory info
+    pynvml.nvmlInit()
+    try:
+        handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+        mem_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+        return mem_info.total // (1024**2), mem_info.free // (1024**2)
+    finally:
+        pynvml.nvmlShutdown()
+
+
 def get_ram_available():
     """
     Function to get VRAM/RAM availability on device
 
     Used to set the number of workers
 
+    Returns:
+    tuple: The device type and the free VRAM on GPU, or the available system
+    RAM on CPU, in MB.
     """
 
     if torch.cuda.is_available():
-        # Initialize NVML to access GPU memory info
-        pynvml.nvmlInit()
+        _, ram_available = get_gpu_memory()
+        return DeviceType.GPU, ram_available
 
-        # Get handle for the first GPU
-        handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+    else:
+        _, ram_available = get_system_memory()
+        return DeviceType.CPU, ram_available
 
-        # Get memory info
-        mem_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
 
-        # Calculate available VRAM in MB
-        ram_available = mem_info.free // (1024**2)  # Convert bytes to MB
+def process_memory(pid: int = None) -> dict:
+    """
+    Function to report the memory of a process, in MB.
 
-        # Cleanup NVML
-        pynvml.nvmlShutdown()
+    RSS counts shared weights in full in every process. PSS splits shared
+    pages between the processes using them, so the PSS of all processes adds
+    up to their real usage.
 
-        return DeviceType.GPU, ram_available
+    Args:
+    pid (int): The process, this process by default.
 
-    else:
-        # For CPU, use torch's built-in method to get total RAM available
-        ram_available = torch.cuda.memory_reserved() // (1024**2)  # Convert bytes to MB
-        return DeviceType.CPU, ram_available
+    Returns:
+    dict: rss_mb, pss_mb and shared_mb, or an empty dict if the process is gone.
+    """
+    pid = pid or os.getpid()
+    values = {}
+    for path in (f"/proc/{pid}/smaps_rollup", f"/proc/{pid}/status"):
+        try:
+            with open(path) as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "VmRSS"):
+                        values[name] = int(value.split()[0]) / 1024
+            break
+        except (OSError, ValueError):
+            continue
+    if not values:
+        return {}
+    return {
+        "pid": pid,
+        "rss_mb": round(values.get("Rss", values.get("VmRSS", 0)), 1),
+        "pss_mb": round(values["Pss"], 1) if "Pss" in values else None,
+        "shared_mb": round(values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0), 1),
+    }
+
+
+def child_pids(pid: int = None) -> list:
+    """
+    Function to list the child processes of a process.
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def get_memory_info() -> dict:
+    """
+    Function to report the memory of this machine, for capacity reports.
+
+    Returns:
+    dict: The device, total and available RAM and, on GPU, VRAM in MB.
+    """
+    ram_total, ram_available = get_system_memory()
+    info = {
+        "device": DeviceType.CPU.value,
+        "ram_total_mb": ram_total,
+        "ram_available_mb": ram_available,
+    }
+    if torch.cuda.is_available():
+        try:
+            vram_total, vram_available = get_gpu_memory()
+            info.update(
+                device=DeviceType.GPU.value,
+                vram_total_mb=vram_total,
+                vram_available_mb=vram_available,
+            )
+        except Exception as e:
+            logger.warning(f"Could not read GPU memory: {str(e)}")
+    return info
 
 
 # # Example usage:
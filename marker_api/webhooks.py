@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from celery import states
+from marker_api.celery_worker import REDIS_URL, get_redis
+from marker_api.result_store import RESULT_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Run the dispatcher inside the distributed server, or only with
+# `python -m marker_api.webhooks`
+WEBHOOKS_ENABLED = os.environ.get("WEBHOOKS_ENABLED", "true").lower() == "true"
+# Notifications to the same endpoint are sent together, up to this many...
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 50))
+# ...waiting at most this long for more
+WEBHOOK_BATCH_WINDOW = float(os.environ.get("WEBHOOK_BATCH_WINDOW", 0.5))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", 6))
+# Retries wait this long, doubled after every attempt
+WEBHOOK_BACKOFF_SECONDS = float(os.environ.get("WEBHOOK_BACKOFF_SECONDS", 1))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.environ.get("WEBHOOK_BACKOFF_MAX_SECONDS", 60))
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get("WEBHOOK_TIMEOUT_SECONDS", 10))
+WEBHOOK_CONNECTIONS = int(os.environ.get("WEBHOOK_CONNECTIONS", 100))
+WEBHOOK_CONNECTIONS_PER_HOST = int(os.environ.get("WEBHOOK_CONNECTIONS_PER_HOST", 10))
+
+# Callback of a task, set at submission
+CALLBACK_KEY = "marker:callback:{task_id}"
+# Notifications waiting for the dispatcher
+WEBHOOK_QUEUE_KEY = "marker:webhooks"
+# Notifications given up on after WEBHOOK_MAX_ATTEMPTS
+WEBHOOK_FAILED_KEY = "marker:webhooks:failed"
+WEBHOOK_FAILED_MAX = 1000
+
+# Client errors that are worth retrying
+RETRY_STATUSES = {408, 425, 429}
+
+
+def register_callback(task_id: str, url: str, per_file: bool = False):
+    """
+    Register the callback URL of a task before it is submitted.
+
+    Args:
+    task_id (str): The task or batch task id.
+    url (str): The URL notifications are posted to.
+    per_file (bool): Also notify every finished file of a batch.
+    """
+    key = CALLBACK_KEY.format(task_id=task_id)
+    pipe = get_redis().pipeline()
+    pipe.hset(key, mapping={"url": url, "per_file": int(per_file)})
+    pipe.expire(key, RESULT_TTL_SECONDS)
+    pipe.execute()
+
+
+def _enqueue(url: str, event: dict):
+    get_redis().rpush(WEBHOOK_QUEUE_KEY, json.dumps({"url": url, "event": event}))
+
+
+def queue_task_callback(task_id: str, state: str):
+    """
+    Queue the completion or failure notification of a task with a callback.
+    """
+    if state not in states.READY_STATES:
+        return
+    try:
+        url = get_redis().hget(CALLBACK_KEY.format(task_id=task_id), "url")
+        if url is None:
+            return
+        _enqueue(
+            url.decode(),
+            {
+                "type": "task",
+                "task_id": task_id,
+                "state": state,
+                "status": "Success" if state == states.SUCCESS else "Error",
+                "time": time.time(),
+            },
+        )
+    except Exception as e:
+        logger.warning(f"Could not queue the callback of task {task_id}: {str(e)}")
+
+
+def queue_file_callback(batch_id: str, entry: dict):
+    """
+    Queue the notification of a finished file of a batch, if its callback
+    asked for them.
+
+    Args:
+    batch_id (str): Task id of the batch.
+    entry (dict): Index, filename, status and cursor of the file.
+    """
+    try:
+        callback = get_redis().hgetall(CALLBACK_KEY.format(task_id=batch_id))
+        if not callback or callback.get(b"per_file") != b"1":
+            return
+        _enqueue(
+            callback[b"url"].decode(),
+            {"type": "file", "task_id": batch_id, "time": time.time(), **entry},
+        )
+    except Exception as e:
+        logger.warning(f"Could not queue the file callback of batch {batch_id}: {str(e)}")
+
+
+class WebhookDispatcher:
+    """
+    Deliver notifications over HTTP POST.
+
+    Notifications for the same URL are collected for up to batch_window
+    seconds and posted together as {"events": [...]}, through one pooled
+    session. Failed deliveries are retried with exponential backoff and
+    jitter; after max_attempts, on_failure is called with the URL and events.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = WEBHOOK_BATCH_SIZE,
+        batch_window: float = WEBHOOK_BATCH_WINDOW,
+        max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+        backoff: float = WEBHOOK_BACKOFF_SECONDS,
+        backoff_max: float = WEBHOOK_BACKOFF_MAX_SECONDS,
+        timeout: float = WEBHOOK_TIMEOUT_SECONDS,
+        connections: int = WEBHOOK_CONNECTIONS,
+        connections_per_host: int = WEBHOOK_CONNECTIONS_PER_HOST,
+        on_failure=None,
+    ):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.on_failure = on_failure
+        self.stats = {"delivered": 0, "requests": 0, "retries": 0, "failed": 0}
+        self._session = None
+        self._pending = {}
+        self._timers = {}
+        self._deliveries = set()
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.connections, limit_per_host=self.connections_per_host
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def close(self):
+        """
+        Send what is still pending, wait for the deliveries and close the session.
+        """
+        for url in list(self._pending):
+            self._flush(url)
+        while self._deliveries:
+            await asyncio.gather(*list(self._deliveries), return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def submit(self, url: str, event: dict):
+        """
+        Queue a notification, it is posted with the next batch for its URL.
+        """
+        events = self._pending.setdefault(url, [])
+        events.append(event)
+        if len(events) >= self.batch_size:
+            self._flush(url)
+        elif url not in self._timers:
+            self._timers[url] = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush, url
+            )
+
+    def _flush(self, url: str):
+        timer = self._timers.pop(url, None)
+        if timer is not None:
+            timer.cancel()
+        events = self._pending.pop(url, None)
+        if not events:
+            return
+        delivery = asyncio.create_task(self.deliver(url, events))
+        self._deliveries.add(delivery)
+        delivery.add_done_callback(self._deliveries.discard)
+
+    def retry_delay(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def deliver(self, url: str, events: list) -> bool:
+        """
+        Post a batch of notifications, retrying until max_attempts.
+
+        Returns:
+        bool: Whether the receiver accepted the batch.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self.stats["requests"] += 1
+            retry = True
+            try:
+                async with self._session.post(url, json={"events": events}) as response:
+                    if response.status < 300:
+                        self.stats["delivered"] += len(events)
+                        return True
+                    retry = response.status >= 500 or response.status in RETRY_STATUSES
+                    error = f"HTTP {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            if not retry or attempt == self.max_attempts:
+                break
+            self.stats["retries"] += 1
+            logger.debug(f"Callback to {url} failed ({error}), retry {attempt}")
+            await asyncio.sleep(self.retry_delay(attempt))
+
+        self.stats["failed"] += len(events)
+        logger.warning(f"Giving up on {len(events)} notifications to {url}: {error}")
+        if self.on_failure is not None:
+            self.on_failure(url, events)
+        return False
+
+
+def store_failed(url: str, events: list):
+    try:
+        client = get_redis()
+        client.lpush(WEBHOOK_FAILED_KEY, json.dumps({"url": url, "events": events}))
+        client.ltrim(WEBHOOK_FAILED_KEY, 0, WEBHOOK_FAILED_MAX - 1)
+    except Exception as e:
+        logger.warning(f"Could not store failed notifications: {str(e)}")
+
+
+async def run_dispatcher():
+    """
+    Deliver the notifications queued by the workers until cancelled.
+
+    Several servers can run a dispatcher, every notification is taken by one.
+    """
+    import redis.asyncio as aioredis
+
+    client = aioredis.Redis.from_url(REDIS_URL)
+    async with WebhookDispatcher(on_failure=store_failed) as dispatcher:
+        logger.info("Webhook dispatcher started")
+        try:
+            while True:
+                try:
+                    item = await client.blpop([WEBHOOK_QUEUE_KEY], timeout=1)
+                except Exception as e:
+                    logger.warning(f"Could not read notifications: {str(e)}")
+                    await asyncio.sleep(1)
+                    continue
+                if item is None:
+                    continue
+                notification = json.loads(item[1])
+                dispatcher.submit(notification["url"], notification["event"])
+        finally:
+            await client.aclose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_dispatcher())
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import threading
+from marker_api.celery_worker import QUEUES, get_redis
+from marker_api.queues import LATENCY_KEY
+from marker_api.utils import child_pids, get_memory_info, process_memory
+
+logger = logging.getLogger(__name__)
+
+WORKER_HEARTBEAT_SECONDS = float(os.environ.get("WORKER_HEARTBEAT_SECONDS", 5))
+# Workers without a heartbeat for this long are dropped from the registry
+WORKER_HEARTBEAT_TIMEOUT = float(
+    os.environ.get("WORKER_HEARTBEAT_TIMEOUT", 3 * WORKER_HEARTBEAT_SECONDS)
+)
+# How often the server refreshes its copy of the registry
+WORKER_REGISTRY_REFRESH = float(os.environ.get("WORKER_REGISTRY_REFRESH", 2))
+# Window of the recent throughput reported by /capacity
+THROUGHPUT_WINDOW_SECONDS = int(os.environ.get("THROUGHPUT_WINDOW_SECONDS", 300))
+
+# Worker hostname to its last heartbeat
+WORKERS_KEY = "marker:workers"
+# Pid of every process running tasks of a worker to its task state
+WORKER_SLOTS_KEY = "marker:worker_slots:{hostname}"
+
+# Tasks finished by this process, reported with its slot
+_slot_counters = {"tasks_done": 0, "tasks_failed": 0}
+_slot_lock = threading.Lock()
+
+
+def write_slot(hostname: str, task_id: str = None, task_name: str = None):
+    """
+    Function to publish the task state of the current process.
+
+    Tasks run in the children of the prefork pool (or in the worker itself
+    with the solo pool), not in the process that sends the heartbeat, so
+    every process writes its own slot under the worker hostname.
+    """
+    with _slot_lock:
+        slot = {
+            "pid": os.getpid(),
+            "task_id": task_id,
+            "task_name": task_name,
+            "task_started": time.time() if task_id else None,
+            **_slot_counters,
+        }
+    try:
+        get_redis().hset(
+            WORKER_SLOTS_KEY.format(hostname=hostname), str(slot["pid"]), json.dumps(slot)
+        )
+    except Exception as e:
+        logger.warning(f"Could not publish the task state of {hostname}: {str(e)}")
+
+
+def record_task_started(hostname: str, task_id: str, task_name: str):
+    write_slot(hostname, task_id, task_name)
+
+
+def record_task_finished(hostname: str, failed: bool = False):
+    with _slot_lock:
+        _slot_counters["tasks_done"] += 1
+        _slot_counters["tasks_failed"] += int(failed)
+    write_slot(hostname)
+
+
+def merge_slots(worker: dict, slots: list) -> dict:
+    """
+    Function to add the task state of the processes of a worker to its
+    heartbeat. The worker is busy when all its processes run a task.
+    """
+    running = [slot for slot in slots if slot.get("task_id")]
+    concurrency = worker.get("concurrency") or 1
+    worker["active"] = len(running)
+    worker["status"] = "busy" if len(running) >= concurrency else "idle"
+    worker["tasks"] = [
+        {key: slot[key] for key in ("pid", "task_id", "task_name", "task_started")}
+        for slot in running
+    ]
+    worker["tasks_done"] = sum(slot.get("tasks_done", 0) for slot in slots)
+    worker["tasks_failed"] = sum(slot.get("tasks_failed", 0) for slot in slots)
+    return worker
+
+
+class WorkerHeartbeat:
+    """
+    Heartbeat of one Celery worker.
+
+    A background thread in the main process of the worker writes its
+    liveness, concurrency and memory to Redis every WORKER_HEARTBEAT_SECONDS.
+    The processes running the tasks publish busy and idle themselves (see
+    write_slot), the heartbeat drops the slots of processes that are gone.
+    """
+
+    def __init__(self, hostname: str, queues: list, concurrency: int = 1):
+        self.hostname = hostname
+        self.queues = queues
+        self.concurrency = concurrency
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def state(self) -> dict:
+        state = {
+            "hostname": self.hostname,
+            "pid": os.getpid(),
+            "queues": self.queues,
+            "concurrency": self.concurrency,
+            "started_at": self.started_at,
+        }
+        state["memory"] = get_memory_info()
+        # With the prefork pool the children run the tasks; with shared
+        # models their PSS is far below their RSS
+        pid = os.getpid()
+        state["processes"] = [
+            memory for memory in map(process_memory, [pid] + child_pids(pid)) if memory
+        ]
+        state["heartbeat"] = time.time()
+        return state
+
+    def beat(self):
+        try:
+            client = get_redis()
+            client.hset(WORKERS_KEY, self.hostname, json.dumps(self.state()))
+            # Slots of children replaced by the pool, e.g. after a crash
+            pid = os.getpid()
+            alive = {str(p) for p in [pid] + child_pids(pid)}
+            slots_key = WORKER_SLOTS_KEY.format(hostname=self.hostname)
+            gone = [p for p in client.hkeys(slots_key) if _text(p) not in alive]
+            if gone:
+                client.hdel(slots_key, *gone)
+        except Exception as e:
+            logger.warning(f"Could not send the heartbeat of {self.hostname}: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(WORKER_HEARTBEAT_SECONDS):
+            self.beat()
+
+    def start(self):
+        self.beat()
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            get_redis().hdel(WORKERS_KEY, self.hostname)
+            get_redis().delete(WORKER_SLOTS_KEY.format(hostname=self.hostname))
+        except Exception as e:
+            logger.warning(f"Could not unregister {self.hostname}: {str(e)}")
+
+
+heartbeat = None
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def start_heartbeat(hostname: str = None, queues: list = None, concurrency: int = 1):
+    global heartbeat
+    if heartbeat is None:
+        heartbeat = WorkerHeartbeat(
+            hostname or socket.gethostname(), queues or QUEUES, concurrency
+        )
+        heartbeat.start()
+    return heartbeat
+
+
+def stop_heartbeat():
+    global heartbeat
+    if heartbeat is not None:
+        heartbeat.stop()
+        heartbeat = None
+
+
+def recent_throughput(client, window: int = THROUGHPUT_WINDOW_SECONDS) -> dict:
+    """
+    Tasks finished per minute over the last window seconds, per queue.
+
+    Counted from the latency samples of marker_api.queues, so it is
+    accurate as long as a queue finishes fewer than QUEUE_LATENCY_SAMPLES
+    tasks per window.
+    """
+    since = time.time() - window
+    throughput = {}
+    for queue in QUEUES:
+        finished = 0
+        for sample in client.lrange(LATENCY_KEY.format(queue=queue), 0, -1):
+            sample = json.loads(sample)
+            finished_at = sample["at"]
+            if finished_at < since:
+                # Samples are newest first
+                break
+            finished += 1
+        throughput[queue] = round(finished * 60 / window, 2)
+    return throughput
+
+
+class WorkerRegistry:
+    """
+    The server's view of the workers, refreshed in the background.
+
+    Requests read the last snapshot instead of broadcasting to the workers,
+    so /health and /capacity cost no more than a dictionary lookup.
+    """
+
+    def __init__(self, refresh: float = WORKER_REGISTRY_REFRESH):
+        self.refresh_interval = refresh
+        self.workers = []
+        self.queues = {}
+        self.throughput = {}
+        self.updated_at = None
+
+    def refresh(self):
+        client = get_redis()
+        now = time.time()
+        workers, stale = [], []
+        for hostname, raw in client.hgetall(WORKERS_KEY).items():
+            worker = json.loads(raw)
+            if now - worker["heartbeat"] > WORKER_HEARTBEAT_TIMEOUT:
+                stale.append(hostname)
+            else:
+                workers.append(worker)
+        if stale:
+            client.hdel(WORKERS_KEY, *stale)
+            client.delete(*[WORKER_SLOTS_KEY.format(hostname=_text(h)) for h in stale])
+        pipe = client.pipeline()
+        for worker in workers:
+            pipe.hvals(WORKER_SLOTS_KEY.format(hostname=worker["hostname"]))
+        for worker, slots in zip(workers, pipe.execute()):
+            merge_slots(worker, [json.loads(slot) for slot in slots])
+        pipe = client.pipeline()
+        for queue in QUEUES:
+            # With the Redis transport a queue is a list named after it
+            pipe.llen(queue)
+        self.queues = dict(zip(QUEUES, pipe.execute()))
+        self.throughput = recent_throughput(client)
+        self.workers = sorted(workers, key=lambda worker: worker["hostname"])
+        self.updated_at = now
+
+    async def run(self):
+        """
+        Refresh the registry until cancelled.
+        """
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.warning(f"Could not refresh the worker registry: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    @property
+    def worker_count(self) -> int:
+        return len(self.workers)
+
+    def capacity(self) -> dict:
+        """
+        Report busy and idle workers, queue depths, throughput and memory.
+
+        Returns:
+        dict: The capacity of the cluster, as of the last refresh.
+        """
+        busy = sum(1 for worker in self.workers if worker["status"] == "busy")
+        slots = sum(worker.get("concurrency") or 1 for worker in self.workers)
+        active = sum(worker.get("active", 0) for worker in self.workers)
+        memory = {}
+        for field in ("ram_available_mb", "vram_available_mb"):
+            values = [w["memory"][field] for w in self.workers if field in w["memory"]]
+            if values:
+                # The tightest worker decides whether another task fits
+                memory[f"min_{field}"] = min(values)
+        return {
+            "updated_at": self.updated_at,
+            "workers": {
+                "total": len(self.workers),
+                "busy": busy,
+                "idle": len(self.workers) - busy,
+                "slots": slots,
+                "active_tasks": active,
+            },
+            "queues": {
+                queue: {
+                    "depth": depth,
+                    "finished_per_minute": self.throughput.get(queue),
+                    "consumers": sum(
+                        1 for worker in self.workers if queue in worker["queues"]
+                    ),
+                }
+                for queue, depth in self.queues.items()
+            },
+            "throughput_window_seconds": THROUGHPUT_WINDOW_SECONDS,
+            "memory": memory,
+            "worker_details": self.workers,
+        }
+
+
+registry = WorkerRegistry()
@@ -1,24 +1,40 @@
 import os
+import json
 import asyncio
 import argparse
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
-import concurrent.futures
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import AsyncExitStack
+from typing import List, Optional
 from marker.logger import configure_logging  # Import logging configuration
-from marker.models import load_all_models  # Import function to load models
+from marker_api.models import get_models  # Import function to load models
 from marker_api.routes import (
     process_pdf_file,
+    stream_pdf_file,
 )
 from marker_api.utils import print_markerapi_text_art
+from marker_api.admission import inference_executor
+from marker_api.cache import get_result_cache
+from marker_api.fastpath import ConversionMode
+from marker_api.pages import get_page_count
+from marker_api.routes import STREAM_CHUNK_PAGES, StreamFormat
+from marker_api.image_delivery import (
+    ImageFormat,
+    ImageMode,
+    deliver_images,
+    image_response,
+    zip_response,
+)
+from marker_api.uploads import UploadLimitMiddleware, spooled_uploads
 from contextlib import asynccontextmanager
 import logging
 import gradio as gr
 from marker_api.model.schema import (
-    BatchConversionResponse,
     ConversionResponse,
     HealthResponse,
     ServerType,
+    SimpleBatchConversionResponse,
 )
 from marker_api.demo import demo_ui
 
@@ -36,13 +52,18 @@ async def lifespan(app: FastAPI):
     global model_list
     logger.debug("--------------------- Loading OCR Model -----------------------")
     print_markerapi_text_art()
-    model_list = load_all_models()
+    # Models preloaded by a pre-fork parent are shared, see marker_api.prefork
+    model_list = get_models()
     yield
 
 
 # Initialize FastAPI app
 app = FastAPI(lifespan=lifespan)
 
+# Upload limits are enforced while the body arrives, before form parsing;
+# added first so that CORS also wraps its responses
+app.add_middleware(UploadLimitMiddleware)
+
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
     CORSMiddleware,
@@ -63,39 +84,193 @@ def server():
     return HealthResponse(message="Welcome to Marker-api", type=ServerType.simple)
 
 
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Endpoint to report result cache hit/miss counters.
+    """
+    cache = get_result_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+
+@app.get("/queue")
+def queue_stats():
+    """
+    Endpoint to report the inference queue: depth, pages in flight and wait times.
+    """
+    return inference_executor.stats()
+
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness endpoint for load balancers, 503 while the inference queue is full.
+    """
+    stats = inference_executor.stats()
+    if stats["saturated"]:
+        return JSONResponse(
+            status_code=503,
+            content=stats,
+            headers={"Retry-After": str(inference_executor.retry_after())},
+        )
+    return stats
+
+
+# Endpoint to serve images of the output store
+@app.get("/images/{key}")
+def get_image(
+    key: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Endpoint to download an extracted image, with ETag and Range support.
+    """
+    return image_response(key, range_header, if_none_match)
+
+
 # Endpoint to convert a single PDF to markdown
 @app.post("/convert", response_model=ConversionResponse)
-async def convert_pdf_to_markdown(pdf_file: UploadFile):
+async def convert_pdf_to_markdown(
+    pdf_file: UploadFile,
+    image_mode: ImageMode = "inline",
+    image_format: ImageFormat = "png",
+    image_quality: Optional[int] = Query(None, ge=0, le=100),
+    conversion_mode: Optional[ConversionMode] = None,
+):
     """
     Endpoint to convert a single PDF to markdown.
+
+    Images are returned inline as base64 (image_mode=inline), as URLs served by
+    /images (url), in a zip archive with the markdown (zip) or not at all (none).
+
+    With conversion_mode=auto, pages with a usable text layer skip the models;
+    metadata.page_modes reports the path every page took.
+
+    The conversion runs on the inference executor; when it is at capacity the
+    request is rejected with 429 and Retry-After.
     """
     logger.debug(f"Received file: {pdf_file.filename}")
-    file = await pdf_file.read()
-    response = process_pdf_file(file, pdf_file.filename, model_list)
-    return ConversionResponse(status="Success", result=response)
+    async with spooled_uploads([pdf_file]) as (upload,):
+        pages = await asyncio.to_thread(get_page_count, upload.path)
+        response = await inference_executor.run(
+            pages,
+            process_pdf_file,
+            upload.path,
+            upload.filename,
+            model_list,
+            upload.sha256,
+            image_mode != "none",
+            image_format,
+            image_quality,
+            conversion_mode,
+        )
+    if image_mode == "zip":
+        return zip_response([response], os.path.splitext(upload.filename)[0])
+    return ConversionResponse(status="Success", result=deliver_images(response, image_mode))
+
+
+# Endpoint to stream the markdown of a single PDF page by page
+@app.post("/convert/stream")
+async def convert_pdf_to_markdown_stream(
+    pdf_file: UploadFile,
+    stream_format: StreamFormat = Query("ndjson", alias="format"),
+    conversion_mode: Optional[ConversionMode] = None,
+):
+    """
+    Endpoint to convert a single PDF and stream each page as soon as it is done.
+
+    Every page is sent as a "page" frame with its markdown and images, followed
+    by one "metadata" frame. Frames are newline-delimited JSON, or Server-Sent
+    Events when format=sse.
+    """
+    logger.debug(f"Received file for streaming: {pdf_file.filename}")
+    stack = AsyncExitStack()
+    try:
+        (upload,) = await stack.enter_async_context(spooled_uploads([pdf_file]))
+        page_count = await asyncio.to_thread(get_page_count, upload.path)
+        # Admission is checked before the response starts, so a full server
+        # still answers with a plain 429
+        await stack.enter_async_context(inference_executor.admission(page_count))
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def frames():
+        # The spooled file and the admission must outlive the endpoint, until
+        # the last frame
+        async with stack:
+            pages = stream_pdf_file(
+                upload.path,
+                upload.filename,
+                model_list,
+                pdf_digest=upload.sha256,
+                conversion_mode=conversion_mode,
+            )
+            try:
+                async for frame in inference_executor.iterate(pages, STREAM_CHUNK_PAGES):
+                    yield encode_frame(frame, stream_format)
+            except Exception as e:
+                logger.error(f"Error streaming {upload.filename}: {str(e)}")
+                yield encode_frame({"type": "error", "message": str(e)}, stream_format)
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(frames(), media_type=media_type)
+
+
+def encode_frame(frame: dict, stream_format: StreamFormat) -> str:
+    data = json.dumps(frame, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {frame['type']}\ndata: {data}\n\n"
+    return data + "\n"
 
 
 # Endpoint to convert multiple PDFs to markdown
-@app.post("/batch_convert", response_model=BatchConversionResponse)
-async def convert_pdfs_to_markdown(pdf_files: List[UploadFile] = File(...)):
+@app.post("/batch_convert", response_model=SimpleBatchConversionResponse)
+async def convert_pdfs_to_markdown(
+    pdf_files: List[UploadFile] = File(...),
+    image_mode: ImageMode = "inline",
+    image_format: ImageFormat = "png",
+    image_quality: Optional[int] = Query(None, ge=0, le=100),
+    conversion_mode: Optional[ConversionMode] = None,
+):
     """
     Endpoint to convert multiple PDFs to markdown.
+
+    The files run on the shared inference executor as one flow of the fair
+    queue, so a large batch shares the threads with other requests instead of
+    starving them.
     """
     logger.debug(f"Received {len(pdf_files)} files for batch conversion")
+    flow = object()
 
-    async def process_files(files):
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
-            coroutines = [
-                loop.run_in_executor(
-                    pool, process_pdf_file, await file.read(), file.filename, model_list
-                )
-                for file in files
-            ]
-            return await asyncio.gather(*coroutines)
-
-    responses = await process_files(pdf_files)
-    return BatchConversionResponse(results=responses)
+    async with spooled_uploads(pdf_files) as uploads:
+        page_counts = await asyncio.to_thread(
+            lambda: [get_page_count(upload.path) for upload in uploads]
+        )
+        async with inference_executor.admission(sum(page_counts)):
+            responses = await asyncio.gather(
+                *[
+                    inference_executor.call(
+                        process_pdf_file,
+                        upload.path,
+                        upload.filename,
+                        model_list,
+                        upload.sha256,
+                        image_mode != "none",
+                        image_format,
+                        image_quality,
+                        conversion_mode,
+                        pages=pages,
+                        flow=flow,
+                    )
+                    for upload, pages in zip(uploads, page_counts)
+                ]
+            )
+    if image_mode == "zip":
+        return zip_response(responses, "batch")
+    responses = [deliver_images(response, image_mode) for response in responses]
+    return SimpleBatchConversionResponse(status="Success", results=responses)
 
 
 # Main function to run the server
@@ -103,8 +278,20 @@ def main():
     parser = argparse.ArgumentParser(description="Run the marker-api server.")
     parser.add_argument("--host", default="0.0.0.0", help="Host IP address")
     parser.add_argument("--port", type=int, default=8080, help="Port number")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("SERVER_WORKERS", 1)),
+        help="Serving processes sharing one copy of the models",
+    )
     args = parser.parse_args()
 
+    if args.workers > 1:
+        from marker_api.prefork import serve
+
+        serve("server:app", args.host, args.port, args.workers)
+        return
+
     import uvicorn
 
     uvicorn.run("server:app", host=args.host, port=args.port)
@@ -0,0 +1,305 @@
+"""
+Load test scenarios for the simple and the distributed server.
+
+Run the servers with the stand-in engine (MARKER_ENGINE=stub, see
+marker_api.stub_engine) to load the serving layer without models, then pick
+the user class of the server under test:
+
+    locust -f tests/locustfile.py SimpleServerUser --host http://localhost:8080 \
+        --headless -u 20 -r 5 -t 2m --slo-p95-ms 20000
+
+Besides the per-request statistics of Locust, every scenario reports the
+end-to-end time of a conversion as an "E2E" request: upload to result,
+including polling or streaming. At the end the E2E throughput and latency
+percentiles are printed and checked against the --slo-* options; a breached
+SLO makes locust exit with 1.
+"""
+import os
+import json
+import time
+import random
+import logging
+from locust import HttpUser, between, events, task
+from locust.runners import WorkerRunner
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDF_DIRS = [os.path.join(ROOT, "examples", "data"), os.path.join(ROOT, "input")]
+
+pdf_files = []
+
+
+@events.init_command_line_parser.add_listener
+def add_options(parser):
+    parser.add_argument(
+        "--pdf-dir",
+        action="append",
+        default=None,
+        env_var="LOCUST_PDF_DIR",
+        help="Folder with the PDFs to upload, examples/data and input by default",
+    )
+    parser.add_argument("--batch-size", type=int, default=3, env_var="LOCUST_BATCH_SIZE")
+    parser.add_argument(
+        "--poll-interval", type=float, default=1.0, env_var="LOCUST_POLL_INTERVAL"
+    )
+    parser.add_argument(
+        "--task-timeout", type=float, default=600, env_var="LOCUST_TASK_TIMEOUT"
+    )
+    parser.add_argument(
+        "--slo-p95-ms", type=float, default=0, env_var="LOCUST_SLO_P95_MS",
+        help="Maximum p95 of every E2E scenario, 0 to skip",
+    )
+    parser.add_argument(
+        "--slo-p99-ms", type=float, default=0, env_var="LOCUST_SLO_P99_MS",
+        help="Maximum p99 of every E2E scenario, 0 to skip",
+    )
+    parser.add_argument(
+        "--slo-max-fail-ratio", type=float, default=0.01, env_var="LOCUST_SLO_MAX_FAIL_RATIO",
+        help="Maximum share of failed requests",
+    )
+    parser.add_argument(
+        "--slo-min-rps", type=float, default=0, env_var="LOCUST_SLO_MIN_RPS",
+        help="Minimum E2E conversions per second, 0 to skip",
+    )
+
+
+@events.init.add_listener
+def load_pdf_files(environment, **kwargs):
+    for folder in environment.parsed_options.pdf_dir or PDF_DIRS:
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(".pdf"):
+                with open(os.path.join(folder, name), "rb") as f:
+                    pdf_files.append((name, f.read()))
+    logger.info(f"Loaded {len(pdf_files)} PDF files")
+    if not pdf_files and not isinstance(environment.runner, WorkerRunner):
+        logger.error("No PDF files to upload, check --pdf-dir")
+
+
+class ConversionUser(HttpUser):
+    abstract = True
+    wait_time = between(0.5, 2)
+
+    @property
+    def options(self):
+        return self.environment.parsed_options
+
+    def pick_files(self, count: int = 1) -> list:
+        return random.sample(pdf_files, min(count, len(pdf_files)))
+
+    @staticmethod
+    def succeeded(resp) -> bool:
+        try:
+            return resp.status_code == 200 and resp.json().get("status") == "Success"
+        except ValueError:
+            return False
+
+    def record(self, name: str, start: float, length: int = 0, exception=None):
+        """Report the end-to-end time of a scenario as an E2E request."""
+        self.environment.events.request.fire(
+            request_type="E2E",
+            name=name,
+            response_time=(time.perf_counter() - start) * 1000,
+            response_length=length,
+            exception=exception,
+            context={},
+        )
+
+
+class SimpleServerUser(ConversionUser):
+    """Scenarios of server.py: single, streaming and batch conversions."""
+
+    @task(3)
+    def convert(self):
+        ((name, content),) = self.pick_files()
+        start = time.perf_counter()
+        with self.client.post(
+            "/convert",
+            files={"pdf_file": (name, content, "application/pdf")},
+            catch_response=True,
+        ) as resp:
+            if not self.succeeded(resp):
+                resp.failure(f"{resp.status_code}: {resp.text[:200]}")
+                self.record("convert", start, exception=Exception(resp.status_code))
+                return
+        self.record("convert", start, len(resp.content))
+
+    @task(1)
+    def convert_stream(self):
+        ((name, content),) = self.pick_files()
+        start = time.perf_counter()
+        first_page = None
+        length = 0
+        with self.client.post(
+            "/convert/stream",
+            files={"pdf_file": (name, content, "application/pdf")},
+            stream=True,
+            catch_response=True,
+        ) as resp:
+            if resp.status_code != 200:
+                resp.failure(f"{resp.status_code}: {resp.text[:200]}")
+                self.record("convert/stream", start, exception=Exception(resp.status_code))
+                return
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                length += len(line)
+                frame = json.loads(line)
+                if frame["type"] == "error":
+                    resp.failure(frame.get("message"))
+                    self.record("convert/stream", start, exception=Exception(frame.get("message")))
+                    return
+                if frame["type"] == "page" and first_page is None:
+                    first_page = time.perf_counter()
+                    self.record("convert/stream first page", start)
+        self.record("convert/stream", start, length)
+
+    @task(1)
+    def batch_convert(self):
+        files = [
+            ("pdf_files", (name, content, "application/pdf"))
+            for name, content in self.pick_files(self.options.batch_size)
+        ]
+        start = time.perf_counter()
+        with self.client.post("/batch_convert", files=files, catch_response=True) as resp:
+            if not self.succeeded(resp):
+                resp.failure(f"{resp.status_code}: {resp.text[:200]}")
+                self.record("batch_convert", start, exception=Exception(resp.status_code))
+                return
+        self.record("batch_convert", start, len(resp.content))
+
+
+class DistributedServerUser(ConversionUser):
+    """
+    Scenarios of distributed_server.py: batches through Celery, waited for
+    by polling or by the event stream.
+    """
+
+    def submit_batch(self):
+        files = [
+            ("pdf_files", (name, content, "application/pdf"))
+            for name, content in self.pick_files(self.options.batch_size)
+        ]
+        with self.client.post("/batch_convert", files=files, catch_response=True) as resp:
+            try:
+                task_id = resp.json().get("task_id") if resp.status_code == 200 else None
+            except ValueError:
+                task_id = None
+            if not task_id:
+                resp.failure(f"{resp.status_code}: {resp.text[:200]}")
+            return task_id
+
+    @task(3)
+    def batch_convert_poll(self):
+        start = time.perf_counter()
+        task_id = self.submit_batch()
+        if not task_id:
+            self.record("batch_convert (poll)", start, exception=Exception("Not submitted"))
+            return
+        deadline = time.monotonic() + self.options.task_timeout
+        while time.monotonic() < deadline:
+            with self.client.get(
+                f"/batch_convert/result/{task_id}",
+                name="/batch_convert/result/[task_id]",
+                catch_response=True,
+            ) as resp:
+                if resp.status_code == 202:
+                    # Still processing is a success of the poll itself
+                    resp.success()
+                elif resp.status_code == 200:
+                    self.record("batch_convert (poll)", start, len(resp.content))
+                    return
+                else:
+                    resp.failure(f"{resp.status_code}: {resp.text[:200]}")
+                    self.record("batch_convert (poll)", start, exception=Exception(resp.status_code))
+                    return
+            time.sleep(self.options.poll_interval)
+        self.record("batch_convert (poll)", start, exception=Exception("Timed out"))
+
+    @task(1)
+    def batch_convert_events(self):
+        start = time.perf_counter()
+        task_id = self.submit_batch()
+        if not task_id:
+            self.record("batch_convert (events)", start, exception=Exception("Not submitted"))
+            return
+        state = None
+        with self.client.get(
+            f"/events/{task_id}",
+            name="/events/[task_id]",
+            stream=True,
+            catch_response=True,
+            timeout=self.options.task_timeout,
+        ) as resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: ") :])
+                if event["type"] == "task":
+                    state = event["state"]
+            if state != "SUCCESS":
+                resp.failure(f"Task ended in state {state}")
+                self.record("batch_convert (events)", start, exception=Exception(state))
+                return
+        # The stream ends with the task, the results are read once
+        self.client.get(
+            f"/batch_convert/result/{task_id}", name="/batch_convert/result/[task_id]"
+        )
+        self.record("batch_convert (events)", start)
+
+
+def e2e_entries(environment) -> list:
+    return [
+        entry
+        for (name, method), entry in sorted(environment.stats.entries.items())
+        if method == "E2E"
+    ]
+
+
+@events.quitting.add_listener
+def check_slos(environment, **kwargs):
+    """Print the E2E report and fail the run when an SLO is breached."""
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    options = environment.parsed_options
+    entries = e2e_entries(environment)
+    print(
+        f"{'scenario':<28} {'count':>6} {'fails':>6} {'rps':>7} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    for entry in entries:
+        print(
+            f"{entry.name:<28} {entry.num_requests:>6} {entry.num_failures:>6} "
+            f"{entry.total_rps:>7.2f} {entry.get_response_time_percentile(0.5):>8.0f} "
+            f"{entry.get_response_time_percentile(0.95):>8.0f} "
+            f"{entry.get_response_time_percentile(0.99):>8.0f}"
+        )
+
+    breaches = []
+    for entry in entries:
+        if entry.num_requests == 0:
+            continue
+        p95 = entry.get_response_time_percentile(0.95)
+        p99 = entry.get_response_time_percentile(0.99)
+        if options.slo_p95_ms and p95 > options.slo_p95_ms:
+            breaches.append(f"{entry.name}: p95 {p95:.0f} ms > {options.slo_p95_ms:.0f} ms")
+        if options.slo_p99_ms and p99 > options.slo_p99_ms:
+            breaches.append(f"{entry.name}: p99 {p99:.0f} ms > {options.slo_p99_ms:.0f} ms")
+    fail_ratio = environment.stats.total.fail_ratio
+    if fail_ratio > options.slo_max_fail_ratio:
+        breaches.append(f"failed requests {fail_ratio:.1%} > {options.slo_max_fail_ratio:.1%}")
+    completed = sum(entry.num_requests - entry.num_failures for entry in entries)
+    total = environment.stats.total
+    duration = (total.last_request_timestamp or total.start_time) - total.start_time
+    rps = completed / duration if duration > 0 else 0
+    if options.slo_min_rps and rps < options.slo_min_rps:
+        breaches.append(f"E2E throughput {rps:.2f}/s < {options.slo_min_rps:.2f}/s")
+
+    for breach in breaches:
+        logger.error(f"SLO breached: {breach}")
+    if breaches:
+        environment.process_exit_code = 1
+    else:
+        print(f"All SLOs met, E2E throughput {rps:.2f}/s")
@@ -0,0 +1,73 @@
+"""
+Tests of the admission control and the fair queue of the inference executor.
+
+    python -m pytest tests/test_admission.py
+"""
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Needs the dependencies of marker_api.utils, e.g. torch
+admission = pytest.importorskip("marker_api.admission")
+
+
+def queued_order(executor, submissions) -> list:
+    """Submit (flow, name, pages) jobs without threads and drain the queue."""
+    executor._start = lambda: None
+    for flow, name, pages in submissions:
+        executor.submit(flow, lambda: None, pages=pages).name = name
+    order = []
+    while True:
+        job = executor._next_job()
+        if job is None:
+            return order
+        order.append(job.future.name)
+
+
+def test_large_flow_does_not_starve_small_flow():
+    executor = admission.InferenceExecutor(workers=1, quantum=10)
+    # A 300-page batch is queued first, a 3-page request right behind it
+    submissions = [("batch", f"batch-{i}", 30) for i in range(10)]
+    submissions += [("small", f"small-{i}", 1) for i in range(3)]
+    order = queued_order(executor, submissions)
+
+    assert sorted(order) == sorted(name for _, name, _ in submissions)
+    # The small request is done before the batch gets its first turn
+    assert order.index("small-2") < order.index("batch-0")
+
+
+def test_flows_share_by_pages():
+    executor = admission.InferenceExecutor(workers=1, quantum=10)
+    submissions = []
+    for i in range(6):
+        submissions += [("a", f"a-{i}", 10), ("b", f"b-{i}", 5)]
+    order = queued_order(executor, submissions)
+    # Per round a runs one 10-page job and b two 5-page jobs
+    assert order[:6] == ["a-0", "b-0", "b-1", "a-1", "b-2", "b-3"]
+
+
+def test_over_budget_is_429_with_retry_after():
+    executor = admission.InferenceExecutor(workers=1, max_pages=10, max_queue=4)
+    app = FastAPI()
+
+    @app.post("/convert")
+    async def convert(pages: int):
+        async with executor.admission(pages):
+            await asyncio.sleep(0)
+        return {"status": "Success"}
+
+    client = TestClient(app)
+    # A document larger than the budget is admitted when nothing is in flight
+    assert client.post("/convert", params={"pages": 50}).status_code == 200
+
+    executor.admit(8)
+    resp = client.post("/convert", params={"pages": 5})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= admission.ADMISSION_RETRY_AFTER
+    assert client.post("/convert", params={"pages": 2}).status_code == 200
+    assert executor.stats()["rejected"] == 1
+
+    executor.release(8)
+    assert client.post("/convert", params={"pages": 5}).status_code == 200
+    assert executor.pages_in_flight == 0
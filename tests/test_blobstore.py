@@ -0,0 +1,107 @@
+"""
+Tests of the blob stores: the local store on a temporary folder, the S3
+store against moto or, with TEST_S3_ENDPOINT_URL set, a MinIO endpoint.
+
+    python -m pytest tests/test_blobstore.py
+"""
+import os
+import time
+import hashlib
+import pytest
+from marker_api.blobstore import LocalBlobStore, S3BlobStore, digest_from_ref
+
+PDF = b"%PDF-1.4 test payload"
+DAY = 24 * 3600
+
+
+def test_local_round_trip(tmp_path):
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+    blob_ref = store.put_bytes(PDF)
+    assert digest_from_ref(blob_ref) == hashlib.sha256(PDF).hexdigest()
+    assert store.get_bytes(blob_ref) == PDF
+
+    store.delete(blob_ref)
+    with pytest.raises(FileNotFoundError):
+        store.get_bytes(blob_ref)
+
+
+def test_local_same_file_twice_is_independent(tmp_path):
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+    first = store.put_bytes(PDF)
+    second = store.put_bytes(PDF)
+    assert first != second
+    store.delete(first)
+    assert store.get_bytes(second) == PDF
+
+
+def test_local_old_input_file_survives_gc(tmp_path):
+    # Files of input/ can be older than the TTL, the blob linked to them must
+    # not expire before its task ran
+    source = tmp_path / "old.pdf"
+    source.write_bytes(PDF)
+    old = time.time() - 2 * DAY
+    os.utime(source, (old, old))
+
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+    blob_ref = store.put_file(str(source))
+    assert store.gc_expired(ttl=DAY) == 0
+    assert store.get_bytes(blob_ref) == PDF
+    assert source.read_bytes() == PDF
+
+
+def test_local_gc_removes_expired(tmp_path):
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+    blob_ref = store.put_bytes(PDF)
+    # A negative TTL puts the cutoff in the future, every blob is expired
+    assert store.gc_expired(ttl=-60) == 1
+    with pytest.raises(FileNotFoundError):
+        store.get_bytes(blob_ref)
+
+
+@pytest.fixture
+def s3_store():
+    endpoint_url = os.environ.get("TEST_S3_ENDPOINT_URL")
+    if endpoint_url:
+        boto3 = pytest.importorskip("boto3")
+        bucket = os.environ.get("TEST_S3_BUCKET", "marker-api-test")
+        try:
+            boto3.client("s3", endpoint_url=endpoint_url).create_bucket(Bucket=bucket)
+        except Exception as e:
+            if "BucketAlready" not in str(e):
+                pytest.skip(f"S3 endpoint {endpoint_url} unavailable: {str(e)}")
+        yield S3BlobStore(bucket=bucket, prefix="test/", endpoint_url=endpoint_url)
+        return
+
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket="marker-api-test")
+        yield S3BlobStore(bucket="marker-api-test", prefix="test/", endpoint_url=None)
+
+
+def test_s3_round_trip(s3_store, tmp_path):
+    blob_ref = s3_store.put_bytes(PDF)
+    assert s3_store.get_bytes(blob_ref) == PDF
+    with s3_store.local_path(blob_ref) as path:
+        with open(path, "rb") as f:
+            assert f.read() == PDF
+    assert not os.path.exists(path)
+
+    source = tmp_path / "upload.pdf"
+    source.write_bytes(PDF)
+    file_ref = s3_store.put_file(str(source))
+    assert digest_from_ref(file_ref) == digest_from_ref(blob_ref)
+
+    s3_store.delete(blob_ref)
+    s3_store.delete(file_ref)
+    with pytest.raises(Exception):
+        s3_store.get_bytes(blob_ref)
+
+
+def test_s3_gc_expired(s3_store):
+    s3_store.put_bytes(PDF)
+    assert s3_store.gc_expired(ttl=DAY) == 0
+    assert s3_store.gc_expired(ttl=-60) == 1
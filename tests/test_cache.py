@@ -0,0 +1,77 @@
+"""
+Tests of the two-tier result cache: the memory LRU and the size-capped disk
+tier.
+
+    python -m pytest tests/test_cache.py
+"""
+import os
+import time
+import pytest
+
+# marker_api.cache takes the inference profile from marker_api.models
+cache = pytest.importorskip("marker_api.cache")
+ResultCache = cache.ResultCache
+
+MB = 1024 * 1024
+
+
+def entry(size: int) -> dict:
+    # Serializes to size + 16 bytes of JSON
+    return {"markdown": "x" * size}
+
+
+def make_cache(tmp_path, memory_mb=1, disk_mb=1) -> ResultCache:
+    return ResultCache(str(tmp_path / "cache"), memory_limit_mb=memory_mb, disk_limit_mb=disk_mb)
+
+
+def test_memory_lru_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, memory_mb=1000 / MB, disk_mb=0)
+    cache.put("a", entry(400))
+    cache.put("b", entry(400))
+    # Reading a makes b the least recently used entry
+    assert cache.get("a") == entry(400)
+    cache.put("c", entry(400))
+
+    assert cache.get("b") is None
+    assert cache.get("a") == entry(400)
+    assert cache.get("c") == entry(400)
+    assert cache._memory_bytes <= cache.memory_limit
+
+
+def test_overwrite_does_not_count_twice(tmp_path):
+    cache = make_cache(tmp_path)
+    for _ in range(5):
+        cache.put("a", entry(1000))
+    assert cache._disk_bytes == cache.disk_usage() == len('{"markdown": ""}') + 1000
+    assert cache.counters["evictions"] == 0
+
+
+def test_disk_eviction_removes_oldest_entries(tmp_path):
+    cache = make_cache(tmp_path, memory_mb=0, disk_mb=3000 / MB)
+    for i, key in enumerate(("aa1", "bb2", "cc3")):
+        cache.put(key, entry(900))
+        # mtime decides the eviction order
+        os.utime(cache._disk_path(key), (time.time() - 100 + i, time.time() - 100 + i))
+    cache.put("dd4", entry(900))
+
+    assert cache.counters["evictions"] == 2
+    assert cache.get("aa1") is None and cache.get("bb2") is None
+    assert cache.get("cc3") == entry(900)
+    assert cache.get("dd4") == entry(900)
+    assert cache._disk_bytes == cache.disk_usage() <= cache.disk_limit
+
+
+def test_disk_eviction_skips_files_being_written(tmp_path):
+    cache = make_cache(tmp_path, memory_mb=0, disk_mb=2000 / MB)
+    cache.put("aa1", entry(900))
+    tmp_file = cache._disk_path("bb2") + ".123.tmp"
+    os.makedirs(os.path.dirname(tmp_file), exist_ok=True)
+    with open(tmp_file, "wb") as f:
+        f.write(b"x" * 900)
+    os.utime(tmp_file, (0, 0))
+    cache.put("cc3", entry(900))
+    cache.put("dd4", entry(900))
+
+    assert os.path.exists(tmp_file)
+    assert cache.get("aa1") is None
+    assert cache.get("dd4") == entry(900)
@@ -0,0 +1,150 @@
+"""
+Tests of the digital-text fast path: page classification, runs of model
+pages, the one-pass fallback and the stitched result.
+
+    python -m pytest tests/test_fastpath.py
+"""
+import pytest
+import pypdfium2 as pdfium
+
+# Needs the conversion engine imported by marker_api.fastpath
+fastpath = pytest.importorskip("marker_api.fastpath")
+from marker_api import pages  # noqa: E402
+
+TEXT, FULL = fastpath.TEXT_PAGE, fastpath.FULL_PAGE
+
+
+class FakePage:
+    """A page as extracted by pdftext, with the mode it should get."""
+
+    def __init__(self, pnum: int, usable: bool):
+        self.pnum = pnum
+        self.usable = usable
+        self.blocks = []
+
+
+@pytest.fixture
+def document(tmp_path, monkeypatch):
+    """
+    Build a PDF whose pages have the given modes and stub the engine: model
+    conversions name images relative to start_page, like marker does.
+    """
+    state = {"calls": []}
+
+    def build(page_modes):
+        path = tmp_path / "doc.pdf"
+        doc = pdfium.PdfDocument.new()
+        for _ in page_modes:
+            doc.new_page(612, 792).close()
+        doc.save(str(path))
+        doc.close()
+        state["pages"] = [FakePage(i, mode == TEXT) for i, mode in enumerate(page_modes)]
+        return str(path)
+
+    def get_text_blocks(doc, pdf_file, max_pages=None, start_page=None):
+        start_page = start_page or 0
+        end = len(state["pages"]) if max_pages is None else start_page + max_pages
+        return state["pages"][start_page:end], []
+
+    def convert_single_pdf(pdf_file, model_list, max_pages=None, start_page=None, metadata=None):
+        start_page = start_page or 0
+        count = len(state["pages"]) - start_page if max_pages is None else max_pages
+        state["calls"].append((start_page, count))
+        markdown = "\n\n".join(
+            f"Model page {start_page + i}\n\n![{i}_image_0.png]({i}_image_0.png)"
+            for i in range(count)
+        )
+        images = {f"{i}_image_0.png": f"image of page {start_page + i}" for i in range(count)}
+        return markdown, images, {"pages": count, "computed_toc": [{"title": "x", "page": 0}]}
+
+    def render_text_pages(run_pages, bad_span_ids):
+        return "\n\n".join(f"Text page {page.pnum}" for page in run_pages), 0
+
+    monkeypatch.setattr(fastpath, "find_filetype", lambda pdf_file: "pdf")
+    monkeypatch.setattr(fastpath, "get_length_of_text", lambda pdf_file: 1)
+    monkeypatch.setattr(fastpath, "get_text_blocks", get_text_blocks)
+    monkeypatch.setattr(fastpath, "has_usable_text", lambda page, pdf_page: page.usable)
+    monkeypatch.setattr(fastpath, "filter_header_footer", lambda run_pages: set())
+    monkeypatch.setattr(fastpath, "render_text_pages", render_text_pages)
+    monkeypatch.setattr(fastpath, "replace_langs_with_codes", lambda langs: langs)
+    monkeypatch.setattr(pages, "convert_single_pdf", convert_single_pdf)
+    state["build"] = build
+    return state
+
+
+def test_page_runs():
+    assert fastpath.page_runs([TEXT, TEXT, FULL, TEXT, FULL, FULL]) == [
+        (TEXT, 0, 2), (FULL, 2, 1), (TEXT, 3, 1), (FULL, 4, 2)
+    ]
+    assert fastpath.page_runs([]) == []
+
+
+def test_classify_pages(document):
+    pdf_path = document["build"]([TEXT, FULL, FULL, TEXT])
+    doc = pdfium.PdfDocument(pdf_path)
+    try:
+        assert fastpath.classify_pages(doc, document["pages"][1:], first_page=1) == [
+            FULL, FULL, TEXT
+        ]
+    finally:
+        doc.close()
+
+
+def test_misaligned_full_run_keeps_images_apart(document):
+    # The model run starts at page 2 and is 4 pages long
+    page_modes = [TEXT, TEXT, FULL, FULL, FULL, FULL]
+    pdf_path = document["build"](page_modes)
+    markdown, images, out_meta = fastpath.convert_pdf(pdf_path, None, "auto")
+
+    assert document["calls"] == [(2, 4)]
+    assert out_meta["page_modes"] == page_modes
+    assert out_meta["pages"] == 6
+    assert images == {f"{page}_image_0.png": f"image of page {page}" for page in range(2, 6)}
+    for page in range(2, 6):
+        assert f"Model page {page}\n\n![{page}_image_0.png]({page}_image_0.png)" in markdown
+    assert markdown.index("Text page 1") < markdown.index("Model page 2")
+    assert [entry["page"] for entry in out_meta["computed_toc"]] == [2]
+
+
+def test_runs_of_model_pages_are_stitched_in_order(document):
+    page_modes = [FULL, TEXT, TEXT, FULL, FULL, TEXT]
+    pdf_path = document["build"](page_modes)
+    markdown, images, out_meta = fastpath.convert_pdf(pdf_path, None, "auto")
+
+    assert document["calls"] == [(0, 1), (3, 2)]
+    assert out_meta["page_modes"] == page_modes
+    assert sorted(images) == ["0_image_0.png", "3_image_0.png", "4_image_0.png"]
+    order = ["Model page 0", "Text page 1", "Text page 2", "Model page 3", "Model page 4", "Text page 5"]
+    positions = [markdown.index(text) for text in order]
+    assert positions == sorted(positions)
+
+
+def test_scattered_model_pages_fall_back_to_one_pass(document, monkeypatch):
+    monkeypatch.setattr(fastpath, "FASTPATH_MAX_FULL_RUNS", 2)
+    pdf_path = document["build"]([FULL, TEXT, FULL, TEXT, FULL, TEXT])
+    markdown, images, out_meta = fastpath.convert_pdf(pdf_path, None, "auto")
+
+    assert document["calls"] == [(0, 6)]
+    assert out_meta["page_modes"] == [FULL] * 6
+    assert sorted(images) == [f"{page}_image_0.png" for page in range(6)]
+
+
+def test_text_mode_never_runs_the_models(document):
+    pdf_path = document["build"]([FULL, FULL, TEXT])
+    markdown, images, out_meta = fastpath.convert_pdf(pdf_path, None, "text")
+
+    assert document["calls"] == []
+    assert out_meta["page_modes"] == [TEXT] * 3
+    assert images == {}
+
+
+def test_page_range_of_a_fanned_out_document(document):
+    # A fan-out range converts pages 2-5 of the document in auto mode
+    pdf_path = document["build"]([TEXT, TEXT, TEXT, FULL, FULL, TEXT])
+    markdown, images, out_meta = fastpath.convert_pdf(
+        pdf_path, None, "auto", start_page=2, max_pages=4
+    )
+
+    assert document["calls"] == [(3, 2)]
+    assert out_meta["page_modes"] == [TEXT, FULL, FULL, TEXT]
+    assert sorted(images) == ["3_image_0.png", "4_image_0.png"]
@@ -0,0 +1,37 @@
+"""
+Tests of the zip delivery of conversion results.
+
+    python -m pytest tests/test_image_delivery.py
+"""
+import io
+import base64
+import zipfile
+from marker_api.image_delivery import zip_results
+
+
+def result(filename: str, markdown: str) -> dict:
+    return {
+        "filename": filename,
+        "markdown": markdown,
+        "metadata": {"pages": 1},
+        "images": {"0_image_0.png": base64.b64encode(markdown.encode()).decode()},
+    }
+
+
+def test_documents_with_the_same_name_get_their_own_folder():
+    results = [
+        result("scan.pdf", "first"),
+        result("a/report.pdf", "second"),
+        result("scan.pdf", "third"),
+        result("b/report.pdf", "fourth"),
+        result("SCAN.pdf", "fifth"),
+    ]
+    with zipfile.ZipFile(io.BytesIO(zip_results(results))) as archive:
+        names = archive.namelist()
+        assert len(names) == len(set(names)) == 15
+        assert archive.read("scan/scan.md") == b"first"
+        assert archive.read("report/report.md") == b"second"
+        assert archive.read("scan_3/scan.md") == b"third"
+        assert archive.read("report_4/report.md") == b"fourth"
+        assert archive.read("SCAN_5/SCAN.md") == b"fifth"
+        assert archive.read("scan_3/0_image_0.png") == b"third"
@@ -0,0 +1,83 @@
+"""
+Tests of the page-range fan-out helpers: splitting a document, renaming the
+images of a range and stitching the ranges back together.
+
+    python -m pytest tests/test_pages.py
+"""
+import pytest
+
+# Needs the conversion engine imported by marker_api.models
+pages = pytest.importorskip("marker_api.pages")
+
+
+def fake_convert_single_pdf(pdf_file, model_list, max_pages, start_page, metadata=None):
+    # Like marker: one image per page, named relative to start_page
+    markdown = "\n\n".join(
+        f"Page {start_page + page}\n\n![{page}_image_0.png]({page}_image_0.png)"
+        for page in range(max_pages)
+    )
+    images = {f"{page}_image_0.png": f"image of page {start_page + page}" for page in range(max_pages)}
+    out_meta = {
+        "languages": ["English"],
+        "pages": max_pages,
+        "ocr_stats": {"ocr_pages": 1, "ocr_failed": 0, "ocr_success": 1, "ocr_engine": "surya"},
+        "block_stats": {"header_footer": 2, "code": 0, "table": 1, "equations": {"successful_ocr": 1}},
+        "computed_toc": [{"title": f"Section {start_page}", "page": 0}],
+    }
+    return markdown, images, out_meta
+
+
+def test_split_page_ranges():
+    assert pages.split_page_ranges(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert pages.split_page_ranges(8, 4) == [(0, 4), (4, 4)]
+    assert pages.split_page_ranges(3, 0) == [(0, 1), (1, 1), (2, 1)]
+    assert pages.split_page_ranges(0, 4) == []
+
+
+def test_offset_image_names():
+    markdown = "![0_image_0.png](0_image_0.png) and ![1_image_2.png](1_image_2.png)"
+    images = {"0_image_0.png": "a", "1_image_2.png": "b"}
+    markdown, images = pages.offset_image_names(markdown, images, 25)
+    assert markdown == "![25_image_0.png](25_image_0.png) and ![26_image_2.png](26_image_2.png)"
+    assert images == {"25_image_0.png": "a", "26_image_2.png": "b"}
+
+    # A range longer than its offset: marker numbers pages from 0 in every range
+    names = {f"{page}_image_0.png": page for page in range(4)}
+    _, images = pages.offset_image_names("", names, 2)
+    assert images == {f"{page + 2}_image_0.png": page for page in range(4)}
+
+    # The first range keeps its names, other numbers are left alone
+    assert pages.offset_image_names("![0_image_0.png](0_image_0.png)", {}, 0)[0] == (
+        "![0_image_0.png](0_image_0.png)"
+    )
+    assert pages.offset_image_names("v1.0_image_0.png 2024", {}, 5)[0] == (
+        "v1.0_image_0.png 2024"
+    )
+
+
+def test_stitched_ranges_have_document_names_and_merged_metadata(monkeypatch):
+    monkeypatch.setattr(pages, "convert_single_pdf", fake_convert_single_pdf)
+    parts = []
+    for start_page, max_pages in pages.split_page_ranges(5, 2):
+        markdown, images, out_meta = pages.convert_page_range("doc.pdf", None, start_page, max_pages)
+        parts.append(
+            {"start_page": start_page, "markdown": markdown, "images": images, "metadata": out_meta}
+        )
+
+    # Parts arrive in completion order
+    markdown, images, metadata = pages.stitch_page_ranges(list(reversed(parts)))
+    assert sorted(images) == [f"{page}_image_0.png" for page in range(5)]
+    assert all(images[f"{page}_image_0.png"] == f"image of page {page}" for page in range(5))
+    for page in range(5):
+        assert f"Page {page}\n\n![{page}_image_0.png]({page}_image_0.png)" in markdown
+    assert markdown.index("Page 0") < markdown.index("Page 2") < markdown.index("Page 4")
+
+    assert metadata["pages"] == 5
+    assert metadata["languages"] == ["English"]
+    assert metadata["ocr_stats"] == {
+        "ocr_pages": 3, "ocr_failed": 0, "ocr_success": 3, "ocr_engine": "surya"
+    }
+    assert metadata["block_stats"] == {
+        "header_footer": 6, "code": 0, "table": 3, "equations": {"successful_ocr": 3}
+    }
+    assert [entry["page"] for entry in metadata["computed_toc"]] == [0, 2, 4]
@@ -0,0 +1,70 @@
+"""
+Tests of the upload limits: rejection before the body is read, the in-flight
+budget and spooling.
+
+    python -m pytest tests/test_uploads.py
+"""
+import pytest
+from typing import List
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from marker_api import uploads
+
+LIMIT = 1024**2
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_REQUEST_BYTES", LIMIT)
+    monkeypatch.setattr(uploads, "upload_budget", uploads.UploadBudget(4 * LIMIT))
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/upload")
+    async def upload(pdf_files: List[UploadFile] = File(...)):
+        app.state.calls += 1
+        async with uploads.spooled_uploads(pdf_files) as spooled:
+            return {"sizes": [item.size for item in spooled]}
+
+    app.add_middleware(uploads.UploadLimitMiddleware, max_request_bytes=LIMIT)
+    return app
+
+
+def test_upload_within_limits(app):
+    resp = TestClient(app).post(
+        "/upload", files=[("pdf_files", ("a.pdf", b"x" * 1000)), ("pdf_files", ("b.pdf", b"y"))]
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {"sizes": [1000, 1]}
+    assert uploads.upload_budget.in_flight == 0
+
+
+def test_declared_oversized_body_is_rejected_before_parsing(app):
+    resp = TestClient(app).post(
+        "/upload", files=[("pdf_files", ("a.pdf", b"x" * (2 * LIMIT)))]
+    )
+    assert resp.status_code == 413
+    assert app.state.calls == 0
+
+
+def test_chunked_oversized_body_is_cut_off(app):
+    def body():
+        yield b"--b\r\nContent-Disposition: form-data; name=\"pdf_files\"; filename=\"a.pdf\"\r\n\r\n"
+        for _ in range(4):
+            yield b"x" * LIMIT
+
+    resp = TestClient(app).post(
+        "/upload", content=body(), headers={"Content-Type": "multipart/form-data; boundary=b"}
+    )
+    assert resp.status_code == 413
+    assert app.state.calls == 0
+    assert uploads.upload_budget.in_flight == 0
+
+
+def test_full_budget_is_503_with_retry_after(app):
+    uploads.upload_budget.reserve(4 * LIMIT - 100)
+    resp = TestClient(app).post("/upload", files=[("pdf_files", ("a.pdf", b"x" * 1000))])
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(uploads.UPLOAD_RETRY_AFTER)
+    assert app.state.calls == 0
@@ -0,0 +1,144 @@
+"""
+Tests of the webhook dispatcher against a local stub receiver.
+
+    python -m pytest tests/test_webhooks.py
+"""
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from marker_api.webhooks import WebhookDispatcher
+
+
+class StubReceiver:
+    """An HTTP server recording the notifications posted to it."""
+
+    def __init__(self, statuses=None):
+        # Status of the next responses, 200 once they are used up
+        self.statuses = list(statuses or [])
+        self.requests = []
+        self.lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with receiver.lock:
+                    receiver.requests.append((self.path, json.loads(body)))
+                    status = receiver.statuses.pop(0) if receiver.statuses else 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path="/hook"):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def events(self, path="/hook"):
+        return [event for p, body in self.requests if p == path for event in body["events"]]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def dispatch(notifications, **options):
+    """Submit (url, event) pairs and wait until everything is delivered."""
+    failures = []
+    options.setdefault("backoff", 0.01)
+    options.setdefault("batch_window", 0.05)
+
+    async def run():
+        dispatcher = WebhookDispatcher(
+            on_failure=lambda url, events: failures.append((url, events)), **options
+        )
+        async with dispatcher:
+            for url, event in notifications:
+                dispatcher.submit(url, event)
+        return dispatcher.stats
+
+    return asyncio.run(run()), failures
+
+
+def task_event(i):
+    return {"type": "task", "task_id": f"task-{i}", "state": "SUCCESS"}
+
+
+def test_notifications_to_one_endpoint_are_batched():
+    with StubReceiver() as receiver:
+        stats, failures = dispatch([(receiver.url(), task_event(i)) for i in range(5)])
+    assert len(receiver.requests) == 1
+    assert receiver.events() == [task_event(i) for i in range(5)]
+    assert stats["delivered"] == 5
+    assert not failures
+
+
+def test_batches_are_capped():
+    with StubReceiver() as receiver:
+        dispatch([(receiver.url(), task_event(i)) for i in range(5)], batch_size=2)
+    assert [len(body["events"]) for _, body in receiver.requests] == [2, 2, 1]
+    assert sorted(e["task_id"] for e in receiver.events()) == [f"task-{i}" for i in range(5)]
+
+
+def test_endpoints_are_batched_separately():
+    with StubReceiver() as receiver:
+        dispatch(
+            [
+                (receiver.url("/a"), task_event(0)),
+                (receiver.url("/b"), task_event(1)),
+                (receiver.url("/a"), task_event(2)),
+            ]
+        )
+    assert receiver.events("/a") == [task_event(0), task_event(2)]
+    assert receiver.events("/b") == [task_event(1)]
+
+
+def test_server_errors_are_retried():
+    with StubReceiver(statuses=[503, 500]) as receiver:
+        stats, failures = dispatch([(receiver.url(), task_event(0))])
+    assert len(receiver.requests) == 3
+    assert stats["retries"] == 2
+    assert stats["delivered"] == 1
+    assert not failures
+
+
+@pytest.mark.parametrize("status", [400, 404])
+def test_client_errors_are_not_retried(status):
+    with StubReceiver(statuses=[status]) as receiver:
+        stats, failures = dispatch([(receiver.url(), task_event(0))])
+    assert len(receiver.requests) == 1
+    assert failures == [(receiver.url(), [task_event(0)])]
+    assert stats["failed"] == 1
+
+
+def test_delivery_gives_up_after_max_attempts():
+    with StubReceiver(statuses=[503] * 10) as receiver:
+        stats, failures = dispatch([(receiver.url(), task_event(0))], max_attempts=3)
+    assert len(receiver.requests) == 3
+    assert failures == [(receiver.url(), [task_event(0)])]
+
+
+def test_unreachable_endpoint_fails():
+    with StubReceiver() as receiver:
+        url = receiver.url()
+    stats, failures = dispatch([(url, task_event(0))], max_attempts=2, timeout=1)
+    assert stats["requests"] == 2
+    assert failures == [(url, [task_event(0)])]
+
+
+def test_retry_delay_backs_off():
+    dispatcher = WebhookDispatcher(backoff=1, backoff_max=5)
+    delays = [dispatcher.retry_delay(attempt) for attempt in range(1, 6)]
+    assert 0.5 <= delays[0] <= 1
+    assert 2 <= delays[2] <= 4
+    assert delays[4] <= 5
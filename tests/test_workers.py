@@ -0,0 +1,101 @@
+"""
+Tests of the worker registry against fakeredis: the heartbeat of a worker,
+the task state published by its pool processes and /capacity.
+
+    python -m pytest tests/test_workers.py
+"""
+import json
+import pytest
+from types import SimpleNamespace
+
+fakeredis = pytest.importorskip("fakeredis")
+# Needs the dependencies of marker_api.utils, e.g. torch
+workers = pytest.importorskip("marker_api.workers")
+
+HOSTNAME = "celery@test"
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(workers, "get_redis", lambda: client)
+    monkeypatch.setattr(workers, "_slot_counters", {"tasks_done": 0, "tasks_failed": 0})
+    monkeypatch.setattr(workers, "child_pids", lambda pid: [])
+    monkeypatch.setattr(workers, "process_memory", lambda pid: None)
+    monkeypatch.setattr(workers, "get_memory_info", lambda: {"ram_available_mb": 1024})
+    yield client
+    workers.stop_heartbeat()
+
+
+def task(name: str = "marker_api.celery_tasks.convert_pdf_to_markdown"):
+    return SimpleNamespace(name=name, request=SimpleNamespace(hostname=HOSTNAME))
+
+
+def capacity() -> dict:
+    registry = workers.WorkerRegistry()
+    registry.refresh()
+    return registry.capacity()
+
+
+def test_task_state_makes_worker_busy_and_idle(redis):
+    workers.start_heartbeat(HOSTNAME, ["celery"], concurrency=1)
+    assert capacity()["workers"] == {
+        "total": 1, "busy": 0, "idle": 1, "slots": 1, "active_tasks": 0
+    }
+
+    workers.record_task_started(HOSTNAME, "t1", task().name)
+    report = capacity()
+    assert report["workers"]["busy"] == 1
+    (worker,) = report["worker_details"]
+    assert worker["status"] == "busy"
+    assert worker["tasks"][0]["task_id"] == "t1"
+
+    workers.record_task_finished(HOSTNAME, failed=True)
+    (worker,) = capacity()["worker_details"]
+    assert worker["status"] == "idle"
+    assert (worker["tasks_done"], worker["tasks_failed"]) == (1, 1)
+
+
+def test_celery_signals_publish_task_state(redis):
+    celery_tasks = pytest.importorskip("marker_api.celery_tasks")
+    workers.start_heartbeat(HOSTNAME, ["celery"], concurrency=1)
+    celery_tasks.mark_task_started(task_id="t1", task=task())
+    assert capacity()["workers"]["busy"] == 1
+    celery_tasks.mark_task_finished(task=task(), state="SUCCESS")
+    (worker,) = capacity()["worker_details"]
+    assert (worker["status"], worker["tasks_done"]) == ("idle", 1)
+
+
+def test_prefork_children_report_their_own_tasks(redis, monkeypatch):
+    # Two pool processes of one worker write their slots, the heartbeat of
+    # the main process never sees their tasks
+    workers.start_heartbeat(HOSTNAME, ["celery"], concurrency=2)
+    slots_key = workers.WORKER_SLOTS_KEY.format(hostname=HOSTNAME)
+    for pid, task_id in ((101, "t1"), (102, None)):
+        slot = {"pid": pid, "task_id": task_id, "task_name": "x", "task_started": 0,
+                "tasks_done": 3, "tasks_failed": 0}
+        redis.hset(slots_key, str(pid), json.dumps(slot))
+
+    report = capacity()
+    assert report["workers"]["busy"] == 0
+    assert report["workers"]["active_tasks"] == 1
+    (worker,) = report["worker_details"]
+    assert worker["tasks_done"] == 6
+
+    redis.hset(slots_key, "102", json.dumps({"pid": 102, "task_id": "t2", "task_name": "x",
+                                              "task_started": 0, "tasks_done": 3,
+                                              "tasks_failed": 0}))
+    assert capacity()["workers"]["busy"] == 1
+
+    # The pool replaced child 102, its slot goes with the next beat
+    monkeypatch.setattr(workers, "child_pids", lambda pid: [101])
+    workers.heartbeat.beat()
+    assert set(redis.hkeys(slots_key)) == {b"101"}
+
+
+def test_stopped_worker_leaves_registry(redis):
+    workers.start_heartbeat(HOSTNAME, ["celery"])
+    workers.record_task_started(HOSTNAME, "t1", task().name)
+    workers.stop_heartbeat()
+    assert capacity()["workers"]["total"] == 0
+    assert not redis.exists(workers.WORKER_SLOTS_KEY.format(hostname=HOSTNAME))